@@ -0,0 +1,300 @@
+# async_engine.py
+import asyncio
+import concurrent.futures
+import os
+import time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None # Flag that the async engine is not available
+
+from function import (Counter, encode_image_payload, build_chat_request, resolve_api_url,
+                      lookup_cached_suggestion, handle_name_response, record_failure, describe_processing_error,
+                      fail_cluster_members, collect_image_paths, log_run_settings, plan_clusters, log_run_statistics,
+                      open_run_report, release_endpoint)
+from endpoints import create_endpoint_balancer, route_request
+from backends import create_naming_backend
+from cache import open_result_cache
+from http_client import get_request_timeout
+from journal import mark as mark_journal, open_run_journal
+from metrics import create_stage_metrics, stage_timer
+from payload import describe_payload, get_payload_settings
+from placement import NameRegistry, PlacementTotals
+from ratelimit import (RequestCancelled, THROTTLE_STATUS, RETRYABLE_STATUS, parse_retry_after, backoff_delay,
+                       create_concurrency_controller, get_retry_settings)
+
+
+class _ConnectionStats:
+    """Counts new vs. reused connections through aiohttp's tracing hooks."""
+    def __init__(self):
+        self.requests_sent = 0
+        self.connections_opened = 0
+
+    def trace_config(self):
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            self.requests_sent += 1
+
+        async def on_connection_create_end(session, context, params):
+            self.connections_opened += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        return trace_config
+
+    def summary(self, pool_size):
+        reused = max(0, self.requests_sent - self.connections_opened)
+        reuse_rate = (reused / self.requests_sent * 100) if self.requests_sent else 0.0
+        return (f"连接复用统计：发送请求{self.requests_sent}次，新建连接{self.connections_opened}个，"
+                f"复用连接{reused}次（复用率{reuse_rate:.1f}%），连接池大小{pool_size}")
+
+
+async def _wait_or_stop(delay, stop_event):
+    deadline = asyncio.get_running_loop().time() + delay
+    while not stop_event.is_set():
+        remaining = deadline - asyncio.get_running_loop().time()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(remaining, 0.2))
+    raise RequestCancelled()
+
+
+async def _post_with_retries(http_session, url, headers, data, concurrency_controller, config, stop_event,
+                             output_text_signal_emit, image_name, endpoint_balancer=None):
+    """
+    send_with_retries 的异步版本，返回解析后的 JSON；最终仍失败时抛出 aiohttp 异常。
+    """
+    max_retries, backoff_base, backoff_cap = get_retry_settings(config)
+    attempt = 0
+    while True:
+        if not await concurrency_controller.acquire_async(stop_event):
+            raise RequestCancelled()
+        endpoint = None
+        if endpoint_balancer is not None:
+            endpoint = await endpoint_balancer.acquire_async(stop_event)
+            if endpoint is None:
+                concurrency_controller.release(outcome='neutral')
+                raise RequestCancelled()
+        endpoint_url, endpoint_headers, endpoint_data = route_request(endpoint, url, headers, data)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        retry_after = None
+        released = False
+        try:
+            async with http_session.post(endpoint_url, headers=endpoint_headers, json=endpoint_data) as response:
+                status = response.status
+                latency = loop.time() - started
+                released = True
+                if status in THROTTLE_STATUS:
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    reported_latency, outcome = release_endpoint(endpoint_balancer, endpoint, latency, 'throttled',
+                                                                 retry_after)
+                    concurrency_controller.release(reported_latency, outcome)
+                    if retry_after and outcome == 'throttled':
+                        concurrency_controller.pause(min(retry_after, backoff_cap))
+                elif status in RETRYABLE_STATUS:
+                    concurrency_controller.release(*release_endpoint(endpoint_balancer, endpoint, latency, 'error'))
+                else:
+                    outcome = 'success' if status < 400 else 'neutral'
+                    concurrency_controller.release(*release_endpoint(endpoint_balancer, endpoint, latency, outcome))
+                    concurrency_controller.maybe_report(output_text_signal_emit)
+                    response.raise_for_status()
+                    return await response.json(content_type=None)
+                if attempt >= max_retries:
+                    response.raise_for_status()
+                reason = f"HTTP {status}"
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if not released: # Otherwise the response arrived and only reading its body failed
+                concurrency_controller.release(*release_endpoint(endpoint_balancer, endpoint, None, 'error'))
+            if attempt >= max_retries:
+                raise
+            reason = type(e).__name__
+        except BaseException:
+            if not released:
+                release_endpoint(endpoint_balancer, endpoint, None, 'neutral')
+                concurrency_controller.release(outcome='neutral')
+            raise
+
+        delay = backoff_delay(attempt, backoff_base, backoff_cap, retry_after)
+        if endpoint_balancer is not None and endpoint_balancer.is_multi:
+            delay = min(delay, backoff_base) # Another endpoint can take the retry
+        attempt += 1
+        concurrency_controller.record_retry()
+        where = f"{endpoint.name}: " if endpoint is not None and endpoint_balancer.is_multi else ""
+        output_text_signal_emit(f"请求失败 ({image_name}): {where}{reason}，{delay:.1f}秒后第{attempt}次重试")
+        await _wait_or_stop(delay, stop_event)
+
+
+async def _process_image_async(image_path, members, config, output_text_signal_emit, stop_event, counters,
+                               active_counter, renaming_data_list, result_cache, http_session, cpu_executor,
+                               concurrency_controller, stage_metrics=None, name_registry=None, endpoint_balancer=None,
+                               naming_backend=None):
+    """
+    process_image 的异步版本：压缩与文件操作放到线程池中执行，HTTP 请求在事件循环中等待。
+    """
+    success_counter, failure_counter, num_counter, saved_calls_counter = counters
+    current_original_filename = os.path.basename(image_path)
+    cluster_label = current_original_filename if members else None
+    if stop_event.is_set():
+        return
+
+    loop = asyncio.get_running_loop()
+    active_counter.increment()
+    mark_journal(renaming_data_list, image_path, 'queued')
+    named = False
+    started = time.perf_counter() if stage_metrics is not None else None
+    try:
+        prompt = config['Prompt']
+        payload_settings = get_payload_settings(config)
+
+        cache_key = cached_text = None
+        if naming_backend is not None:
+            # Decoding runs on cpu_executor; its threads together fill one model batch
+            local_name, confidence = await loop.run_in_executor(cpu_executor, naming_backend.suggest, image_path,
+                                                                stage_metrics)
+            if naming_backend.accepts(confidence):
+                output_text_signal_emit(f"{current_original_filename}：本地模型命名为 {local_name}（置信度{confidence:.2f}）")
+                cached_text = local_name
+            else:
+                output_text_signal_emit(f"{current_original_filename}：本地模型置信度{confidence:.2f}（{local_name}），改用远程 API")
+        if cached_text is None:
+            with stage_timer(stage_metrics if result_cache is not None else None, 'hash'):
+                cache_key, cached_text = await loop.run_in_executor(
+                    cpu_executor, lookup_cached_suggestion, image_path, config, result_cache, prompt, payload_settings)
+        if cached_text is not None:
+            response_data = {'choices': [{'message': {'content': cached_text}}]}
+        else:
+            encoded = await loop.run_in_executor(cpu_executor, encode_image_payload, image_path, payload_settings,
+                                                 stage_metrics)
+            output_text_signal_emit(describe_payload(current_original_filename, encoded))
+            headers, data = build_chat_request(config, prompt, encoded.data, encoded.mime_type, encoded.detail)
+            encoded = None
+            # aiohttp has no per-attempt elapsed time, so waits, retries and the body read all count as 'request' here
+            with stage_timer(stage_metrics, 'request'):
+                response_data = await _post_with_retries(http_session, resolve_api_url(config), headers, data,
+                                                         concurrency_controller, config, stop_event,
+                                                         output_text_signal_emit, current_original_filename,
+                                                         endpoint_balancer)
+
+        named = await loop.run_in_executor(
+            cpu_executor, handle_name_response, image_path, response_data, config, output_text_signal_emit,
+            success_counter, failure_counter, num_counter, renaming_data_list,
+            result_cache, cache_key, cached_text is not None, members, saved_calls_counter, stage_metrics, name_registry)
+    except RequestCancelled:
+        return
+    except asyncio.TimeoutError:
+        record_failure(image_path, f"HTTP请求失败 ({current_original_filename}): 请求超时",
+                       output_text_signal_emit, failure_counter, num_counter, renaming_data_list, cluster_label)
+    except aiohttp.ClientError as e:
+        record_failure(image_path, f"HTTP请求失败 ({current_original_filename}): {e}",
+                       output_text_signal_emit, failure_counter, num_counter, renaming_data_list, cluster_label)
+    except Exception as e:
+        record_failure(image_path, describe_processing_error(image_path, e), output_text_signal_emit,
+                       failure_counter, num_counter, renaming_data_list, cluster_label)
+    finally:
+        active_counter.decrement()
+        if started is not None:
+            stage_metrics.observe('total', time.perf_counter() - started)
+
+    if members and not named:
+        fail_cluster_members(image_path, members, output_text_signal_emit, failure_counter, num_counter, renaming_data_list)
+
+
+async def _run_async(clusters, config, output_text_signal_emit, stop_event, counters, active_counter,
+                     renaming_data_list, result_cache, stage_metrics=None, naming_backend=None):
+    concurrency = max(1, int(config.get('Async_concurrency', 200)))
+    connect_timeout, read_timeout = get_request_timeout(config)
+    timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+    connector = aiohttp.TCPConnector(limit=concurrency, keepalive_timeout=60)
+    connection_stats = _ConnectionStats()
+    semaphore = asyncio.Semaphore(concurrency)
+    # The semaphore bounds the number of tasks; the controller adapts how many of them may hit the API at once
+    concurrency_controller = create_concurrency_controller(config, concurrency)
+    endpoint_balancer = create_endpoint_balancer(config)
+    # Decode/resize/base64 is CPU work; keep it off the event loop
+    cpu_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(2, os.cpu_count() or 2))
+    name_registry = NameRegistry()
+    tasks = set()
+
+    async def run_one(image_path, members):
+        try:
+            await _process_image_async(image_path, members, config, output_text_signal_emit, stop_event, counters,
+                                       active_counter, renaming_data_list, result_cache, http_session, cpu_executor,
+                                       concurrency_controller, stage_metrics, name_registry, endpoint_balancer,
+                                       naming_backend)
+        finally:
+            semaphore.release()
+
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         trace_configs=[connection_stats.trace_config()]) as http_session:
+            for image_path, members in clusters:
+                await semaphore.acquire()
+                if stop_event.is_set():
+                    semaphore.release()
+                    output_text_signal_emit("停止信号已接收，正在取消剩余任务...")
+                    break
+                task = asyncio.create_task(run_one(image_path, members))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        cpu_executor.shutdown(wait=True)
+    output_text_signal_emit(concurrency_controller.summary())
+    if endpoint_balancer.is_multi:
+        output_text_signal_emit(endpoint_balancer.summary())
+    output_text_signal_emit(connection_stats.summary(concurrency))
+
+
+def process_images_async(config, output_text_signal_emit, stop_event, active_counter, gui_num_counter):
+    """
+    异步引擎：单个事件循环内用信号量控制并发请求数（Async_concurrency），
+    返回值与 process_images_concurrently 相同。
+    """
+    if aiohttp is None:
+        output_text_signal_emit("错误：异步引擎需要安装 'aiohttp' 库。请运行 'pip install aiohttp'，或改用线程引擎。")
+        return 0, 0, 0, []
+    try:
+        naming_backend = create_naming_backend(config, output_text_signal_emit)
+    except RuntimeError as e:
+        output_text_signal_emit(f"错误：{e}")
+        return 0, 0, 0, []
+
+    image_scan = collect_image_paths(config, output_text_signal_emit)
+    if not image_scan:
+        if naming_backend is not None:
+            naming_backend.close()
+        return 0, 0, 0, []
+
+    success_counter = Counter()
+    failure_counter = Counter()
+    saved_calls_counter = Counter()
+    placement_totals = PlacementTotals()
+    renaming_data_for_excel = open_run_journal(config, output_text_signal_emit, retain_rows=False,
+                                               sinks=(placement_totals, open_run_report(config, output_text_signal_emit)))
+    result_cache = open_result_cache(config, output_text_signal_emit)
+    stage_metrics = create_stage_metrics(config)
+
+    log_run_settings(config, output_text_signal_emit, f"异步引擎并发数: {config.get('Async_concurrency', 200)}")
+    if int(config.get('Batch_size', 1)) > 1:
+        output_text_signal_emit("提示：批量请求模式仅适用于线程池引擎，本次按单张图片请求。")
+    clusters = plan_clusters(image_scan, config, output_text_signal_emit, stop_event)
+
+    try:
+        asyncio.run(_run_async(clusters, config, output_text_signal_emit, stop_event,
+                               (success_counter, failure_counter, gui_num_counter, saved_calls_counter),
+                               active_counter, renaming_data_for_excel, result_cache, stage_metrics, naming_backend))
+    except KeyboardInterrupt:
+        output_text_signal_emit("检测到键盘中断！正在尝试停止...")
+        stop_event.set()
+    if naming_backend is not None:
+        naming_backend.close()
+        output_text_signal_emit(naming_backend.summary())
+
+    renaming_data_for_excel.close()
+    log_run_statistics(config, output_text_signal_emit, saved_calls_counter, result_cache, stage_metrics,
+                       placement_totals)
+    return image_scan.count, success_counter.get_value(), failure_counter.get_value(), renaming_data_for_excel
@@ -0,0 +1,249 @@
+# backends.py
+"""
+命名后端：remote 为原有的 chat-completions 请求；local 用本机 CPU 上的 ONNX 图像模型（CLIP 式零样本或
+标签分类器）离线命名；hybrid 先用本地模型，置信度低于 Hybrid_min_confidence 的图片再请求远程 API。
+
+The local model is one ONNX file with an NCHW float image input plus a UTF-8 label file (one name per line):
+- with Local_label_embeddings_path (a .npy of shape labels x D, e.g. CLIP text embeddings of the labels)
+  the model output is an image embedding, scored by cosine similarity x Local_logit_scale;
+- without it the model output is one logit per label.
+Either way a softmax gives the confidence of the top label, which becomes the name.
+
+numpy and onnxruntime are only needed when Naming_backend is 'local' or 'hybrid'.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from decoding import open_image, open_raster_cache
+from metrics import stage_timer
+
+NAMING_BACKENDS = {'remote': "远程 API", 'local': "本地 CPU 模型（离线）", 'hybrid': "混合（本地置信度低时转远程 API）"}
+# CLIP's input normalization; override with Local_mean / Local_std for other models
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+DEFAULT_INPUT_SIZE = 224
+
+
+def get_naming_backend_name(config):
+    name = config.get('Naming_backend', 'remote')
+    return name if name in NAMING_BACKENDS else 'remote'
+
+
+def uses_remote_api(config):
+    """False only for the local backend, which needs no API key."""
+    return get_naming_backend_name(config) != 'local'
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("本地命名后端需要安装 'numpy' 库。请运行 'pip install numpy onnxruntime'。")
+    return numpy
+
+
+def load_input_array(image_path, size, stage_metrics=None, raster_cache=None):
+    """
+    The model input of one image as a uint8 (size, size, 3) array: the shorter side scaled to size, then
+    center-cropped, like CLIP's preprocessing. Decoding goes through decoding.open_image (draft / reduced decode).
+    """
+    from PIL import Image, ImageOps
+    np = _import_numpy()
+
+    def cover_box(width, height):
+        # The thumbnail must still cover the size x size crop
+        scale = size / max(1, min(width, height))
+        return max(size, int(width * scale + 1)), max(size, int(height * scale + 1))
+
+    img = open_image(image_path, cover_box, stage_metrics=stage_metrics, raster_cache=raster_cache)
+    with stage_timer(stage_metrics, 'resize'):
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img = ImageOps.fit(img, (size, size), Image.BICUBIC)
+        return np.asarray(img, dtype=np.uint8)
+
+
+class LocalTagger:
+    """
+    An ONNX image model and its labels; predict() scores a whole batch in one session.run call.
+    """
+    def __init__(self, model_path, labels_path, label_embeddings_path=None, mean=CLIP_MEAN, std=CLIP_STD,
+                 logit_scale=100.0, threads=None):
+        np = _import_numpy()
+        try:
+            import onnxruntime
+        except ImportError:
+            raise RuntimeError("本地命名后端需要安装 'onnxruntime' 库。请运行 'pip install onnxruntime'。")
+        if not model_path or not os.path.isfile(model_path):
+            raise RuntimeError(f"本地模型文件不存在: {model_path or '（未设置 Local_model_path）'}")
+        if not labels_path or not os.path.isfile(labels_path):
+            raise RuntimeError(f"标签文件不存在: {labels_path or '（未设置 Local_labels_path）'}")
+        self.model_path = model_path
+        with open(labels_path, 'r', encoding='utf-8') as file:
+            self.labels = [line.strip() for line in file if line.strip()]
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = int(threads)
+        self.session = onnxruntime.InferenceSession(model_path, sess_options=options,
+                                                    providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        height = model_input.shape[2] if len(model_input.shape) == 4 else None
+        self.input_size = height if isinstance(height, int) and height > 0 else DEFAULT_INPUT_SIZE
+
+        # Shaped for broadcasting over an NCHW batch
+        self.mean = np.asarray(mean, dtype=np.float32).reshape(1, 3, 1, 1) * 255.0
+        self.scale = 1.0 / (np.asarray(std, dtype=np.float32).reshape(1, 3, 1, 1) * 255.0)
+        self.logit_scale = float(logit_scale)
+        self.label_embeddings = None
+        if label_embeddings_path:
+            embeddings = np.load(label_embeddings_path).astype(np.float32)
+            if embeddings.shape[0] != len(self.labels):
+                raise RuntimeError(f"标签向量数量 ({embeddings.shape[0]}) 与标签数量 ({len(self.labels)}) 不一致")
+            self.label_embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    def preprocess(self, arrays):
+        """uint8 (H, W, 3) arrays -> one normalized float32 NCHW batch; a single vectorized pass."""
+        np = _import_numpy()
+        batch = np.stack(arrays).transpose(0, 3, 1, 2).astype(np.float32)
+        batch -= self.mean
+        batch *= self.scale
+        return batch
+
+    def predict(self, arrays):
+        """Returns [(label, confidence), ...] in the order of arrays."""
+        np = _import_numpy()
+        outputs = self.session.run(None, {self.input_name: self.preprocess(arrays)})[0]
+        outputs = outputs.reshape(len(arrays), -1).astype(np.float32)
+        if self.label_embeddings is not None:
+            outputs /= np.linalg.norm(outputs, axis=1, keepdims=True)
+            logits = self.logit_scale * outputs @ self.label_embeddings.T
+        else:
+            logits = outputs
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        best = probabilities.argmax(axis=1)
+        return [(self.labels[index], float(probabilities[row, index])) for row, index in enumerate(best)]
+
+
+class LocalNamingBackend:
+    """
+    本地命名：调用线程解码并裁剪图片，后台线程把同时到达的图片（最多 batch_size 张，最多等待 batch_wait 秒）
+    合成一个批次送入模型，每张图片按批次耗时均摊记入 'inference' 阶段。
+
+    suggest() is safe to call from any number of threads; with the threads engine Max_workers
+    threads feed one batch. mode 'hybrid' only accepts names whose confidence reaches min_confidence.
+    """
+    def __init__(self, tagger, mode='local', min_confidence=0.5, batch_size=16, batch_wait=0.01, raster_cache=None):
+        self.tagger = tagger
+        self.mode = mode
+        self.min_confidence = float(min_confidence)
+        self.batch_size = max(1, int(batch_size))
+        self.batch_wait = max(0.0, float(batch_wait))
+        self.raster_cache = raster_cache
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.images = 0
+        self.batches = 0
+        self.inference_seconds = 0.0
+        self.accepted = 0
+        self.fallbacks = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _collect(self):
+        first = self.pending.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            try:
+                item = self.pending.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                self.pending.put(None) # Finish this batch, then stop
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            try:
+                predictions = self.tagger.predict([array for array, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            seconds = time.perf_counter() - started
+            with self.lock:
+                self.images += len(batch)
+                self.batches += 1
+                self.inference_seconds += seconds
+            for (_, future, stage_metrics), prediction in zip(batch, predictions):
+                if stage_metrics is not None:
+                    stage_metrics.observe('inference', seconds / len(batch))
+                future.set_result(prediction)
+
+    def suggest(self, image_path, stage_metrics=None):
+        """(name, confidence) of the image's top label."""
+        array = load_input_array(image_path, self.tagger.input_size, stage_metrics, self.raster_cache)
+        future = Future()
+        self.pending.put((array, future, stage_metrics))
+        return future.result()
+
+    def accepts(self, confidence):
+        accepted = self.mode == 'local' or confidence >= self.min_confidence
+        with self.lock:
+            if accepted:
+                self.accepted += 1
+            else:
+                self.fallbacks += 1
+        return accepted
+
+    def summary(self):
+        with self.lock:
+            images, batches, seconds = self.images, self.batches, self.inference_seconds
+            accepted, fallbacks = self.accepted, self.fallbacks
+        per_image = seconds / images * 1000 if images else 0.0
+        line = (f"本地模型统计：推理{images}张，{batches}个批次（平均每批{images / batches if batches else 0:.1f}张），"
+                f"推理合计{seconds:.2f}秒（每张{per_image:.1f}ms）")
+        if self.mode == 'hybrid':
+            line += f"；本地命名{accepted}张，置信度低于{self.min_confidence:g}转远程{fallbacks}张"
+        return line
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+
+
+def create_naming_backend(config, output_text_signal_emit=None):
+    """
+    The run's LocalNamingBackend for Naming_backend 'local' / 'hybrid'; None for 'remote'.
+    Raises RuntimeError (missing numpy / onnxruntime, model or label file) so the run stops before any image.
+    """
+    mode = get_naming_backend_name(config)
+    if mode == 'remote':
+        return None
+    tagger = LocalTagger(config.get('Local_model_path', ''), config.get('Local_labels_path', ''),
+                         config.get('Local_label_embeddings_path') or None,
+                         config.get('Local_mean') or CLIP_MEAN, config.get('Local_std') or CLIP_STD,
+                         float(config.get('Local_logit_scale', 100.0)), config.get('Local_threads') or None)
+    backend = LocalNamingBackend(tagger, mode, config.get('Hybrid_min_confidence', 0.5),
+                                 config.get('Local_batch_size', 16), float(config.get('Local_batch_wait_ms', 10)) / 1000,
+                                 open_raster_cache(config))
+    if output_text_signal_emit is not None:
+        threshold = f"，置信度低于{backend.min_confidence:g}时转远程 API" if mode == 'hybrid' else ""
+        output_text_signal_emit(f"命名后端：{NAMING_BACKENDS[mode]}，模型 {os.path.basename(tagger.model_path)}，"
+                                f"{len(tagger.labels)}个标签，输入{tagger.input_size}px，每批最多{backend.batch_size}张{threshold}")
+    return backend
@@ -0,0 +1,103 @@
+# benchmarks/bench_payload.py
+"""
+上传图片优化基准：比较旧路径（compress_and_encode_image，512 框内、PNG 保持 PNG）与
+payload.optimize_payload（默认设置 / 低细节）每张图片的上传字节数、预处理耗时和估算的图片 token。
+
+    python benchmarks/bench_payload.py --megapixels 12 --repeat 3 [--json result.json]
+
+Inputs are the bench_preprocess corpus plus an RGBA product cut-out (PNG with transparency).
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_preprocess import generate_image
+
+FORMATS = ('jpeg', 'png', 'png_rgba', 'webp', 'tiff')
+
+
+def generate_cutout(megapixels, folder):
+    """Product-style RGBA PNG: an opaque subject on a fully transparent background."""
+    from PIL import Image, ImageDraw
+    width = int((megapixels * 1_000_000 * 3 / 2) ** 0.5)
+    height = int(width * 2 / 3)
+    subject = Image.effect_mandelbrot((width, height), (-2.2, -1.2, 1.0, 1.2), 60).convert('RGBA')
+    mask = Image.new('L', (width, height), 0)
+    ImageDraw.Draw(mask).ellipse((width // 6, height // 8, width * 5 // 6, height * 7 // 8), fill=255)
+    subject.putalpha(mask)
+    path = os.path.join(folder, "bench_png_rgba.png")
+    subject.save(path, compress_level=1)
+    return path
+
+
+def measure(encode, repeat):
+    """Runs encode() repeat times; returns (mean seconds, (data, mime_type, width, height, byte_count))."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = encode()
+        timings.append(time.perf_counter() - started)
+    return sum(timings) / len(timings), result
+
+
+def main():
+    from function import LEGACY_MAX_SIZE, compress_and_encode_image
+    from payload import estimate_image_tokens, get_payload_settings, optimize_payload
+    from PIL import Image
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--megapixels', type=float, default=12)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--formats', default=','.join(FORMATS))
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    default_settings = get_payload_settings({'Raster_cache_enabled': False})
+    low_settings = get_payload_settings({'Upload_detail': 'low', 'Raster_cache_enabled': False})
+
+    def legacy(path):
+        encoded, mime_type, _ = compress_and_encode_image(path, quality=85, max_size=LEGACY_MAX_SIZE)
+        data = base64.b64decode(encoded)
+        with Image.open(io.BytesIO(data)) as img:
+            width, height = img.size
+        return encoded, mime_type, width, height, len(data)
+
+    def optimized(path, settings):
+        encoded = optimize_payload(path, settings)
+        return encoded.data, encoded.mime_type, encoded.width, encoded.height, encoded.byte_count
+
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for fmt in args.formats.split(','):
+            path = generate_cutout(args.megapixels, folder) if fmt == 'png_rgba' else generate_image(fmt, args.megapixels, folder)
+            row = {'format': fmt, 'megapixels': args.megapixels, 'file_bytes': os.path.getsize(path)}
+            # The old requests sent no detail field, which the API treats like high detail for a 512px image
+            for label, encode, token_settings in (('legacy', lambda: legacy(path), default_settings),
+                                                  ('default', lambda: optimized(path, default_settings), default_settings),
+                                                  ('low', lambda: optimized(path, low_settings), low_settings)):
+                seconds, (data, mime_type, width, height, byte_count) = measure(encode, args.repeat)
+                row[label] = {'seconds': seconds, 'bytes': byte_count, 'base64_bytes': len(data), 'mime_type': mime_type,
+                              'size': [width, height], 'tokens': estimate_image_tokens(width, height, token_settings)}
+            results.append(row)
+
+    print(f"{'format':<10}{'legacy KB':>11}{'default KB':>12}{'low KB':>9}{'legacy ms':>11}{'default ms':>12}"
+          f"{'legacy tok':>12}{'default tok':>13}{'low tok':>9}")
+    for row in results:
+        legacy_row, default_row, low_row = row['legacy'], row['default'], row['low']
+        print(f"{row['format']:<10}{legacy_row['bytes'] / 1024:>11.1f}{default_row['bytes'] / 1024:>12.1f}"
+              f"{low_row['bytes'] / 1024:>9.1f}{legacy_row['seconds'] * 1000:>11.1f}{default_row['seconds'] * 1000:>12.1f}"
+              f"{legacy_row['tokens']:>12}{default_row['tokens']:>13}{low_row['tokens']:>9}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
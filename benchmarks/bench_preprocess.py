@@ -0,0 +1,133 @@
+# benchmarks/bench_preprocess.py
+"""
+compress_and_encode_image 预处理基准：按格式比较旧路径（完整解码后 thumbnail）与快速路径
+（DCT 域缩小解码 / EXIF 内嵌缩略图）的单张耗时与峰值内存。
+
+    python benchmarks/bench_preprocess.py --megapixels 24 --repeat 5 [--json result.json]
+
+Each (format, mode) pair runs in its own child process so peak RSS is not polluted by earlier runs.
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FORMATS = ('jpeg', 'jpeg_exif_thumb', 'png', 'tiff', 'webp')
+
+
+def _exif_with_thumbnail(thumbnail_jpeg):
+    """Minimal little-endian EXIF block: IFD0 with one tag, IFD1 pointing at the embedded JPEG."""
+    make = b'Bench\x00'
+    ifd0_offset = 8
+    ifd0 = struct.pack('<H', 1) + struct.pack('<HHII', 0x010F, 2, len(make), 0) # value offset patched below
+    ifd1_offset = ifd0_offset + len(ifd0) + 4
+    ifd1_size = 2 + 2 * 12 + 4
+    make_offset = ifd1_offset + ifd1_size
+    thumbnail_offset = make_offset + len(make)
+    ifd0 = struct.pack('<H', 1) + struct.pack('<HHII', 0x010F, 2, len(make), make_offset)
+    ifd1 = (struct.pack('<H', 2)
+            + struct.pack('<HHII', 0x0201, 4, 1, thumbnail_offset)
+            + struct.pack('<HHII', 0x0202, 4, 1, len(thumbnail_jpeg))
+            + struct.pack('<I', 0))
+    tiff = b'II*\x00' + struct.pack('<I', ifd0_offset) + ifd0 + struct.pack('<I', ifd1_offset) + ifd1 + make + thumbnail_jpeg
+    return b'Exif\x00\x00' + tiff
+
+
+def generate_image(fmt, megapixels, folder):
+    from PIL import Image
+    width = int((megapixels * 1_000_000 * 3 / 2) ** 0.5)
+    height = int(width * 2 / 3)
+    img = Image.effect_mandelbrot((width, height), (-2.2, -1.2, 1.0, 1.2), 60).convert('RGB')
+    path = os.path.join(folder, f"bench_{fmt}.{ 'jpg' if fmt.startswith('jpeg') else fmt }")
+    if fmt == 'jpeg':
+        img.save(path, quality=90)
+    elif fmt == 'jpeg_exif_thumb':
+        thumbnail = img.copy()
+        thumbnail.thumbnail((640, 640))
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, format='JPEG', quality=85)
+        img.save(path, quality=90, exif=_exif_with_thumbnail(buffer.getvalue()))
+    elif fmt == 'png':
+        img.save(path, compress_level=1)
+    elif fmt == 'tiff':
+        img.save(path)
+    elif fmt == 'webp':
+        img.save(path, quality=85)
+    return path
+
+
+def peak_rss_mb():
+    """
+    Peak RSS of this process. VmHWM is reset by exec; ru_maxrss is not on Linux, so it would
+    report the (much larger) parent process that generated the corpus.
+    """
+    try:
+        with open('/proc/self/status', encoding='ascii') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == 'darwin' else maxrss / 1024
+
+
+def run_child(path, fast_decode, repeat, max_size):
+    from function import compress_and_encode_image
+    timings = []
+    payload_bytes = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        encoded, mime_type, output_format = compress_and_encode_image(path, quality=85, max_size=max_size,
+                                                                     fast_decode=fast_decode)
+        timings.append(time.perf_counter() - started)
+        payload_bytes = len(encoded)
+    print(json.dumps({'mean_seconds': sum(timings) / len(timings), 'min_seconds': min(timings),
+                      'peak_rss_mb': peak_rss_mb(), 'payload_bytes': payload_bytes}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--megapixels', type=float, default=24)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--formats', default=','.join(FORMATS))
+    parser.add_argument('--json', help="write results to this file")
+    parser.add_argument('--child', nargs=3, metavar=('PATH', 'FAST', 'REPEAT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    max_size = (512, 512)
+
+    if args.child:
+        run_child(args.child[0], args.child[1] == '1', int(args.child[2]), max_size)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for fmt in args.formats.split(','):
+            path = generate_image(fmt, args.megapixels, folder)
+            row = {'format': fmt, 'megapixels': args.megapixels, 'file_bytes': os.path.getsize(path)}
+            for label, fast in (('before', '0'), ('after', '1')):
+                output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', path, fast, str(args.repeat)],
+                                        capture_output=True, text=True, check=True).stdout
+                row[label] = json.loads(output.strip().splitlines()[-1])
+            results.append(row)
+
+    print(f"{'format':<16}{'before ms':>11}{'after ms':>11}{'speedup':>9}{'before RSS MB':>15}{'after RSS MB':>14}")
+    for row in results:
+        before, after = row['before'], row['after']
+        print(f"{row['format']:<16}{before['mean_seconds'] * 1000:>11.1f}{after['mean_seconds'] * 1000:>11.1f}"
+              f"{before['mean_seconds'] / after['mean_seconds']:>8.1f}x{before['peak_rss_mb']:>15.1f}{after['peak_rss_mb']:>14.1f}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# benchmarks/bench_startup.py
+"""
+启动耗时基准：测量从启动进程到主窗口显示（time-to-window）以及到第一个 API 请求到达服务器
+（time-to-first-request，经由 cli.py）的时间，取多次运行的中位数；超出预算时以非零状态退出。
+
+    python benchmarks/bench_startup.py --runs 5 --window-budget 1.5 --request-budget 1.0 [--json result.json]
+
+Every run is a fresh interpreter, so module import cost is included. The GUI run uses the offscreen
+Qt platform and a temporary working directory so the real config.json is never touched.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_server import MockChatServer
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WINDOW_CHILD = """
+import sys, time
+sys.path.insert(0, {project_dir!r})
+from PyQt5.QtWidgets import QApplication
+from ui import ConfigGUI
+app = QApplication(sys.argv)
+window = ConfigGUI()
+window.show()
+app.processEvents()
+print(time.time(), flush=True)
+"""
+
+
+def measure_time_to_window(work_dir):
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'))
+    started = time.time()
+    output = subprocess.run([sys.executable, '-c', WINDOW_CHILD.format(project_dir=PROJECT_DIR)],
+                            cwd=work_dir, env=env, capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1]) - started
+
+
+def measure_time_to_first_request(work_dir):
+    from PIL import Image
+    source_folder = os.path.join(work_dir, 'images')
+    os.makedirs(source_folder, exist_ok=True)
+    Image.new('RGB', (64, 64), (200, 120, 40)).save(os.path.join(source_folder, 'startup.jpg'))
+
+    server = MockChatServer(latency='fixed:0').start()
+    config_path = os.path.join(work_dir, 'config.json')
+    with open(config_path, 'w', encoding='utf-8') as file:
+        json.dump({'Source_folder': source_folder, 'Api_key': 'benchmark', 'Max_workers': 1,
+                   'Base_url': server.base_url, 'Cache_enabled': False,
+                   'output_mode': 'in_place'}, file)
+    try:
+        started = time.time()
+        subprocess.run([sys.executable, os.path.join(PROJECT_DIR, 'cli.py'), '--config', config_path, '--no-report'],
+                       cwd=work_dir, capture_output=True, text=True, check=False, timeout=60)
+        if not server.first_request.is_set():
+            raise RuntimeError("cli.py exited without sending a request")
+        return server.first_request_at - started
+    finally:
+        server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--window-budget', type=float, default=1.5, help="seconds, median time-to-window")
+    parser.add_argument('--request-budget', type=float, default=1.0, help="seconds, median time-to-first-request")
+    parser.add_argument('--skip-window', action='store_true', help="only measure the CLI (no PyQt5 available)")
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    measurements = {'time_to_first_request': (measure_time_to_first_request, args.request_budget)}
+    if not args.skip_window:
+        measurements['time_to_window'] = (measure_time_to_window, args.window_budget)
+
+    results = {}
+    over_budget = []
+    for name, (measure, budget) in measurements.items():
+        samples = []
+        for _ in range(max(1, args.runs)):
+            with tempfile.TemporaryDirectory() as work_dir:
+                samples.append(measure(work_dir))
+        median = statistics.median(samples)
+        results[name] = {'median_seconds': median, 'min_seconds': min(samples), 'max_seconds': max(samples),
+                         'budget_seconds': budget, 'runs': len(samples)}
+        status = "OK" if median <= budget else "OVER BUDGET"
+        print(f"{name:<24}median {median * 1000:8.1f} ms  (min {min(samples) * 1000:.1f}, "
+              f"max {max(samples) * 1000:.1f})  budget {budget * 1000:.0f} ms  {status}")
+        if median > budget:
+            over_budget.append(name)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
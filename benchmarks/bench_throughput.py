@@ -0,0 +1,210 @@
+# benchmarks/bench_throughput.py
+"""
+离线吞吐基准：启动本地模拟 API（benchmarks/mock_server.py），生成不同格式与尺寸的合成图片集，
+对每组 Max_workers × Image_quality_percent × 图片集运行 process_images_concurrently，
+输出吞吐（张/秒）、单张耗时 p50/p95/p99、CPU 时间与峰值内存。
+
+    python benchmarks/bench_throughput.py --images 200 --workers 5,20 --quality 60,80 \\
+        --formats jpeg,png --megapixels 2,12 --latency lognormal:0.3,0.4 --json after.json
+    python benchmarks/bench_throughput.py ... --compare before.json
+
+Each scenario runs in a child process (the mock server stays in this one), so CPU time and peak RSS
+belong to the renaming code only. Results are JSON so runs from two commits can be diffed with --compare.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_preprocess import generate_image, peak_rss_mb
+from mock_server import MockChatServer
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def build_corpus(folder, fmt, megapixels, count):
+    """count copies of one synthetic image; the result cache is off, so identical bytes still cost a request each."""
+    template = generate_image(fmt, megapixels, folder)
+    corpus = os.path.join(folder, f"{fmt}_{megapixels:g}mp")
+    os.makedirs(corpus)
+    extension = os.path.splitext(template)[1]
+    for index in range(count):
+        shutil.copyfile(template, os.path.join(corpus, f"img_{index:05d}{extension}"))
+    os.remove(template)
+    return corpus
+
+
+def run_child(scenario):
+    """Runs one scenario in this process and prints its metrics as one JSON line."""
+    import function
+    from function import Counter
+    from settings import default_config
+
+    latencies = []
+    latency_lock = threading.Lock()
+
+    def timed(target, images_per_call):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return target(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with latency_lock:
+                    latencies.extend([elapsed] * images_per_call(args))
+        return wrapper
+
+    # process_images_concurrently looks these up as module globals, so wrapping them here times every image
+    function.process_image = timed(function.process_image, lambda args: 1)
+    function.process_image_batch = timed(function.process_image_batch, lambda args: len(args[0]))
+
+    config = default_config() # Same defaults a config.json from the GUI would have
+    config.update(scenario['config'])
+    messages = []
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    total, success, failure, _ = function.process_images_concurrently(
+        config, messages.append, threading.Event(), Counter(), Counter())
+    wall = time.perf_counter() - started
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+
+    latencies.sort()
+    cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    print(json.dumps({
+        'images': total, 'succeeded': success, 'failed': failure,
+        'wall_seconds': wall, 'images_per_second': success / wall if wall > 0 else 0.0,
+        'latency_p50': percentile(latencies, 0.50), 'latency_p95': percentile(latencies, 0.95),
+        'latency_p99': percentile(latencies, 0.99), 'latency_mean': sum(latencies) / len(latencies) if latencies else None,
+        'cpu_seconds': cpu, 'cpu_seconds_per_image': cpu / total if total else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }))
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def scenario_key(row):
+    return f"{row['format']}/{row['megapixels']:g}mp/w{row['workers']}/q{row['quality']}/b{row['batch_size']}"
+
+
+def print_table(results, baseline=None):
+    baseline_by_key = {scenario_key(row): row for row in (baseline or {}).get('results', [])}
+    header = f"{'scenario':<28}{'img/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'CPU ms/img':>12}{'RSS MB':>9}"
+    print(header + ("  vs baseline" if baseline else ""))
+    for row in results:
+        metrics = row['metrics']
+        line = (f"{scenario_key(row):<28}{metrics['images_per_second']:>9.1f}"
+                f"{(metrics['latency_p50'] or 0) * 1000:>9.0f}{(metrics['latency_p95'] or 0) * 1000:>9.0f}"
+                f"{(metrics['latency_p99'] or 0) * 1000:>9.0f}{(metrics['cpu_seconds_per_image'] or 0) * 1000:>12.1f}"
+                f"{metrics['peak_rss_mb']:>9.1f}")
+        previous = baseline_by_key.get(scenario_key(row))
+        if previous and previous['metrics']['images_per_second']:
+            change = metrics['images_per_second'] / previous['metrics']['images_per_second'] - 1
+            line += f"  {change * 100:+.1f}% img/s"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=100, help="images per corpus")
+    parser.add_argument('--formats', default='jpeg,png')
+    parser.add_argument('--megapixels', default='2', help="comma-separated sizes")
+    parser.add_argument('--workers', default='5,10,20', help="comma-separated Max_workers values")
+    parser.add_argument('--quality', default='80', help="comma-separated Image_quality_percent values")
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--latency', default='lognormal:0.2,0.3', help="mock server latency spec")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument('--retry-after', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help="extra config, VALUE as JSON")
+    parser.add_argument('--json', help="write results to this file")
+    parser.add_argument('--compare', help="baseline JSON from an earlier run")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        with open(args.child, encoding='utf-8') as file:
+            run_child(json.load(file))
+        return
+
+    extra_config = {}
+    for assignment in args.set:
+        key, _, raw_value = assignment.partition('=')
+        try:
+            extra_config[key] = json.loads(raw_value)
+        except ValueError:
+            extra_config[key] = raw_value
+
+    server = MockChatServer(latency=args.latency, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                            retry_after=args.retry_after, seed=args.seed).start()
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            for fmt in args.formats.split(','):
+                for megapixels in (float(value) for value in args.megapixels.split(',')):
+                    corpus = build_corpus(folder, fmt, megapixels, args.images)
+                    for workers in (int(value) for value in args.workers.split(',')):
+                        for quality in (int(value) for value in args.quality.split(',')):
+                            output_folder = tempfile.mkdtemp(dir=folder)
+                            config = {'Source_folder': corpus, 'Api_key': 'benchmark', 'Base_url': server.base_url,
+                                      'Max_workers': workers, 'Image_quality_percent': quality,
+                                      'Batch_size': args.batch_size, 'output_mode': 'custom',
+                                      'custom_output_folder': output_folder, 'Cache_enabled': False,
+                                      'Dedup_enabled': False}
+                            config.update(extra_config)
+                            scenario_path = os.path.join(folder, 'scenario.json')
+                            with open(scenario_path, 'w', encoding='utf-8') as file:
+                                json.dump({'config': config}, file)
+                            requests_before = server.stats()['requests']
+                            output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', scenario_path],
+                                                    capture_output=True, text=True, check=True).stdout
+                            metrics = json.loads(output.strip().splitlines()[-1])
+                            metrics['server_requests'] = server.stats()['requests'] - requests_before
+                            results.append({'format': fmt, 'megapixels': megapixels, 'workers': workers,
+                                            'quality': quality, 'batch_size': args.batch_size, 'metrics': metrics})
+                            shutil.rmtree(output_folder, ignore_errors=True)
+                    shutil.rmtree(corpus, ignore_errors=True)
+    finally:
+        server.stop()
+
+    report = {
+        'revision': git_revision(), 'python': platform.python_version(), 'platform': platform.platform(),
+        'cpu_count': os.cpu_count(), 'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'server': {'latency': args.latency, 'error_rate': args.error_rate, 'throttle_rate': args.throttle_rate,
+                   'retry_after': args.retry_after, 'seed': args.seed, **server.stats()},
+        'results': results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+    print_table(results, baseline)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
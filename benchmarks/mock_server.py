@@ -0,0 +1,165 @@
+# benchmarks/mock_server.py
+"""
+本地模拟的 OpenAI 兼容 /v1/chat/completions 服务，用于离线基准测试与手动调试，不消耗真实 API。
+
+    python benchmarks/mock_server.py --port 8000 --latency lognormal:0.4,0.5 --throttle-rate 0.05
+
+Latency specs: fixed:S | uniform:LOW,HIGH | exp:MEAN | lognormal:MEDIAN,SIGMA (seconds).
+Batched requests (several image_url parts) get a JSON array of names, like a real model would return.
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def parse_latency(spec):
+    """
+    Returns a function(rng) -> seconds for a latency spec string (see module docstring).
+    """
+    kind, _, raw_params = (spec or 'fixed:0').partition(':')
+    params = [float(value) for value in raw_params.split(',') if value.strip()]
+    if kind == 'fixed' and len(params) == 1:
+        return lambda rng: params[0]
+    if kind == 'uniform' and len(params) == 2:
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == 'exp' and len(params) == 1:
+        return lambda rng: rng.expovariate(1.0 / params[0]) if params[0] > 0 else 0.0
+    if kind == 'lognormal' and len(params) == 2:
+        mu = math.log(params[0]) if params[0] > 0 else 0.0
+        return lambda rng: rng.lognormvariate(mu, params[1])
+    raise ValueError(f"无法解析延迟分布: {spec}")
+
+
+class MockChatServer(ThreadingHTTPServer):
+    """
+    error_rate: fraction answered with 500; throttle_rate: fraction answered with 429 + Retry-After.
+    Counters are kept so a benchmark can check what the client actually sent.
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency='fixed:0.05', error_rate=0.0, throttle_rate=0.0,
+                 retry_after=1.0, seed=None):
+        super().__init__((host, port), _MockChatHandler)
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.images = 0
+        self.status_counts = {}
+        self.first_request_at = None
+        self.first_request = threading.Event()
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def draw(self):
+        """(delay_seconds, status) for the next request."""
+        with self.lock:
+            self.requests += 1
+            if self.first_request_at is None:
+                self.first_request_at = time.time()
+                self.first_request.set()
+            delay = max(0.0, self.latency(self.rng))
+            roll = self.rng.random()
+        if roll < self.throttle_rate:
+            return delay, 429
+        if roll < self.throttle_rate + self.error_rate:
+            return delay, 500
+        return delay, 200
+
+    def record(self, status, images):
+        with self.lock:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            if status == 200:
+                self.images += images
+
+    def stats(self):
+        with self.lock:
+            return {'requests': self.requests, 'images_named': self.images,
+                    'status_counts': {str(status): count for status, count in sorted(self.status_counts.items())}}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _MockChatHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, so connection reuse in the client is exercised
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        delay, status = self.server.draw()
+        if delay:
+            time.sleep(delay)
+        try:
+            content = json.loads(body)['messages'][0]['content']
+            images = sum(1 for part in content if isinstance(part, dict) and part.get('type') == 'image_url')
+        except (ValueError, KeyError, IndexError, TypeError):
+            status, images = 400, 0
+        self.server.record(status, images)
+
+        if status != 200:
+            self.send_response(status)
+            if status == 429:
+                self.send_header('Retry-After', f"{self.server.retry_after:g}")
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        with self.server.lock:
+            suffix = self.server.rng.randint(0, 99999)
+        if images > 1:
+            text = json.dumps([f"模拟名称{suffix}_{index}" for index in range(images)], ensure_ascii=False)
+        else:
+            text = f"模拟名称{suffix}"
+        payload = json.dumps({'choices': [{'message': {'content': text}}],
+                              'usage': {'prompt_tokens': 85 * max(1, images), 'completion_tokens': 8}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', default='fixed:0.05')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=float, default=1.0)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    server = MockChatServer(args.host, args.port, args.latency, args.error_rate, args.throttle_rate,
+                            args.retry_after, args.seed)
+    print(f"Mock server on {server.base_url} (set Base_url to this in config.json)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+# cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from settings import resolve_data_path
+
+DEFAULT_CACHE_PATH = 'airename_cache.sqlite3'
+
+
+def hash_file_content(image_path, chunk_size=1024 * 1024):
+    """
+    计算图片文件内容的 SHA-256，用作缓存键的一部分（与文件名、路径无关）。
+    """
+    digest = hashlib.sha256()
+    with open(image_path, 'rb') as image_file:
+        for chunk in iter(lambda: image_file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_cache_key(content_hash, model, prompt, quality, max_size, variant=''):
+    """
+    Combines the image content hash with every setting that influences the AI answer.
+    Changing the model, prompt or compression settings therefore never returns a stale name.
+    variant covers the remaining upload settings (payload.payload_signature); '' keeps older keys valid.
+    """
+    parts = [content_hash, model or '', prompt or '', str(quality), f"{max_size[0]}x{max_size[1]}"]
+    if variant:
+        parts.append(variant)
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    基于 SQLite 的AI命名结果缓存，按内容哈希+模型+提示词+压缩参数索引。
+    Shared by all worker threads of a run; every access goes through a single lock.
+    """
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, max_entries=50000, max_age_days=30):
+        self.db_path = db_path
+        self.max_entries = max(0, int(max_entries))
+        self.max_age_seconds = max(0, float(max_age_days)) * 86400
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.isdir(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " suggestion TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_used ON results(last_used)")
+        self.conn.commit()
+        self.evict()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT suggestion, created_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.max_age_seconds and now - row[1] > self.max_age_seconds):
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, suggestion):
+        if not suggestion:
+            return
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results (key, suggestion, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, suggestion, now, now)
+            )
+            self.conn.commit()
+            self.stores += 1
+
+    def evict(self):
+        """
+        Drops entries older than max_age_days, then the least recently used ones beyond max_entries.
+        """
+        with self.lock:
+            removed = 0
+            if self.max_age_seconds:
+                cursor = self.conn.execute("DELETE FROM results WHERE created_at < ?",
+                                           (time.time() - self.max_age_seconds,))
+                removed += cursor.rowcount
+            if self.max_entries:
+                cursor = self.conn.execute(
+                    "DELETE FROM results WHERE key IN ("
+                    " SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+                removed += cursor.rowcount
+            self.conn.commit()
+            self.evicted += removed
+            return removed
+
+    def entry_count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        hit_rate = (self.hits / lookups * 100) if lookups else 0.0
+        return (f"缓存统计：命中{self.hits}次，未命中{self.misses}次（命中率{hit_rate:.1f}%），"
+                f"新写入{self.stores}条，淘汰{self.evicted}条，当前共{self.entry_count()}条")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def open_result_cache(config, output_text_signal_emit=None):
+    """
+    Returns a ResultCache for this run, or None when caching is disabled or the database can't be opened.
+    A relative Cache_path (the default included) is next to the config file, not in the working directory.
+    """
+    if not config.get('Cache_enabled', True):
+        return None
+    try:
+        return ResultCache(resolve_data_path(config.get('Cache_path') or DEFAULT_CACHE_PATH),
+                           max_entries=config.get('Cache_max_entries', 50000),
+                           max_age_days=config.get('Cache_max_age_days', 30))
+    except (sqlite3.Error, OSError) as e:
+        if output_text_signal_emit:
+            output_text_signal_emit(f"警告：无法打开结果缓存，将不使用缓存: {e}")
+        return None
@@ -0,0 +1,331 @@
+# cli.py
+"""
+无界面命令行入口：读取 config.json（可用参数覆盖），直接调用处理引擎并生成结果报告（xlsx / csv / jsonl）。
+Never imports PyQt5, so it runs on headless render servers.
+
+    python cli.py --source /data/shoot --workers 20
+    python cli.py --config prod.json --json > run.jsonl
+    python cli.py --resume            # continue after a crash or stop
+    python cli.py --undo [RUN_ID]     # revert in-place renames of the last (or given) run
+    python cli.py --source /data/a --prompt ... --enqueue --priority 5   # add a folder to the job queue
+    python cli.py --run-queue         # run all queued folders on one shared worker pool
+    python cli.py --endpoint url=https://a.example,key=sk-1,weight=2 --endpoint url=https://b.example,key=sk-2,max=8
+    python cli.py --backend hybrid --local-model clip_image.onnx --local-labels labels.txt --min-confidence 0.6
+    python cli.py --engine distributed --listen 0.0.0.0:8765   # coordinator: shards, places, reports
+    python cli.py --worker http://coordinator:8765 --source-root /mnt/shoot   # on every worker node
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+from backends import NAMING_BACKENDS, uses_remote_api
+from endpoints import has_api_key, parse_endpoint_spec
+from engines import ENGINES, get_engine
+from function import Counter
+from jobqueue import JobRunner, open_job_queue
+from journal import undo_in_place_renames
+from payload import UPLOAD_DETAILS, UPLOAD_FORMATS
+from placement import PLACEMENT_STRATEGIES
+from settings import DEFAULT_CONFIG_PATH, load_config_file
+
+EXIT_OK = 0             # every image was renamed
+EXIT_PARTIAL_FAILURE = 1 # some images failed
+EXIT_CONFIG_ERROR = 2   # invalid arguments or configuration (argparse also uses 2)
+EXIT_NO_IMAGES = 3      # nothing to process
+EXIT_ALL_FAILED = 4     # no image was renamed
+EXIT_INTERRUPTED = 130  # stopped by Ctrl+C / SIGTERM
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default=DEFAULT_CONFIG_PATH, help="配置文件路径（默认 config.json）")
+    parser.add_argument('--source', dest='Source_folder', help="图片文件夹")
+    parser.add_argument('--api-key', dest='Api_key')
+    parser.add_argument('--base-url', dest='Base_url')
+    parser.add_argument('--model', dest='Model')
+    parser.add_argument('--endpoint', action='append', default=[], metavar='url=...,key=...',
+                        help="负载均衡端点，可重复：url=HOST,key=KEY[,model=M][,weight=2][,max=8]；"
+                             "省略的 url / key 沿用 --base-url / --api-key，未给 model 时沿用 --model")
+    parser.add_argument('--prompt', dest='Prompt')
+    parser.add_argument('--workers', dest='Max_workers', type=int)
+    parser.add_argument('--quality', dest='Image_quality_percent', type=int)
+    parser.add_argument('--upload-format', dest='Upload_format', choices=sorted(UPLOAD_FORMATS),
+                        help="上传图片格式：auto（默认）、jpeg、webp，或 original（旧版压缩方式）")
+    parser.add_argument('--detail', dest='Upload_detail', choices=sorted(UPLOAD_DETAILS),
+                        help="请求的图片细节：low 固定 85 token，high 按 Upload_max_tiles 分块")
+    parser.add_argument('--engine', dest='Engine', choices=sorted(ENGINES))
+    parser.add_argument('--backend', dest='Naming_backend', choices=sorted(NAMING_BACKENDS),
+                        help="命名后端：remote（默认，远程 API）、local（本地 ONNX 模型，离线）、hybrid（本地置信度低时转远程）")
+    parser.add_argument('--local-model', dest='Local_model_path', help="本地命名后端的 ONNX 模型文件")
+    parser.add_argument('--local-labels', dest='Local_labels_path', help="本地模型的标签文件（每行一个名称）")
+    parser.add_argument('--min-confidence', dest='Hybrid_min_confidence', type=float,
+                        help="hybrid 模式下接受本地命名的最低置信度（默认 0.5）")
+    parser.add_argument('--output-mode', dest='output_mode', choices=('finish_subfolder', 'in_place', 'custom'))
+    parser.add_argument('--output-folder', dest='custom_output_folder', help="output-mode=custom 时的目标文件夹")
+    parser.add_argument('--batch-size', dest='Batch_size', type=int)
+    parser.add_argument('--placement', dest='Placement_strategy', choices=sorted(PLACEMENT_STRATEGIES),
+                        help="复制到 Finish/自定义文件夹的方式：reflink（默认）、hardlink、auto 或 copy")
+    parser.add_argument('--recursive', dest='Recursive', action='store_true', default=None)
+    parser.add_argument('--include', dest='Include_patterns', help="逗号分隔的 glob，例如 '*.jpg,*.png'")
+    parser.add_argument('--exclude', dest='Exclude_patterns')
+    parser.add_argument('--dedup', dest='Dedup_enabled', action='store_true', default=None)
+    parser.add_argument('--no-cache', dest='Cache_enabled', action='store_false', default=None)
+    parser.add_argument('--metrics', dest='Metrics_format', choices=('json', 'prometheus'),
+                        help="记录各阶段耗时，并在报告旁写入 stage_metrics.json / .prom")
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help="覆盖任意配置项，VALUE 按 JSON 解析（失败则当作字符串），可重复")
+    parser.add_argument('--resume', dest='Resume', action='store_true', default=None,
+                        help="续跑：跳过任务日志中已完成的图片")
+    parser.add_argument('--undo', nargs='?', const='', metavar='RUN_ID',
+                        help="撤销某次运行（默认最近一次）的原位重命名后退出")
+    parser.add_argument('--report', dest='Report_formats', help="报告格式，逗号分隔：xlsx、csv、jsonl（默认 xlsx）")
+    parser.add_argument('--no-report', action='store_true', help="不生成报告")
+    parser.add_argument('--enqueue', action='store_true',
+                        help="把当前文件夹（连同提示词、模型、输出模式）加入作业队列；不与 --run-queue 同用时加入后即退出")
+    parser.add_argument('--priority', type=int, default=0, help="--enqueue 的优先级，数值大的先运行（默认 0）")
+    parser.add_argument('--jobs', action='store_true', help="列出作业队列后退出")
+    parser.add_argument('--cancel-job', type=int, metavar='JOB_ID', help="取消一个尚未运行的作业后退出")
+    parser.add_argument('--run-queue', action='store_true', help="按优先级运行队列中的全部作业（共用一个工作线程池）")
+    parser.add_argument('--listen', dest='Distributed_listen', metavar='HOST:PORT',
+                        help="--engine distributed 的协调服务地址（默认 127.0.0.1:8765；多台机器时用 0.0.0.0:PORT，须同时设置 Distributed_token）")
+    parser.add_argument('--worker', metavar='COORDINATOR',
+                        help="作为工作节点运行：协调者的 http://HOST:PORT，或同机的工作单元数据库路径")
+    parser.add_argument('--worker-id', help="工作节点名称（默认 主机名-进程号）")
+    parser.add_argument('--source-root', dest='Worker_source_root',
+                        help="工作节点上源文件夹的挂载路径（与协调者路径不同时）")
+    parser.add_argument('--json', action='store_true', help="以 JSON Lines 输出日志与结果")
+    return parser
+
+
+def apply_overrides(config, args):
+    option_keys = ('Source_folder', 'Api_key', 'Base_url', 'Model', 'Prompt', 'Max_workers', 'Image_quality_percent',
+                   'Engine', 'output_mode', 'custom_output_folder', 'Batch_size', 'Recursive', 'Include_patterns',
+                   'Exclude_patterns', 'Dedup_enabled', 'Cache_enabled', 'Metrics_format', 'Resume',
+                   'Placement_strategy', 'Report_formats', 'Upload_format', 'Upload_detail', 'Distributed_listen',
+                   'Worker_source_root', 'Naming_backend', 'Local_model_path', 'Local_labels_path', 'Hybrid_min_confidence')
+    for key in option_keys:
+        value = getattr(args, key)
+        if value is not None:
+            config[key] = value
+    if args.endpoint:
+        config['Endpoints'] = [parse_endpoint_spec(spec) for spec in args.endpoint]
+    if args.Metrics_format is not None:
+        config['Metrics_enabled'] = True
+    if args.no_report:
+        config['Report_formats'] = ''
+    for assignment in args.set:
+        key, separator, raw_value = assignment.partition('=')
+        if not separator or not key.strip():
+            raise ValueError(f"--set 参数格式应为 KEY=VALUE: {assignment}")
+        try:
+            config[key.strip()] = json.loads(raw_value)
+        except ValueError:
+            config[key.strip()] = raw_value
+    return config
+
+
+def validate_config(config):
+    """Same checks as ConfigGUI.start_main_logic; returns an error message or None."""
+    source_folder = config.get('Source_folder', '')
+    if not source_folder or not os.path.isdir(source_folder):
+        return f"错误：源文件夹 '{source_folder}' 无效或未设置。"
+    if uses_remote_api(config) and not has_api_key(config):
+        return "错误：API Key 未设置。"
+    if config.get('output_mode') == 'custom':
+        custom_folder = config.get('custom_output_folder', '')
+        if not custom_folder:
+            return "错误：自定义输出文件夹未设置。"
+        try:
+            os.makedirs(custom_folder, exist_ok=True)
+        except OSError as e:
+            return f"错误：无法创建自定义输出文件夹 '{custom_folder}': {e}"
+    return None
+
+
+class ConsoleOutput:
+    """
+    Plays the role of MainLogicThread.output_text.emit: plain lines or JSON Lines on stdout.
+    """
+    def __init__(self, json_lines, num_counter):
+        self.json_lines = json_lines
+        self.num_counter = num_counter
+        self.lock = threading.Lock()
+
+    def emit(self, message):
+        with self.lock:
+            if self.json_lines:
+                print(json.dumps({'event': 'log', 'time': round(time.time(), 3),
+                                  'processed': self.num_counter.get_value(), 'message': message},
+                                 ensure_ascii=False), flush=True)
+            else:
+                print(message, flush=True)
+
+    def job_progress(self, snapshots):
+        """Per-job throughput / ETA from jobqueue.JobRunner; plain mode already logs them."""
+        if not self.json_lines:
+            return
+        with self.lock:
+            for snapshot in snapshots:
+                print(json.dumps(dict(snapshot, event='job_progress', time=round(time.time(), 3)), ensure_ascii=False),
+                      flush=True)
+
+    def result(self, summary):
+        with self.lock:
+            if self.json_lines:
+                print(json.dumps(dict(summary, event='summary'), ensure_ascii=False), flush=True)
+            else:
+                print(f"任务总结：共发现{summary['total']}张图片。处理尝试{summary['processed']}张，"
+                      f"成功{summary['succeeded']}张，失败{summary['failed']}张，用时{summary['elapsed_seconds']}秒。", flush=True)
+
+
+def undo_renames(config, run_id, output):
+    source_folder = config.get('Source_folder', '')
+    if not source_folder or not os.path.isdir(source_folder):
+        output.emit(f"错误：源文件夹 '{source_folder}' 无效或未设置。")
+        return EXIT_CONFIG_ERROR
+    _, restored, skipped = undo_in_place_renames(source_folder, run_id, output.emit)
+    return EXIT_PARTIAL_FAILURE if skipped else EXIT_OK
+
+
+def list_jobs(job_queue, output):
+    jobs = job_queue.jobs()
+    if not jobs:
+        output.emit("作业队列为空。")
+    for job in jobs:
+        if output.json_lines:
+            with output.lock:
+                print(json.dumps(dict(job, event='job'), ensure_ascii=False), flush=True)
+            continue
+        settings = job['settings']
+        counts = f"，成功{job['succeeded']}张，失败{job['failed']}张" if job['total'] is not None else ""
+        output.emit(f"#{job['id']} [{job['state']}] 优先级{job['priority']} {settings.get('Source_folder')}"
+                    f"（{settings.get('Model')}，{settings.get('output_mode')}）{counts}")
+    return EXIT_OK
+
+
+def run_queue(config, job_queue, output, stop_event, num_counter):
+    """Runs every pending job; the exit code reflects the worst job."""
+    if uses_remote_api(config) and not has_api_key(config):
+        output.emit("错误：API Key 未设置。")
+        return EXIT_CONFIG_ERROR
+    results = JobRunner(job_queue, config, output.emit, stop_event, Counter(), num_counter,
+                        on_progress=output.job_progress).run()
+    if output.json_lines:
+        with output.lock:
+            for result in results:
+                print(json.dumps(dict(result, event='job_summary'), ensure_ascii=False), flush=True)
+    if stop_event.is_set():
+        return EXIT_INTERRUPTED
+    if not results:
+        return EXIT_NO_IMAGES
+    if all(result['state'] == 'failed' for result in results):
+        return EXIT_ALL_FAILED
+    if any(result['state'] == 'failed' or result.get('failed') for result in results):
+        return EXIT_PARTIAL_FAILURE
+    return EXIT_OK
+
+
+def run_distributed_worker(config, args, output):
+    if uses_remote_api(config) and not has_api_key(config):
+        output.emit("错误：API Key 未设置。")
+        return EXIT_CONFIG_ERROR
+    from distributed import run_worker # Only needed in worker mode
+    stop_event = threading.Event()
+    install_stop_handlers(stop_event, output)
+    try:
+        units, named, failed = run_worker(config, args.worker, output.emit, stop_event, args.worker_id)
+    except RuntimeError as e: # The local naming backend could not be loaded
+        output.emit(f"错误：{e}")
+        return EXIT_CONFIG_ERROR
+    if stop_event.is_set():
+        return EXIT_INTERRUPTED
+    return EXIT_PARTIAL_FAILURE if failed else EXIT_OK
+
+
+def install_stop_handlers(stop_event, output):
+    """First Ctrl+C / SIGTERM sets stop_event, the second one aborts."""
+    def request_stop(signum, frame):
+        if stop_event.is_set():
+            raise KeyboardInterrupt # Second Ctrl+C: give up waiting for in-flight requests
+        output.emit("正在发送停止信号...")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, request_stop)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    num_counter = Counter()
+    output = ConsoleOutput(args.json, num_counter)
+
+    try:
+        config = apply_overrides(load_config_file(args.config), args)
+    except (ValueError, OSError) as e: # json.JSONDecodeError is a ValueError
+        output.emit(f"错误：无法加载配置 {args.config}: {e}")
+        return EXIT_CONFIG_ERROR
+    if args.undo is not None:
+        return undo_renames(config, args.undo or None, output)
+    if args.worker:
+        return run_distributed_worker(config, args, output)
+    job_queue = None
+    if args.enqueue or args.jobs or args.cancel_job is not None or args.run_queue:
+        job_queue = open_job_queue(config, args.config)
+    if args.jobs:
+        return list_jobs(job_queue, output)
+    if args.cancel_job is not None:
+        if job_queue.cancel(args.cancel_job):
+            output.emit(f"作业#{args.cancel_job} 已取消。")
+            return EXIT_OK
+        output.emit(f"错误：作业#{args.cancel_job} 不存在或已开始运行。")
+        return EXIT_CONFIG_ERROR
+    if args.enqueue:
+        error = validate_config(dict(config, Api_key=config.get('Api_key') or 'queued'))
+        if error:
+            output.emit(error)
+            return EXIT_CONFIG_ERROR
+        job_id = job_queue.add(config, args.priority)
+        output.emit(f"已加入作业队列：#{job_id} {config['Source_folder']}（优先级{args.priority}）")
+        if not args.run_queue:
+            return EXIT_OK
+    error = None if args.run_queue else validate_config(config)
+    if error:
+        output.emit(error)
+        return EXIT_CONFIG_ERROR
+
+    stop_event = threading.Event()
+    install_stop_handlers(stop_event, output)
+
+    if args.run_queue:
+        try:
+            return run_queue(config, job_queue, output, stop_event, num_counter)
+        finally:
+            job_queue.close()
+
+    started = time.monotonic()
+    engine = get_engine(config.get('Engine'))
+    # The engine streams the report (Report_formats) while it runs
+    total_found, success_count, failure_count, _ = engine(config, output.emit, stop_event, Counter(), num_counter)
+
+    output.result({'total': total_found, 'processed': num_counter.get_value(), 'succeeded': success_count,
+                   'failed': failure_count, 'stopped': stop_event.is_set(),
+                   'elapsed_seconds': round(time.monotonic() - started, 2)})
+
+    if stop_event.is_set():
+        return EXIT_INTERRUPTED
+    if total_found == 0:
+        return EXIT_NO_IMAGES
+    if success_count == 0:
+        return EXIT_ALL_FAILED
+    if failure_count > 0:
+        return EXIT_PARTIAL_FAILURE
+    return EXIT_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,344 @@
+# decoding.py
+import hashlib
+import io
+import os
+import re
+import struct
+import threading
+import time
+
+from metrics import stage_timer
+from settings import resolve_data_path
+
+EXIF_THUMBNAIL_OFFSET_TAG = 0x0201 # JPEGInterchangeFormat
+EXIF_THUMBNAIL_LENGTH_TAG = 0x0202 # JPEGInterchangeFormatLength
+DEFAULT_RASTER_CACHE_FOLDER = 'airename_raster_cache'
+
+
+def read_exif_thumbnail(exif_bytes):
+    """
+    从 EXIF（APP1）数据的 IFD1 中取出内嵌的 JPEG 缩略图字节，没有时返回 None。
+    Only the TIFF header, IFD0's entry count and IFD1's two pointer tags are read.
+    """
+    if not exif_bytes:
+        return None
+    if exif_bytes.startswith(b'Exif\x00\x00'):
+        exif_bytes = exif_bytes[6:]
+    if len(exif_bytes) < 8:
+        return None
+    byte_order = exif_bytes[:2]
+    if byte_order == b'II':
+        endian = '<'
+    elif byte_order == b'MM':
+        endian = '>'
+    else:
+        return None
+    try:
+        ifd0_offset = struct.unpack(endian + 'I', exif_bytes[4:8])[0]
+        entry_count = struct.unpack(endian + 'H', exif_bytes[ifd0_offset:ifd0_offset + 2])[0]
+        next_ifd_pointer = ifd0_offset + 2 + entry_count * 12
+        ifd1_offset = struct.unpack(endian + 'I', exif_bytes[next_ifd_pointer:next_ifd_pointer + 4])[0]
+        if not ifd1_offset:
+            return None
+        entry_count = struct.unpack(endian + 'H', exif_bytes[ifd1_offset:ifd1_offset + 2])[0]
+        thumbnail_offset = thumbnail_length = None
+        for index in range(entry_count):
+            entry_start = ifd1_offset + 2 + index * 12
+            tag, field_type, count = struct.unpack(endian + 'HHI', exif_bytes[entry_start:entry_start + 8])
+            value_format = endian + ('H' if field_type == 3 else 'I')
+            value = struct.unpack(value_format, exif_bytes[entry_start + 8:entry_start + 8 + struct.calcsize(value_format)])[0]
+            if tag == EXIF_THUMBNAIL_OFFSET_TAG:
+                thumbnail_offset = value
+            elif tag == EXIF_THUMBNAIL_LENGTH_TAG:
+                thumbnail_length = value
+    except struct.error:
+        return None
+    if not thumbnail_offset or not thumbnail_length:
+        return None
+    thumbnail = exif_bytes[thumbnail_offset:thumbnail_offset + thumbnail_length]
+    if len(thumbnail) != thumbnail_length or not thumbnail.startswith(b'\xff\xd8'):
+        return None
+    return thumbnail
+
+
+def open_embedded_thumbnail(img, max_size):
+    """
+    Returns the EXIF thumbnail as an image when it covers max_size on its longer side, else None.
+    The main image's pixels are never decoded for this check.
+    """
+    from PIL import Image
+    thumbnail_bytes = read_exif_thumbnail(img.info.get('exif'))
+    if thumbnail_bytes is None:
+        return None
+    try:
+        thumbnail = Image.open(io.BytesIO(thumbnail_bytes))
+        thumbnail.load()
+    except Exception:
+        return None
+    # The thumbnail must be big enough and have (about) the same aspect ratio as the photo
+    if max(thumbnail.size) < min(max(img.size), max(max_size)):
+        return None
+    if abs(thumbnail.size[0] / thumbnail.size[1] - img.size[0] / img.size[1]) > 0.02:
+        return None
+    return thumbnail
+
+
+def load_reduced(img, max_size, use_embedded_thumbnail=True, stage_metrics=None):
+    """
+    按目标尺寸以最低代价解码图片：优先使用足够大的 EXIF 内嵌缩略图，
+    JPEG 在 DCT 域直接按 1/2、1/4、1/8 缩小解码，其余格式先用整数倍 reduce() 再精细缩放。
+    Returns an image no larger than max_size; img.format is kept on the result.
+    stage_metrics (metrics.StageMetrics) receives the 'decode' and 'resize' timings.
+    """
+    source_format = img.format
+    with stage_timer(stage_metrics, 'decode'):
+        thumbnail = None
+        if source_format == 'JPEG':
+            if use_embedded_thumbnail:
+                thumbnail = open_embedded_thumbnail(img, max_size)
+            if thumbnail is None and img.mode in ('RGB', 'L', 'CMYK', 'YCbCr'):
+                img.draft(img.mode if img.mode != 'YCbCr' else 'RGB', max_size)
+        if thumbnail is None:
+            img.load() # thumbnail() would load anyway; done here so decoding and resizing are timed apart
+    with stage_timer(stage_metrics, 'resize'):
+        if thumbnail is not None:
+            thumbnail.thumbnail(max_size)
+            thumbnail.format = source_format
+            return thumbnail
+        # reducing_gap=1.0: box-reduce to at most 1x the target before resampling, instead of Pillow's default 2x
+        img.thumbnail(max_size, reducing_gap=1.0)
+    img.format = source_format
+    return img
+
+
+SVG_UNITS = {'px': 1.0, 'pt': 96 / 72, 'pc': 16.0, 'mm': 96 / 25.4, 'cm': 96 / 2.54, 'in': 96.0}
+# Size used for an SVG without width/height/viewBox, as cairosvg does
+SVG_DEFAULT_SIZE = (300, 150)
+
+
+def _parse_svg_length(value):
+    """'120', '120px', '3.5in' -> pixels at 96 dpi; None for percentages or missing values."""
+    match = re.match(r'\s*([0-9.]+(?:[eE][-+]?[0-9]+)?)\s*(px|pt|pc|mm|cm|in)?\s*$', value or '')
+    if not match:
+        return None
+    return float(match.group(1)) * SVG_UNITS[match.group(2) or 'px']
+
+
+class SvgDecoder:
+    """
+    SVG 矢量图：用 cairosvg 直接按目标尺寸栅格化（不先渲染原始尺寸再缩小）。
+    Only the root element is parsed for the intrinsic size; the rasterized image is RGBA.
+    """
+    name = 'svg'
+    output_format = 'PNG'
+
+    def source_size(self, image_path):
+        from xml.etree import ElementTree
+        try:
+            for _, root in ElementTree.iterparse(image_path, events=('start',)):
+                break
+            else:
+                return SVG_DEFAULT_SIZE
+        except ElementTree.ParseError as e:
+            raise RuntimeError(f"SVG 解析失败: {e}")
+        width = _parse_svg_length(root.get('width'))
+        height = _parse_svg_length(root.get('height'))
+        view_box = (root.get('viewBox') or '').replace(',', ' ').split()
+        if len(view_box) == 4:
+            try:
+                box_width, box_height = float(view_box[2]), float(view_box[3])
+            except ValueError:
+                box_width = box_height = 0
+            if box_width > 0 and box_height > 0:
+                if width is None and height is None:
+                    width, height = box_width, box_height
+                elif width is None:
+                    width = height * box_width / box_height
+                elif height is None:
+                    height = width * box_height / box_width
+        return (max(1, round(width or SVG_DEFAULT_SIZE[0])), max(1, round(height or SVG_DEFAULT_SIZE[1])))
+
+    def decode(self, image_path, max_size):
+        try:
+            import cairosvg
+        except ImportError:
+            raise RuntimeError("处理 SVG 需要安装 'cairosvg' 库。请运行 'pip install cairosvg'。")
+        from PIL import Image
+        width, height = self.source_size(image_path)
+        # Vector images are rendered at exactly the box size, upscaling small ones
+        scale = min(max_size[0] / width, max_size[1] / height)
+        png_bytes = cairosvg.svg2png(url=image_path, output_width=max(1, round(width * scale)),
+                                     output_height=max(1, round(height * scale)))
+        img = Image.open(io.BytesIO(png_bytes))
+        img.load()
+        return img
+
+
+class HeifDecoder:
+    """
+    HEIC / HEIF photos through the pillow_heif plugin, registered with Pillow on first use;
+    after that they are decoded and reduced like any other format.
+    """
+    name = 'heif'
+    output_format = 'JPEG'
+    _registered = False
+
+    def _open(self, image_path):
+        if not HeifDecoder._registered:
+            try:
+                import pillow_heif
+            except ImportError:
+                raise RuntimeError("处理 HEIC/HEIF 需要安装 'pillow-heif' 库。请运行 'pip install pillow-heif'。")
+            pillow_heif.register_heif_opener()
+            HeifDecoder._registered = True
+        from PIL import Image
+        return Image.open(image_path)
+
+    def source_size(self, image_path):
+        with self._open(image_path) as img:
+            return img.size
+
+    def decode(self, image_path, max_size):
+        with self._open(image_path) as img:
+            return load_reduced(img, max_size, use_embedded_thumbnail=False)
+
+
+# File suffix -> decoder for formats Pillow can't open by itself; see register_decoder
+DECODERS = {}
+
+
+def register_decoder(suffixes, decoder):
+    """
+    Adds a decoder for the given suffixes. A decoder has a name and output_format, source_size(path)
+    returning (width, height), and decode(path, max_size) returning a loaded image within max_size.
+    """
+    for suffix in suffixes:
+        DECODERS[suffix.lower()] = decoder
+
+
+register_decoder(('.svg',), SvgDecoder())
+register_decoder(('.heic', '.heif'), HeifDecoder())
+
+
+def get_decoder(image_path):
+    return DECODERS.get(os.path.splitext(image_path)[1].lower())
+
+
+class RasterCache:
+    """
+    按内容哈希缓存栅格化结果（SVG、HEIC 等慢速解码器的输出），重复运行时直接读取 PNG。
+
+    Files live in folder/<2 hex>/<key>.png and are written through a temporary file + os.replace,
+    so concurrent threads and worker processes never see partial files. The object only holds
+    the folder and can be pickled into process pools.
+    """
+    def __init__(self, folder=DEFAULT_RASTER_CACHE_FOLDER, max_age_days=30):
+        self.folder = folder
+        self.max_age_seconds = max(0, float(max_age_days)) * 86400
+
+    def key(self, image_path, decoder_name, max_size):
+        from cache import hash_file_content
+        parts = (hash_file_content(image_path), decoder_name, f"{max_size[0]}x{max_size[1]}")
+        return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.folder, key[:2], f"{key}.png")
+
+    def get(self, key):
+        from PIL import Image
+        try:
+            img = Image.open(self._path(key))
+            img.load()
+        except FileNotFoundError:
+            return None
+        except Exception:
+            return None # Truncated or foreign file: rasterize again and overwrite it
+        return img
+
+    def put(self, key, img):
+        path = self._path(key)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            img.save(temporary_path, format='PNG', compress_level=1)
+            os.replace(temporary_path, path)
+        except OSError:
+            try:
+                os.remove(temporary_path)
+            except OSError:
+                pass
+
+    def prune(self):
+        """Removes entries older than max_age_days (by modification time); returns how many."""
+        if not self.max_age_seconds or not os.path.isdir(self.folder):
+            return 0
+        cutoff = time.time() - self.max_age_seconds
+        removed = 0
+        for directory in os.scandir(self.folder):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        removed += 1
+                except OSError:
+                    pass
+        return removed
+
+
+_pruned_raster_folders = set()
+
+
+def open_raster_cache(config):
+    """
+    The run's RasterCache, or None when Raster_cache_enabled is off. A relative Raster_cache_folder is next to
+    the config file. Old entries are pruned the first time a folder is opened in this process.
+    """
+    if not config.get('Raster_cache_enabled', True):
+        return None
+    raster_cache = RasterCache(resolve_data_path(config.get('Raster_cache_folder') or DEFAULT_RASTER_CACHE_FOLDER),
+                               max_age_days=config.get('Raster_cache_max_age_days', 30))
+    if raster_cache.folder not in _pruned_raster_folders:
+        _pruned_raster_folders.add(raster_cache.folder)
+        raster_cache.prune()
+    return raster_cache
+
+
+def open_image(image_path, max_size, use_embedded_thumbnail=True, fast_decode=True, stage_metrics=None, raster_cache=None):
+    """
+    打开并按目标尺寸解码图片：Pillow 支持的格式走 load_reduced，其余格式（SVG、HEIC…）走已注册的解码器，
+    其结果按内容哈希缓存在 raster_cache 中。
+    max_size is a (width, height) box or a function of the source (width, height) returning the box.
+    Returns a loaded image no larger than the box with img.format set (the decoder's output_format).
+    """
+    from PIL import Image
+    decoder = get_decoder(image_path)
+    if decoder is None:
+        with stage_timer(stage_metrics, 'read'):
+            source_image = Image.open(image_path)
+        with source_image as img:
+            box = max_size(img.width, img.height) if callable(max_size) else max_size
+            if fast_decode:
+                return load_reduced(img, box, use_embedded_thumbnail, stage_metrics=stage_metrics)
+            source_format = img.format
+            with stage_timer(stage_metrics, 'decode'):
+                img.thumbnail(box)
+            img.format = source_format
+            return img
+
+    with stage_timer(stage_metrics, 'read'):
+        width, height = decoder.source_size(image_path)
+    box = max_size(width, height) if callable(max_size) else max_size
+    img = key = None
+    if raster_cache is not None:
+        with stage_timer(stage_metrics, 'hash'):
+            key = raster_cache.key(image_path, decoder.name, box)
+            img = raster_cache.get(key)
+    if img is None:
+        with stage_timer(stage_metrics, 'decode'):
+            img = decoder.decode(image_path, box)
+        if key is not None:
+            raster_cache.put(key, img)
+    img.format = decoder.output_format
+    return img
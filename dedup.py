@@ -0,0 +1,142 @@
+# dedup.py
+import concurrent.futures
+import os
+
+from decoding import get_decoder, open_image
+
+HASH_SIZE = 8
+
+
+def _load_small_grayscale(image_path, size):
+    from PIL import Image
+    if get_decoder(image_path) is not None: # SVG / HEIC: rasterize straight to the hash size
+        with open_image(image_path, (size[0] * 8, size[1] * 8)) as img:
+            return img.convert('L').resize(size, Image.BILINEAR)
+    with Image.open(image_path) as img:
+        # Let the JPEG decoder downscale in the DCT domain; other formats ignore draft()
+        img.draft('L', (size[0] * 8, size[1] * 8))
+        img.thumbnail((size[0] * 8, size[1] * 8))
+        return img.convert('L').resize(size, Image.BILINEAR)
+
+
+def average_hash(image_path, hash_size=HASH_SIZE):
+    """
+    aHash：缩小到 hash_size x hash_size 灰度图，每个像素与平均值比较得到一位。
+    """
+    pixels = list(_load_small_grayscale(image_path, (hash_size, hash_size)).getdata())
+    mean = sum(pixels) / len(pixels)
+    value = 0
+    for pixel in pixels:
+        value = (value << 1) | (1 if pixel > mean else 0)
+    return value
+
+
+def difference_hash(image_path, hash_size=HASH_SIZE):
+    """
+    dHash：缩小到 (hash_size+1) x hash_size 灰度图，比较水平相邻像素的亮度梯度。
+    """
+    img = _load_small_grayscale(image_path, (hash_size + 1, hash_size))
+    pixels = list(img.getdata())
+    width = hash_size + 1
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * width + col]
+            right = pixels[row * width + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+HASH_METHODS = {
+    'ahash': average_hash,
+    'dhash': difference_hash,
+}
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over Hamming distance, so radius queries only visit
+    the subtrees whose edge distance can still fall inside the radius.
+    """
+    def __init__(self):
+        self.root = None # [hash_value, item, {distance: child_node}]
+        self.size = 0
+
+    def add(self, hash_value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [hash_value, item, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(hash_value, node[0])
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash_value, item, {}]
+                return
+            node = child
+
+    def query(self, hash_value, max_distance):
+        """
+        Returns [(distance, item), ...] for every stored hash within max_distance, nearest first.
+        """
+        results = []
+        if self.root is None:
+            return results
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= max_distance:
+                results.append((distance, node[1]))
+            low, high = distance - max_distance, distance + max_distance
+            for edge, child in node[2].items():
+                if low <= edge <= high:
+                    stack.append(child)
+        results.sort(key=lambda pair: pair[0])
+        return results
+
+
+def cluster_similar_images(image_paths, max_distance=5, method='dhash', max_workers=4, stop_event=None, output_text_signal_emit=None):
+    """
+    将近似重复的图片分组，返回 {代表图片路径: [同组其他图片路径, ...]}。
+
+    Leader clustering: images are visited in path order; each one joins the nearest
+    existing representative within max_distance, otherwise it becomes a new representative.
+    Images that can't be hashed stay on their own.
+    """
+    hash_function = HASH_METHODS.get(method, difference_hash)
+    hashes = {}
+
+    def compute(path):
+        if stop_event is not None and stop_event.is_set():
+            return path, None
+        try:
+            return path, hash_function(path)
+        except Exception as e:
+            if output_text_signal_emit:
+                output_text_signal_emit(f"提示：无法计算感知哈希，单独处理 {os.path.basename(path)}: {e}")
+            return path, None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for path, value in executor.map(compute, image_paths):
+            hashes[path] = value
+
+    clusters = {}
+    tree = BKTree()
+    for path in sorted(image_paths):
+        value = hashes.get(path)
+        if value is None:
+            clusters[path] = []
+            continue
+        matches = tree.query(value, max_distance)
+        if matches:
+            clusters[matches[0][1]].append(path)
+        else:
+            tree.add(value, path)
+            clusters[path] = []
+    return clusters
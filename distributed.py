@@ -0,0 +1,607 @@
+# distributed.py
+import concurrent.futures
+import ipaddress
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from backends import create_naming_backend
+from cache import open_result_cache
+from endpoints import create_endpoint_balancer
+from function import (Counter, collect_image_paths, describe_processing_error, extract_suggestion, fail_cluster_members,
+                      handle_name_response, log_run_settings, log_run_statistics, name_image, open_run_report,
+                      plan_clusters, record_failure)
+from http_client import create_http_session
+from journal import mark as mark_journal, new_run_id, open_run_journal
+from placement import NameRegistry, PlacementTotals
+from ratelimit import RequestCancelled, create_concurrency_controller
+
+UNITS_FILENAME = '.airename_units.sqlite3'
+MAX_UNIT_ATTEMPTS = 3 # A unit whose lease expired this often is failed instead of re-issued again
+# Settings a worker takes from the coordinator, so every image of a run is named the same way;
+# the API key, endpoint, threads and cache stay the worker's own
+WORKER_KEYS = ('Model', 'Prompt', 'Image_quality_percent', 'Upload_format', 'Upload_detail', 'Upload_max_tiles',
+               'Vision_tile_size', 'Upload_max_bytes')
+POLL_SECONDS = 0.2
+COORDINATOR_GONE_ATTEMPTS = 3 # Failed lease calls in a row (one per second) after which a worker that has finished its work exits
+UNREACHABLE_LOG_INTERVAL = 15.0 # Seconds between repeated "cannot reach the coordinator" lines
+
+
+class LeaseStore:
+    """
+    分布式运行的工作单元表（SQLite）：协调者把文件列表切成工作单元，工作节点租用单元、
+    命名其中的图片并交回结果；租约到期未续租的单元会重新分配给其他节点。
+
+    The coordinator serves it over HTTP (start_lease_server); workers on the same machine can also open the
+    database directly. Every state change runs in a BEGIN IMMEDIATE transaction, so several processes
+    can share the file. Paths in units and results are relative to the run's source folder.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS runs (id TEXT PRIMARY KEY, source_folder TEXT NOT NULL,"
+                          " settings TEXT NOT NULL, state TEXT NOT NULL, created_at REAL NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS units (id INTEGER PRIMARY KEY AUTOINCREMENT, run TEXT NOT NULL,"
+                          " paths TEXT NOT NULL, state TEXT NOT NULL, worker TEXT, lease_expires REAL,"
+                          " attempts INTEGER NOT NULL DEFAULT 0)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_units_run_state ON units(run, state)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY AUTOINCREMENT, run TEXT NOT NULL,"
+                          " unit INTEGER NOT NULL, path TEXT NOT NULL, name TEXT, error TEXT, worker TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_results_run ON results(run, id)")
+
+    def _transaction(self, work):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    def start_run(self, run_id, source_folder, settings):
+        """Makes run_id the active run; any older run still marked active is finished."""
+        def work():
+            self.conn.execute("UPDATE runs SET state = 'finished' WHERE state = 'active'")
+            self.conn.execute("INSERT INTO runs (id, source_folder, settings, state, created_at) VALUES (?, ?, ?, 'active', ?)",
+                              (run_id, source_folder, json.dumps(settings, ensure_ascii=False), time.time()))
+        self._transaction(work)
+
+    def finish_run(self, run_id):
+        self._transaction(lambda: self.conn.execute("UPDATE runs SET state = 'finished' WHERE id = ?", (run_id,)))
+
+    def add_unit(self, run_id, paths):
+        return self._transaction(lambda: self.conn.execute(
+            "INSERT INTO units (run, paths, state) VALUES (?, ?, 'pending')", (run_id, json.dumps(paths, ensure_ascii=False))
+        ).lastrowid)
+
+    def _expire_leases(self, run_id, now):
+        for row in self.conn.execute("SELECT id, paths, attempts FROM units WHERE run = ? AND state = 'leased'"
+                                     " AND lease_expires < ?", (run_id, now)).fetchall():
+            if row['attempts'] < MAX_UNIT_ATTEMPTS:
+                self.conn.execute("UPDATE units SET state = 'pending', worker = NULL WHERE id = ?", (row['id'],))
+                continue
+            self.conn.execute("UPDATE units SET state = 'failed' WHERE id = ?", (row['id'],))
+            error = f"工作单元的租约已过期{row['attempts']}次（工作节点可能已崩溃），不再重新分配"
+            self.conn.executemany("INSERT INTO results (run, unit, path, error) VALUES (?, ?, ?, ?)",
+                                  [(run_id, row['id'], path, error) for path in json.loads(row['paths'])])
+
+    def lease(self, worker_id, lease_seconds):
+        """
+        Hands the oldest pending (or expired) unit of the active run to worker_id.
+        Returns {'unit': id, 'run', 'paths', 'source_folder', 'settings', 'lease_seconds'}, or
+        {'unit': None, 'finished': bool} where finished means there is no active run.
+        """
+        def work():
+            run = self.conn.execute("SELECT * FROM runs WHERE state = 'active' ORDER BY created_at DESC LIMIT 1").fetchone()
+            if run is None:
+                return {'unit': None, 'finished': True}
+            now = time.time()
+            self._expire_leases(run['id'], now)
+            row = self.conn.execute("SELECT id, paths FROM units WHERE run = ? AND state = 'pending' ORDER BY id LIMIT 1",
+                                    (run['id'],)).fetchone()
+            if row is None:
+                return {'unit': None, 'finished': False}
+            self.conn.execute("UPDATE units SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1"
+                              " WHERE id = ?", (worker_id, now + lease_seconds, row['id']))
+            return {'unit': row['id'], 'run': run['id'], 'paths': json.loads(row['paths']),
+                    'source_folder': run['source_folder'], 'settings': json.loads(run['settings']),
+                    'lease_seconds': lease_seconds}
+        return self._transaction(work)
+
+    def heartbeat(self, unit_id, worker_id, lease_seconds):
+        """Extends the lease; False when the unit was re-issued or finished meanwhile."""
+        return self._transaction(lambda: self.conn.execute(
+            "UPDATE units SET lease_expires = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+            (time.time() + lease_seconds, unit_id, worker_id)).rowcount > 0)
+
+    def release(self, unit_id, worker_id):
+        """Gives an unfinished unit back (worker stopping) so it is re-issued at once."""
+        return self._transaction(lambda: self.conn.execute(
+            "UPDATE units SET state = 'pending', worker = NULL, attempts = MAX(0, attempts - 1)"
+            " WHERE id = ? AND worker = ? AND state = 'leased'", (unit_id, worker_id)).rowcount > 0)
+
+    def complete(self, unit_id, worker_id, results):
+        """
+        Stores the results of a unit: a list of {'path', 'name', 'error'}. The first completion wins;
+        a worker whose lease expired and was re-issued gets False and its results are dropped.
+        A unit still leased to another worker, or results for paths that are not in the unit, are refused
+        (False) and the unit stays as it was. A unit path without a result gets an error row.
+        """
+        def work():
+            row = self.conn.execute("SELECT run, paths, state, worker FROM units WHERE id = ?", (unit_id,)).fetchone()
+            if row is None or row['state'] in ('done', 'failed'):
+                return False
+            if row['state'] == 'leased' and row['worker'] != worker_id:
+                return False
+            unit_paths = json.loads(row['paths'])
+            by_path = {}
+            for result in results:
+                if result['path'] not in unit_paths:
+                    return False
+                by_path.setdefault(result['path'], result)
+            missing_error = "工作节点交回工作单元时未返回该图片的结果"
+            self.conn.executemany("INSERT INTO results (run, unit, path, name, error, worker) VALUES (?, ?, ?, ?, ?, ?)",
+                                  [(row['run'], unit_id, path, by_path[path].get('name'), by_path[path].get('error'), worker_id)
+                                   if path in by_path else (row['run'], unit_id, path, None, missing_error, worker_id)
+                                   for path in unit_paths])
+            self.conn.execute("UPDATE units SET state = 'done', worker = ? WHERE id = ?", (worker_id, unit_id))
+            return True
+        return self._transaction(work)
+
+    def results_after(self, run_id, after_id):
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(
+                "SELECT id, path, name, error, worker FROM results WHERE run = ? AND id > ? ORDER BY id", (run_id, after_id))]
+
+    def unit_counts(self, run_id):
+        with self.lock:
+            return {row[0]: row[1] for row in self.conn.execute(
+                "SELECT state, COUNT(*) FROM units WHERE run = ? GROUP BY state", (run_id,))}
+
+    def worker_counts(self, run_id):
+        """Images named per worker in this run."""
+        with self.lock:
+            return {row[0]: row[1] for row in self.conn.execute(
+                "SELECT worker, COUNT(*) FROM results WHERE run = ? AND worker IS NOT NULL GROUP BY worker", (run_id,))}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class _LeaseRequestHandler(BaseHTTPRequestHandler):
+    """JSON POST /lease, /heartbeat, /release, /complete and GET /status on the coordinator's LeaseStore."""
+    ACTIONS = {
+        '/lease': lambda store, body: store.lease(body['worker'], float(body['lease_seconds'])),
+        '/heartbeat': lambda store, body: {'ok': store.heartbeat(body['unit'], body['worker'], float(body['lease_seconds']))},
+        '/release': lambda store, body: {'ok': store.release(body['unit'], body['worker'])},
+        '/complete': lambda store, body: {'ok': store.complete(body['unit'], body['worker'], body['results'])},
+    }
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        token = self.server.token
+        if token and self.headers.get('X-Airename-Token') != token:
+            self._reply(403, {'error': 'invalid token'})
+            return False
+        return True
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path != '/status':
+            self._reply(404, {'error': 'not found'})
+            return
+        run_id = self.server.run_id
+        self._reply(200, {'run': run_id, 'units': self.server.store.unit_counts(run_id),
+                          'workers': self.server.store.worker_counts(run_id)})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        action = self.ACTIONS.get(self.path)
+        if action is None:
+            self._reply(404, {'error': 'not found'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            payload = action(self.server.store, body)
+        except (ValueError, KeyError, TypeError) as e:
+            self._reply(400, {'error': str(e)})
+            return
+        except sqlite3.Error as e:
+            self._reply(503, {'error': str(e)})
+            return
+        self._reply(200, payload)
+
+    def log_message(self, format, *args):
+        pass # Workers poll constantly; the coordinator logs progress itself
+
+
+def parse_listen_address(value):
+    """'0.0.0.0:8765' / ':8765' / '8765' -> (host, port); the host defaults to 127.0.0.1."""
+    host, separator, port = str(value).rpartition(':')
+    if not separator:
+        host, port = '', value
+    return host or '127.0.0.1', int(port)
+
+
+def is_loopback_host(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == 'localhost'
+
+
+def start_lease_server(store, run_id, config):
+    """
+    Serves store over HTTP on Distributed_listen from a daemon thread; returns the server.
+    Listening beyond the loopback interface needs a Distributed_token (ValueError otherwise).
+    """
+    address = parse_listen_address(config['Distributed_listen'])
+    if not config.get('Distributed_token') and not is_loopback_host(address[0]):
+        raise ValueError(f"监听非本机地址 {address[0]} 时必须设置 Distributed_token")
+    server = ThreadingHTTPServer(address, _LeaseRequestHandler)
+    server.daemon_threads = True
+    server.store = store
+    server.run_id = run_id
+    server.token = config.get('Distributed_token') or None
+    threading.Thread(target=server.serve_forever, name='lease-server', daemon=True).start()
+    return server
+
+
+def open_lease_store(config):
+    path = config.get('Distributed_db') or os.path.join(config['Source_folder'], UNITS_FILENAME)
+    return LeaseStore(path)
+
+
+def _relative(path, source_folder):
+    return os.path.relpath(path, source_folder).replace(os.sep, '/')
+
+
+def process_images_distributed(config, output_text_signal_emit, stop_event, active_counter, gui_num_counter):
+    """
+    分布式引擎（协调者）：把文件列表切分为工作单元交给工作节点（cli.py --worker）命名，
+    文件放置、任务日志与报告仍在本机集中完成。Same signature and return value as the other engines.
+
+    Units are written while the folder is being scanned; results are placed as soon as a worker
+    hands in its unit. Workers need the source folder on a shared path (Worker_source_root maps it).
+    """
+    image_scan = collect_image_paths(config, output_text_signal_emit)
+    if not image_scan:
+        return 0, 0, 0, []
+
+    source_folder = config['Source_folder']
+    success_counter = Counter()
+    failure_counter = Counter()
+    saved_calls_counter = Counter()
+    placement_totals = PlacementTotals()
+    renaming_data_for_excel = open_run_journal(config, output_text_signal_emit, retain_rows=False,
+                                               sinks=(placement_totals, open_run_report(config, output_text_signal_emit)))
+    name_registry = NameRegistry()
+    unit_size = max(1, int(config.get('Distributed_unit_size', 20)))
+    try:
+        store = open_lease_store(config)
+    except (sqlite3.Error, OSError) as e:
+        output_text_signal_emit(f"错误：无法打开分布式工作单元数据库: {e}")
+        renaming_data_for_excel.close()
+        return 0, 0, 0, renaming_data_for_excel
+    run_id = getattr(renaming_data_for_excel, 'run_id', None) or new_run_id()
+    store.start_run(run_id, os.path.abspath(source_folder), {key: config[key] for key in WORKER_KEYS if key in config})
+    server = None
+    if config.get('Distributed_listen'):
+        try:
+            server = start_lease_server(store, run_id, config)
+        except (OSError, ValueError) as e:
+            output_text_signal_emit(f"错误：无法启动协调服务 {config['Distributed_listen']}: {e}")
+            store.finish_run(run_id)
+            store.close()
+            renaming_data_for_excel.close()
+            return 0, 0, 0, renaming_data_for_excel
+        host, port = server.server_address[:2]
+        output_text_signal_emit(f"协调服务已启动：http://{host}:{port}（工作节点：python cli.py --worker http://{host}:{port}）")
+    output_text_signal_emit(f"工作单元数据库：{os.path.abspath(store.db_path)}（同机工作节点也可直接使用该路径）")
+    log_run_settings(config, output_text_signal_emit, f"分布式，每个工作单元{unit_size}张")
+
+    members_by_path = {}
+    last_result_id = 0
+
+    def place_results():
+        nonlocal last_result_id
+        results = store.results_after(run_id, last_result_id)
+        for result in results:
+            last_result_id = result['id']
+            image_path = os.path.join(source_folder, *result['path'].split('/'))
+            members = members_by_path.pop(result['path'], [])
+            if result['name']:
+                response_data = {'choices': [{'message': {'content': result['name']}}]}
+                named = handle_name_response(image_path, response_data, config, output_text_signal_emit, success_counter,
+                                             failure_counter, gui_num_counter, renaming_data_for_excel, None, None, True,
+                                             members, saved_calls_counter, None, name_registry)
+            else:
+                record_failure(image_path, f"工作节点 {result['worker'] or '-'}：{result['error']}", output_text_signal_emit,
+                               failure_counter, gui_num_counter, renaming_data_for_excel,
+                               os.path.basename(image_path) if members else None)
+                named = False
+            if members and not named:
+                fail_cluster_members(image_path, members, output_text_signal_emit, failure_counter, gui_num_counter,
+                                     renaming_data_for_excel)
+        return len(results)
+
+    try:
+        unit = []
+        for image_path, members in plan_clusters(image_scan, config, output_text_signal_emit, stop_event):
+            if stop_event.is_set():
+                break
+            relative_path = _relative(image_path, source_folder)
+            if members:
+                members_by_path[relative_path] = members
+            mark_journal(renaming_data_for_excel, image_path, 'queued')
+            unit.append(relative_path)
+            if len(unit) >= unit_size:
+                store.add_unit(run_id, unit)
+                unit = []
+                place_results()
+        if unit and not stop_event.is_set():
+            store.add_unit(run_id, unit)
+        output_text_signal_emit(f"扫描完成：共{image_scan.count}张图片，等待工作节点...")
+
+        last_report = time.monotonic()
+        while not stop_event.is_set():
+            counts = store.unit_counts(run_id)
+            open_units = counts.get('pending', 0) + counts.get('leased', 0)
+            if place_results() == 0 and open_units == 0:
+                break
+            if time.monotonic() - last_report >= float(config.get('Distributed_progress_interval', 10)):
+                last_report = time.monotonic()
+                output_text_signal_emit(f"分布式进度：待分配{counts.get('pending', 0)}个单元，处理中{counts.get('leased', 0)}个，"
+                                        f"已完成{counts.get('done', 0)}个；已放置{gui_num_counter.get_value()}张")
+            stop_event.wait(POLL_SECONDS)
+        if stop_event.is_set():
+            output_text_signal_emit("停止信号已接收：不再分配工作单元，未完成的图片可用续跑继续。")
+    finally:
+        store.finish_run(run_id)
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        workers = store.worker_counts(run_id)
+        if workers:
+            output_text_signal_emit("工作节点：" + "，".join(f"{worker} 命名{count}张" for worker, count in sorted(workers.items())))
+        store.close()
+        renaming_data_for_excel.close()
+    log_run_statistics(config, output_text_signal_emit, saved_calls_counter, None, None, placement_totals)
+    return image_scan.count, success_counter.get_value(), failure_counter.get_value(), renaming_data_for_excel
+
+
+class HttpLeaseClient:
+    """The LeaseStore methods a worker needs, over the coordinator's HTTP service."""
+    def __init__(self, base_url, token=None, timeout=(10, 60)):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+        if token:
+            self.session.headers['X-Airename-Token'] = token
+        self.timeout = timeout
+
+    def _post(self, action, body):
+        response = self.session.post(f"{self.base_url}/{action}", json=body, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def lease(self, worker_id, lease_seconds):
+        return self._post('lease', {'worker': worker_id, 'lease_seconds': lease_seconds})
+
+    def heartbeat(self, unit_id, worker_id, lease_seconds):
+        return self._post('heartbeat', {'unit': unit_id, 'worker': worker_id, 'lease_seconds': lease_seconds})['ok']
+
+    def release(self, unit_id, worker_id):
+        return self._post('release', {'unit': unit_id, 'worker': worker_id})['ok']
+
+    def complete(self, unit_id, worker_id, results):
+        return self._post('complete', {'unit': unit_id, 'worker': worker_id, 'results': results})['ok']
+
+    def close(self):
+        self.session.close()
+
+
+def open_lease_client(coordinator, config):
+    """An http(s):// URL of a coordinator, or the path of its unit database on this machine."""
+    if coordinator.startswith(('http://', 'https://')):
+        return HttpLeaseClient(coordinator, config.get('Distributed_token') or None)
+    return LeaseStore(coordinator)
+
+
+def _name_one(image_path, relative_path, config, output_text_signal_emit, stop_event, result_cache, http_session,
+              concurrency_controller, endpoint_balancer=None, naming_backend=None):
+    """One image of a unit: {'path', 'name', 'error'}; None when the worker is stopping."""
+    try:
+        response_data, cache_key, from_cache = name_image(image_path, config, output_text_signal_emit, stop_event,
+                                                          result_cache, http_session, concurrency_controller,
+                                                          endpoint_balancer=endpoint_balancer, naming_backend=naming_backend)
+    except RequestCancelled:
+        return None
+    except Exception as e:
+        return {'path': relative_path, 'name': None, 'error': describe_processing_error(image_path, e)}
+    result_text = extract_suggestion(response_data)
+    if not result_text:
+        return {'path': relative_path, 'name': None,
+                'error': f"API响应无效或内容为空: {response_data.get('error', response_data)}"}
+    if not from_cache and result_cache is not None:
+        result_cache.put(cache_key, result_text)
+    return {'path': relative_path, 'name': result_text, 'error': None}
+
+
+def run_worker(config, coordinator, output_text_signal_emit, stop_event, worker_id=None):
+    """
+    工作节点：从协调者租用工作单元，用本机的 API Key、线程池和结果缓存为其中的图片命名并交回结果。
+
+    Up to Distributed_prefetch_units units are worked on at once so the thread pool doesn't idle at
+    unit boundaries; leases are renewed every third of Distributed_lease_seconds. The worker exits
+    once the run it worked on is finished, on stop (unfinished units are released), after
+    Worker_idle_timeout seconds without work, or when the coordinator has been unreachable for
+    Distributed_lease_seconds while units are held (their leases have expired there by then, so
+    they are dropped). Returns (units, images_named, images_failed).
+    Naming_backend 'local' / 'hybrid' uses this machine's model; RuntimeError if it cannot be loaded.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    naming_backend = create_naming_backend(config, output_text_signal_emit) # Raises before any unit is leased
+    client = open_lease_client(coordinator, config)
+    max_workers = int(config.get('Max_workers', 5))
+    lease_seconds = float(config.get('Distributed_lease_seconds', 60))
+    prefetch_units = max(1, int(config.get('Distributed_prefetch_units', 2)))
+    idle_timeout = float(config.get('Worker_idle_timeout', 300))
+    http_session = create_http_session(config)
+    concurrency_controller = create_concurrency_controller(config, max_workers)
+    endpoint_balancer = create_endpoint_balancer(config)
+    result_cache = open_result_cache(config, output_text_signal_emit)
+    output_text_signal_emit(f"工作节点 {worker_id} 已启动：协调者 {coordinator}，线程数 {max_workers}")
+
+    active_units = {} # unit id -> {'remaining', 'results', 'renewed'}
+    futures = {} # future -> unit id
+    units_done = named = failed = 0
+    seen_run = None
+    lease_failures = 0
+    unreachable_since = None
+    last_unreachable_log = 0.0
+    last_work = time.monotonic()
+
+    def note_unreachable(error):
+        nonlocal unreachable_since, last_unreachable_log
+        now = time.monotonic()
+        if unreachable_since is None:
+            unreachable_since = now
+        if now - last_unreachable_log >= UNREACHABLE_LOG_INTERVAL:
+            last_unreachable_log = now
+            output_text_signal_emit(f"工作节点：无法连接协调者，稍后重试: {error}")
+
+    def note_reachable():
+        nonlocal unreachable_since, last_unreachable_log
+        unreachable_since = None
+        last_unreachable_log = 0.0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            while not stop_event.is_set():
+                while len(active_units) < prefetch_units:
+                    try:
+                        lease = client.lease(worker_id, lease_seconds)
+                    except Exception as e:
+                        lease_failures += 1
+                        note_unreachable(e)
+                        # The coordinator shuts its service down when the run ends
+                        if seen_run is not None and not active_units and lease_failures >= COORDINATOR_GONE_ATTEMPTS:
+                            output_text_signal_emit(f"工作节点：协调者已关闭，运行 {seen_run} 结束。")
+                            return units_done, named, failed
+                        break
+                    lease_failures = 0
+                    note_reachable()
+                    if lease['unit'] is None:
+                        if lease['finished'] and seen_run is not None and not active_units:
+                            output_text_signal_emit(f"工作节点：运行 {seen_run} 已结束。")
+                            return units_done, named, failed
+                        break
+                    seen_run = lease['run']
+                    last_work = time.monotonic()
+                    unit_config = dict(config, **lease['settings'])
+                    root = config.get('Worker_source_root') or lease['source_folder']
+                    active_units[lease['unit']] = {'remaining': len(lease['paths']), 'results': [],
+                                                   'renewed': time.monotonic()}
+                    output_text_signal_emit(f"工作节点：租用工作单元 {lease['unit']}（{len(lease['paths'])}张）")
+                    for relative_path in lease['paths']:
+                        image_path = os.path.join(root, *relative_path.split('/'))
+                        futures[executor.submit(_name_one, image_path, relative_path, unit_config, output_text_signal_emit,
+                                                stop_event, result_cache, http_session, concurrency_controller,
+                                                endpoint_balancer, naming_backend)] = lease['unit']
+                    if not lease['paths']:
+                        active_units[lease['unit']]['remaining'] = 0
+
+                if futures:
+                    done, _ = concurrent.futures.wait(list(futures), timeout=1.0,
+                                                      return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        unit_id = futures.pop(future)
+                        result = future.result()
+                        unit = active_units[unit_id]
+                        unit['remaining'] -= 1
+                        if result is not None:
+                            unit['results'].append(result)
+                for unit_id, unit in list(active_units.items()):
+                    if stop_event.is_set():
+                        break
+                    try:
+                        if unit['remaining'] == 0:
+                            accepted = client.complete(unit_id, worker_id, unit['results'])
+                        elif time.monotonic() - unit['renewed'] >= lease_seconds / 3:
+                            unit['renewed'] = time.monotonic()
+                            renewed = client.heartbeat(unit_id, worker_id, lease_seconds)
+                            note_reachable()
+                            if not renewed:
+                                output_text_signal_emit(f"工作节点：工作单元 {unit_id} 的租约已失效。")
+                            continue
+                        else:
+                            continue
+                    except Exception as e:
+                        note_unreachable(e) # Unit kept, retried next round
+                        continue
+                    note_reachable()
+                    del active_units[unit_id]
+                    last_work = time.monotonic()
+                    if not accepted:
+                        output_text_signal_emit(f"工作节点：工作单元 {unit_id} 已被重新分配并完成，本次结果丢弃。")
+                        continue
+                    units_done += 1
+                    named += sum(1 for result in unit['results'] if result['name'])
+                    failed += sum(1 for result in unit['results'] if not result['name'])
+                    output_text_signal_emit(f"工作节点：交回工作单元 {unit_id}（累计命名{named}张，失败{failed}张）")
+                if (active_units and unreachable_since is not None
+                        and time.monotonic() - unreachable_since >= lease_seconds):
+                    output_text_signal_emit(f"工作节点：协调者已{lease_seconds:.0f}秒无法连接，放弃未交回的"
+                                            f"{len(active_units)}个工作单元（租约已到期），退出。")
+                    for future in futures:
+                        future.cancel()
+                    futures.clear()
+                    active_units.clear() # Nothing to release: the coordinator is gone or re-issues them anyway
+                    break
+                if not futures and not active_units:
+                    if time.monotonic() - last_work >= idle_timeout:
+                        output_text_signal_emit(f"工作节点：{idle_timeout:.0f}秒内没有工作单元，退出。")
+                        break
+                    stop_event.wait(1.0)
+                elif not futures:
+                    stop_event.wait(1.0) # Only hand-ins left that failed to reach the coordinator
+        finally:
+            for future in futures:
+                future.cancel()
+            for unit_id in active_units:
+                try:
+                    client.release(unit_id, worker_id)
+                except Exception:
+                    pass # The lease expires on its own
+            if naming_backend is not None:
+                naming_backend.close()
+                output_text_signal_emit(naming_backend.summary())
+            if endpoint_balancer.is_multi:
+                output_text_signal_emit(endpoint_balancer.summary())
+            output_text_signal_emit(http_session.summary())
+            http_session.close()
+            if result_cache is not None:
+                result_cache.close()
+            client.close()
+    return units_done, named, failed
@@ -0,0 +1,297 @@
+# endpoints.py
+"""
+多端点负载均衡：Endpoints 列出若干 Base_url / Api_key / Model 组合（带权重和各自的并发上限），
+每次请求（包括每次重试）都由 EndpointBalancer 选择端点。
+
+    "Endpoints": [
+        {"name": "main", "base_url": "https://a.example", "api_key": "sk-...", "weight": 2, "max_concurrency": 16},
+        {"base_url": "https://b.example", "api_key": "sk-...", "model": "gpt-4.1-mini"}
+    ]
+
+Missing base_url / api_key fall back to Base_url / Api_key and a missing model keeps the run's Model;
+an empty list means the single configured endpoint.
+"""
+import threading
+import time
+from urllib.parse import urlsplit
+
+from ratelimit import AsyncWaitQueue
+
+DEFAULT_API_URL = "https://yunwu.ai/v1/chat/completions"
+EWMA_ALPHA = 0.3
+
+
+def resolve_endpoint_url(base_url):
+    """The chat-completions URL of a Base_url (the API host); the default provider when empty."""
+    base_url = (base_url or '').strip()
+    return f"{base_url.rstrip('/')}/v1/chat/completions" if base_url else DEFAULT_API_URL
+
+
+class Endpoint:
+    """
+    One Endpoints entry and its routing state (guarded by the balancer's lock).
+    model None keeps the model of the request (the run's Model).
+    """
+    def __init__(self, name, url, api_key, model, weight=1.0, max_concurrency=0):
+        self.name = name
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.weight = max(0.01, float(weight))
+        self.max_concurrency = max(0, int(max_concurrency or 0)) # 0: only the run's overall limit applies
+
+        self.outstanding = 0
+        self.ewma_latency = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.probing = False
+        self.paused_until = 0.0
+
+        self.requests = 0
+        self.successes = 0
+        self.errors = 0
+        self.throttled = 0
+        self.latency_total = 0.0
+        self.latency_count = 0
+
+    def has_capacity(self):
+        return not self.max_concurrency or self.outstanding < self.max_concurrency
+
+
+def route_request(endpoint, url, headers, data):
+    """
+    (url, headers, json_body) of a request sent to endpoint; unchanged when endpoint is None.
+    The body is copied shallowly, so the image payload is shared rather than duplicated.
+    """
+    if endpoint is None:
+        return url, headers, data
+    if endpoint.model:
+        data = dict(data, model=endpoint.model)
+    return endpoint.url, dict(headers, Authorization=f"Bearer {endpoint.api_key}"), data
+
+
+class EndpointBalancer:
+    """
+    选择端点：在未被剔除、未暂停且未达并发上限的端点中，取 (进行中请求数 + 1) × EWMA 延迟 / 权重 最小者。
+    连续失败（5xx、超时、429/503）达到 eject_after 次的端点被剔除 eject_seconds 秒（再次剔除时加倍，最多 8 倍），
+    到期后先放行一个探测请求，成功才恢复正常路由。
+
+    When every endpoint is ejected the ones whose ejection ends first are used anyway, so a run never stalls
+    on health checks alone. A single endpoint is never ejected; the balancer then only adds statistics.
+    """
+    def __init__(self, endpoints, eject_after=3, eject_seconds=30.0):
+        if not endpoints:
+            raise ValueError("EndpointBalancer needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self.eject_after = max(1, int(eject_after))
+        self.eject_seconds = max(0.0, float(eject_seconds))
+        self.condition = threading.Condition()
+        self.async_waiters = AsyncWaitQueue(self.condition)
+
+    @property
+    def is_multi(self):
+        return len(self.endpoints) > 1
+
+    def _latency_estimate(self, endpoint):
+        if endpoint.ewma_latency is not None:
+            return endpoint.ewma_latency
+        known = [other.ewma_latency for other in self.endpoints if other.ewma_latency is not None]
+        # Unmeasured endpoints look as fast as the fastest one, so each gets tried early
+        return min(known) if known else 1.0
+
+    def _score(self, endpoint):
+        return (endpoint.outstanding + 1) * self._latency_estimate(endpoint) / endpoint.weight
+
+    def _pick(self, now):
+        candidates = []
+        all_ejected = True
+        for endpoint in self.endpoints:
+            if endpoint.ejected_until > now:
+                continue
+            all_ejected = False
+            if endpoint.paused_until > now or not endpoint.has_capacity():
+                continue
+            # Re-admission: one probe request at a time until it succeeds
+            if endpoint.ejections and endpoint.consecutive_failures >= self.eject_after:
+                if endpoint.probing:
+                    continue
+            candidates.append(endpoint)
+        if all_ejected:
+            ejected_until = min(endpoint.ejected_until for endpoint in self.endpoints)
+            candidates = [endpoint for endpoint in self.endpoints
+                          if endpoint.ejected_until == ejected_until and endpoint.has_capacity()]
+        if not candidates:
+            return None
+        endpoint = min(candidates, key=self._score)
+        if endpoint.ejections and endpoint.consecutive_failures >= self.eject_after:
+            endpoint.probing = True
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        return endpoint
+
+    def try_acquire(self):
+        with self.condition:
+            return self._pick(time.monotonic())
+
+    def acquire(self, stop_event=None):
+        """
+        Blocks until an endpoint can take a request; returns it, or None if stop_event was set while waiting.
+        """
+        with self.condition:
+            while True:
+                if stop_event is not None and stop_event.is_set():
+                    return None
+                endpoint = self._pick(time.monotonic())
+                if endpoint is not None:
+                    return endpoint
+                self.condition.wait(timeout=0.2)
+
+    async def acquire_async(self, stop_event=None):
+        """Like acquire(), for coroutines: they are woken by release() / cancel() and served in arrival order."""
+        return await self.async_waiters.acquire(self._pick, stop_event)
+
+    def release(self, endpoint, latency=None, outcome='success', retry_after=None):
+        """
+        Records the attempt on endpoint and returns (latency, outcome) to report to the run's
+        AdaptiveConcurrencyController. With several endpoints a throttled or failing one is handled here
+        (pause / ejection), so it is reported as 'neutral' instead of shrinking the concurrency every other
+        endpoint shares, and latency is left out: a mix of fast and slow endpoints is not congestion.
+        """
+        with self.condition:
+            now = time.monotonic()
+            endpoint.outstanding = max(0, endpoint.outstanding - 1)
+            endpoint.probing = False
+            if outcome in ('success', 'neutral'):
+                if latency is not None:
+                    endpoint.ewma_latency = (latency if endpoint.ewma_latency is None
+                                             else (1 - EWMA_ALPHA) * endpoint.ewma_latency + EWMA_ALPHA * latency)
+                    endpoint.latency_total += latency
+                    endpoint.latency_count += 1
+                endpoint.successes += outcome == 'success'
+                endpoint.consecutive_failures = 0
+            else:
+                if outcome == 'throttled':
+                    endpoint.throttled += 1
+                    if retry_after and self.is_multi:
+                        endpoint.paused_until = max(endpoint.paused_until, now + retry_after)
+                else:
+                    endpoint.errors += 1
+                endpoint.consecutive_failures += 1
+                if self.is_multi and endpoint.consecutive_failures >= self.eject_after:
+                    # Repeat ejections back off: 1x, 2x, 4x, 8x eject_seconds
+                    factor = 2 ** min(3, endpoint.ejections)
+                    endpoint.ejected_until = now + self.eject_seconds * factor
+                    endpoint.ejections += 1
+            self.condition.notify_all()
+            self.async_waiters.wake()
+        if not self.is_multi:
+            return latency, outcome
+        return None, 'neutral' if outcome in ('throttled', 'error') else outcome
+
+    def cancel(self, endpoint):
+        """Gives back an endpoint that was acquired but never used (e.g. the run's slot wait was cancelled)."""
+        with self.condition:
+            endpoint.outstanding = max(0, endpoint.outstanding - 1)
+            endpoint.requests = max(0, endpoint.requests - 1)
+            endpoint.probing = False
+            self.condition.notify_all()
+            self.async_waiters.wake()
+
+    def summary(self):
+        with self.condition:
+            total = sum(endpoint.requests for endpoint in self.endpoints) or 1
+            lines = ["端点统计："]
+            for endpoint in self.endpoints:
+                mean_latency = (endpoint.latency_total / endpoint.latency_count) if endpoint.latency_count else 0.0
+                state = "已剔除" if endpoint.ejected_until > time.monotonic() else "正常"
+                model = f"{endpoint.model}，" if endpoint.model else ""
+                lines.append(
+                    f"  {endpoint.name}（{model}权重{endpoint.weight:g}）：请求{endpoint.requests}次"
+                    f"（{endpoint.requests * 100 / total:.0f}%），成功{endpoint.successes}，错误{endpoint.errors}，"
+                    f"限流{endpoint.throttled}，平均延迟{mean_latency * 1000:.0f}ms，剔除{endpoint.ejections}次，当前{state}")
+        return "\n".join(lines)
+
+
+def get_endpoint_configs(config):
+    """
+    The Endpoints entries with Base_url / Api_key filled in; the single configured endpoint when empty.
+    """
+    entries = config.get('Endpoints') or []
+    if not entries:
+        entries = [{}]
+    endpoint_configs = []
+    for index, entry in enumerate(entries, 1):
+        base_url = entry.get('base_url') or config.get('Base_url', '')
+        url = resolve_endpoint_url(base_url)
+        endpoint_configs.append({
+            'name': entry.get('name') or (f"#{index} {urlsplit(url).netloc}" if len(entries) > 1 else "默认端点"),
+            'url': url,
+            'api_key': entry.get('api_key') or config.get('Api_key', ''),
+            'model': entry.get('model') or None,
+            'weight': entry.get('weight', 1),
+            'max_concurrency': entry.get('max_concurrency', 0),
+        })
+    return endpoint_configs
+
+
+def has_api_key(config):
+    """Whether every endpoint the run would use has an API key."""
+    return all(endpoint['api_key'] for endpoint in get_endpoint_configs(config))
+
+
+def create_endpoint_balancer(config):
+    endpoints = [Endpoint(**endpoint) for endpoint in get_endpoint_configs(config)]
+    return EndpointBalancer(endpoints, eject_after=config.get('Endpoint_eject_after', 3),
+                            eject_seconds=config.get('Endpoint_eject_seconds', 30.0))
+
+
+def parse_endpoint_spec(spec):
+    """
+    One --endpoint value, 'base_url=URL,api_key=KEY,model=M,weight=2,max_concurrency=8' (keys may be
+    shortened to url / key / max), as an Endpoints entry.
+    """
+    aliases = {'url': 'base_url', 'key': 'api_key', 'max': 'max_concurrency'}
+    entry = {}
+    for part in spec.split(','):
+        name, separator, value = part.partition('=')
+        name = aliases.get(name.strip(), name.strip())
+        if not separator or name not in ('name', 'base_url', 'api_key', 'model', 'weight', 'max_concurrency'):
+            raise ValueError(f"--endpoint 参数格式应为 url=...,key=...,model=...,weight=...,max=...: {spec}")
+        value = value.strip()
+        if name == 'weight':
+            value = float(value)
+        elif name == 'max_concurrency':
+            value = int(value)
+        entry[name] = value
+    return entry
+
+
+def format_endpoint_lines(entries):
+    """The GUI's text form: one 'URL | KEY | MODEL | WEIGHT | MAX' line per entry, trailing blanks dropped."""
+    lines = []
+    for entry in entries:
+        fields = [entry.get('base_url') or '', entry.get('api_key') or '', entry.get('model') or '',
+                  f"{float(entry['weight']):g}" if entry.get('weight') is not None else '',
+                  str(entry['max_concurrency']) if entry.get('max_concurrency') else '']
+        while fields and not fields[-1]:
+            fields.pop()
+        lines.append(" | ".join(fields))
+    return "\n".join(lines)
+
+
+def parse_endpoint_lines(text):
+    """Inverse of format_endpoint_lines; blank fields fall back to the main settings, '#' lines are skipped."""
+    entries = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = [field.strip() for field in line.split('|')] + [''] * 5
+        entry = {key: value for key, value in zip(('base_url', 'api_key', 'model'), fields[:3]) if value}
+        if fields[3]:
+            entry['weight'] = float(fields[3])
+        if fields[4]:
+            entry['max_concurrency'] = int(fields[4])
+        entries.append(entry)
+    return entries
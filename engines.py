@@ -0,0 +1,20 @@
+# engines.py
+# Engine registry shared by the GUI and the command line; every engine has the
+# process_images_concurrently signature and return value.
+
+ENGINES = {'threads': "线程池", 'async': "异步 (asyncio)", 'pipeline': "分阶段流水线 (多进程预处理)",
+           'distributed': "分布式协调者 (工作节点: cli.py --worker)"}
+
+
+def get_engine(name):
+    if name == 'async':
+        from async_engine import process_images_async
+        return process_images_async
+    if name == 'distributed':
+        from distributed import process_images_distributed
+        return process_images_distributed
+    if name == 'pipeline':
+        from pipeline import process_images_pipeline
+        return process_images_pipeline
+    from function import process_images_concurrently
+    return process_images_concurrently
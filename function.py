@@ -1,23 +1,33 @@
 # function.py
-from PIL import Image
 import io
 import concurrent.futures
+import contextlib
 import re
+import fnmatch
+import itertools
 import base64
-import requests
-import shutil
+import sys
 import os
 import json
 import threading
-# Note: 'sys' and 'datetime' from original full script are not directly used in these functions.
+import time
+from decoding import open_image
+from cache import build_cache_key, hash_file_content, open_result_cache
+from dedup import cluster_similar_images
+from backends import create_naming_backend
+from endpoints import create_endpoint_balancer, get_endpoint_configs, resolve_endpoint_url, route_request
+from http_client import create_http_session, get_request_timeout
+from metrics import create_stage_metrics, stage_timer
+from journal import load_resume_state, mark as mark_journal, open_run_journal
+from payload import (EncodedImage, describe_payload, describe_upload_settings, get_payload_settings, optimize_payload,
+                     payload_signature)
+from placement import NameRegistry, PlacementTotals, move_file, place_file
+from report import StreamingReport, parse_report_formats, write_report
+from ratelimit import (RequestCancelled, THROTTLE_STATUS, RETRYABLE_STATUS, parse_retry_after, backoff_delay,
+                       create_concurrency_controller, get_retry_settings)
+# Note: 'datetime' from original full script is not directly used in these functions.
 # 'QApplication' from PyQt5 is not used here.
-
-# Added for Excel generation
-try:
-    import openpyxl
-    from openpyxl.utils import get_column_letter
-except ImportError:
-    openpyxl = None # Flag that openpyxl is not available
+# PIL, requests and openpyxl are imported on first use so that importing this module (GUI start, CLI start) stays cheap.
 
 
 def sanitize_filename(filename):
@@ -34,10 +44,13 @@ def encode_image(image_path):
 def remove_punctuation_at_end(sentence):
     return re.sub(r'[。？！，、；：“”‘’《》（）【】『』「」\[\]\.,;:"\'?!(){}<>]+$', '', sentence)
 
-def compress_and_encode_image(image_path, quality=85, max_size=(1080, 1080)):
+def compress_and_encode_image(image_path, quality=85, max_size=(1080, 1080), fast_decode=True, stage_metrics=None,
+                              raster_cache=None):
     try:
-        with Image.open(image_path) as img:
-            img.thumbnail(max_size)
+        # Reduced-resolution decoding / embedded EXIF thumbnail, SVG/HEIC decoders, see decoding.py
+        img = open_image(image_path, max_size, fast_decode=fast_decode, stage_metrics=stage_metrics,
+                         raster_cache=raster_cache)
+        with img:
             if img.mode in ('RGBA', 'LA', 'P') and (img.format != 'JPEG' and img.format != 'WEBP'):
                 if img.format != 'PNG':
                     img = img.convert('RGB')
@@ -60,14 +73,15 @@ def compress_and_encode_image(image_path, quality=85, max_size=(1080, 1080)):
             elif output_format == 'WEBP':
                  save_params['quality'] = quality
 
-            if output_format == 'JPEG' and img.mode == 'RGBA':
-                img_to_save = img.convert('RGB')
-                img_to_save.save(img_bytes, format=output_format, **save_params)
-            else:
-                img.save(img_bytes, format=output_format, **save_params)
+            with stage_timer(stage_metrics, 'encode'):
+                if output_format == 'JPEG' and img.mode == 'RGBA':
+                    img_to_save = img.convert('RGB')
+                    img_to_save.save(img_bytes, format=output_format, **save_params)
+                else:
+                    img.save(img_bytes, format=output_format, **save_params)
 
-            img_bytes.seek(0)
-            base64_encoded = base64.b64encode(img_bytes.read()).decode('utf-8')
+            with stage_timer(stage_metrics, 'base64'):
+                base64_encoded = base64.b64encode(img_bytes.getbuffer()).decode('utf-8')
         return base64_encoded, mime_type, output_format
     except FileNotFoundError:
         raise
@@ -75,6 +89,10 @@ def compress_and_encode_image(image_path, quality=85, max_size=(1080, 1080)):
         raise RuntimeError(f"Error during image compression/encoding for {image_path}: {e}")
 
 
+# Bounding box of the original upload path (Upload_format 'original'); the optimizer derives its size from the tiling
+LEGACY_MAX_SIZE = (512, 512)
+
+
 def get_unique_filename(filepath):
     base, ext = os.path.splitext(filepath)
     counter = 1
@@ -98,153 +116,779 @@ class Counter:
         with self.lock:
             return self.value
 
-# Modified to include renaming_data_list and ensure all attempts are logged for Excel
-def process_image(image_path, config, output_text_signal_emit, stop_event, success_counter, failure_counter, num_counter, active_counter, renaming_data_list):
-    current_original_filename = os.path.basename(image_path)
-    try:
-        if stop_event.is_set():
-            return # Not processed, so not added to Excel as "failed"
-
-        active_counter.increment()
-
-        api_key = config['Api_key']
-        base_url = (
-            f"{config['Base_url'].strip().rstrip('/')}/v1/chat/completions"
-            if config.get('Base_url', '').strip()
-            else "https://yunwu.ai/v1/chat/completions"
-        )
-        prompt = config['Prompt']
-        image_quality_percent = int(config.get('Image_quality_percent', 85))
-        quality_value = min(95, max(1, image_quality_percent))
-
-        original_format = os.path.splitext(image_path)[1][1:].upper()
-        if not original_format: original_format = "PNG" # Default format
-
-        encoded_image, mime_type, image_format = compress_and_encode_image(image_path, quality=quality_value, max_size=(512, 512))
-
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "model": config["Model"],
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{encoded_image}"}}
-                    ]
-                }
-            ],
-            "max_tokens": 300
-        }
-
-        response = requests.post(base_url, headers=headers, json=data, timeout=60)
-        response.raise_for_status() # Will raise HTTPError for bad responses (4xx or 5xx)
-        response_data = response.json()
-
-        if 'choices' in response_data and len(response_data['choices']) > 0 and \
-           isinstance(response_data['choices'][0].get('message'), dict) and \
-           response_data['choices'][0]['message'].get('content'):
-            result_text = response_data['choices'][0]['message']['content']
-            result_text = sanitize_filename(result_text)
-
-            renaming_data_list.append({'original_name': current_original_filename, 'new_name_suggestion': result_text})
-
-            new_name = f"{result_text}.{original_format.lower()}"
-            output_mode = config.get('output_mode', 'finish_subfolder')
-
-            if output_mode == 'custom':
-                target_dir = config.get('custom_output_folder', '')
-                if not target_dir:
-                    output_text_signal_emit(f"错误：自定义输出文件夹未在配置中正确设置。跳过 {current_original_filename}")
-                    renaming_data_list.append({'original_name': current_original_filename, 'new_name_suggestion': ''}) # Ensure logged
-                    failure_counter.increment(); num_counter.increment(); active_counter.decrement(); return
-            elif output_mode == 'in_place':
-                target_dir = os.path.dirname(image_path)
-            else: # finish_subfolder
-                target_dir = os.path.join(os.path.dirname(image_path), 'Finish')
-
-            if not os.path.exists(target_dir):
-                try:
-                    os.makedirs(target_dir, exist_ok=True)
-                except OSError as e:
-                    output_text_signal_emit(f"创建文件夹失败 '{target_dir}': {e}. 跳过 {current_original_filename}")
-                    # Already added to renaming_data_list if API was successful, if not, added in API error block
-                    # If API was success, but folder creation failed, the suggestion was made.
-                    # To mark it as truly failed for renaming, we might need to update the entry or handle differently.
-                    # For now, if API success, it's logged with suggestion, even if file op fails.
-                    # To ensure it's blank if file op fails:
-                    # We need to ensure renaming_data_list has an empty suggestion if this part fails.
-                    # However, the request is about "生成失败的图片" (generation failed, i.e. AI suggestion).
-                    # If AI suggestion is there, but file op fails, the suggestion still exists.
-                    # This logic primarily targets AI failure.
-                    failure_counter.increment(); num_counter.increment(); active_counter.decrement(); return
-
-
-            target_path = os.path.join(target_dir, new_name)
-            target_path = get_unique_filename(target_path)
-
-            operation_verb = ""
-            if output_mode == 'in_place':
-                shutil.move(image_path, target_path)
-                operation_verb = "在原位置重命名"
-            else:
-                shutil.copy2(image_path, target_path)
-                operation_verb = "复制并重命名到新位置"
+def resolve_api_url(config):
+    return resolve_endpoint_url(config.get('Base_url', ''))
+
+
+def build_image_part(encoded_image, mime_type, detail=None):
+    """One image_url content part; detail 'low' / 'high' is only sent when chosen (Upload_detail)."""
+    image_url = {"url": f"data:{mime_type};base64,{encoded_image}"}
+    if detail in ('low', 'high'):
+        image_url["detail"] = detail
+    return {"type": "image_url", "image_url": image_url}
 
-            success_counter.increment()
-            num_counter.increment()
-            output_text_signal_emit(f"第{num_counter.get_value()}张图片处理完成：{current_original_filename} 已{operation_verb}为 {target_dir} (目录: {os.path.basename(target_dir)})")
+
+def encode_image_payload(image_path, payload_settings, stage_metrics=None):
+    """
+    Returns a payload.EncodedImage for the upload: the payload optimizer, or for Upload_format 'original'
+    the previous compress_and_encode_image path at LEGACY_MAX_SIZE.
+    """
+    if payload_settings.upload_format != 'original':
+        return optimize_payload(image_path, payload_settings, stage_metrics)
+    started = time.perf_counter()
+    encoded_image, mime_type, image_format = compress_and_encode_image(image_path, quality=payload_settings.quality,
+                                                                       max_size=LEGACY_MAX_SIZE, stage_metrics=stage_metrics,
+                                                                       raster_cache=payload_settings.raster_cache)
+    return EncodedImage(encoded_image, mime_type, image_format, None, None, len(encoded_image) * 3 // 4,
+                        time.perf_counter() - started, payload_settings.detail)
+
+
+def build_chat_request(config, prompt, encoded_image, mime_type, detail=None):
+    """
+    Returns (headers, json_body) for a single-image chat-completions request.
+    """
+    headers = {
+        "Authorization": f"Bearer {config['Api_key']}",
+        "Content-Type": "application/json"
+    }
+    data = {
+        "model": config["Model"],
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    build_image_part(encoded_image, mime_type, detail)
+                ]
+            }
+        ],
+        "max_tokens": 300
+    }
+    return headers, data
+
+
+def extract_suggestion(response_data):
+    if 'choices' in response_data and len(response_data['choices']) > 0 and \
+       isinstance(response_data['choices'][0].get('message'), dict) and \
+       response_data['choices'][0]['message'].get('content'):
+        return sanitize_filename(response_data['choices'][0]['message']['content'])
+    return None
+
+
+def send_with_retries(send, concurrency_controller, config, stop_event, output_text_signal_emit, image_name,
+                      endpoint_balancer=None):
+    """
+    在自适应并发控制下发送请求：429/503 遵循 Retry-After，5xx/超时/连接错误按带抖动的指数退避重试。
+    send(endpoint) performs one attempt; with an endpoint_balancer every attempt, retries included, goes to the
+    endpoint it picks (endpoint is None without one).
+    Returns the last response (the caller still calls raise_for_status) or re-raises the last network error.
+    """
+    import requests
+    max_retries, backoff_base, backoff_cap = get_retry_settings(config)
+    attempt = 0
+    while True:
+        if not concurrency_controller.acquire(stop_event):
+            raise RequestCancelled()
+        endpoint = None
+        if endpoint_balancer is not None:
+            endpoint = endpoint_balancer.acquire(stop_event)
+            if endpoint is None:
+                concurrency_controller.release(outcome='neutral')
+                raise RequestCancelled()
+        started = time.monotonic()
+        retry_after = None
+        try:
+            response = send(endpoint)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            concurrency_controller.release(*release_endpoint(endpoint_balancer, endpoint, None, 'error'))
+            if attempt >= max_retries:
+                raise
+            reason = f"{type(e).__name__}"
+        except BaseException:
+            release_endpoint(endpoint_balancer, endpoint, None, 'neutral')
+            concurrency_controller.release(outcome='neutral')
+            raise
         else:
-            failure_counter.increment()
-            num_counter.increment()
-            output_text_signal_emit(f"API响应无效或内容为空 ({current_original_filename}): {response_data.get('error', response_data)}")
-            renaming_data_list.append({'original_name': current_original_filename, 'new_name_suggestion': ''})
+            latency = time.monotonic() - started
+            status = response.status_code
+            if status in THROTTLE_STATUS:
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                reported_latency, outcome = release_endpoint(endpoint_balancer, endpoint, latency, 'throttled', retry_after)
+                concurrency_controller.release(reported_latency, outcome)
+                if retry_after and outcome == 'throttled':
+                    concurrency_controller.pause(min(retry_after, backoff_cap))
+            elif status in RETRYABLE_STATUS:
+                concurrency_controller.release(*release_endpoint(endpoint_balancer, endpoint, latency, 'error'))
+            else:
+                outcome = 'success' if status < 400 else 'neutral'
+                concurrency_controller.release(*release_endpoint(endpoint_balancer, endpoint, latency, outcome))
+                concurrency_controller.maybe_report(output_text_signal_emit)
+                return response
+            if attempt >= max_retries:
+                return response
+            reason = f"HTTP {status}"
 
-    except FileNotFoundError:
+        delay = backoff_delay(attempt, backoff_base, backoff_cap, retry_after)
+        if endpoint_balancer is not None and endpoint_balancer.is_multi:
+            # Another endpoint can take the retry; the failing one is paused or ejected by the balancer
+            delay = min(delay, backoff_base)
+        attempt += 1
+        concurrency_controller.record_retry()
+        where = f"{endpoint.name}: " if endpoint is not None and endpoint_balancer.is_multi else ""
+        output_text_signal_emit(f"请求失败 ({image_name}): {where}{reason}，{delay:.1f}秒后第{attempt}次重试")
+        if stop_event is not None and stop_event.wait(delay):
+            raise RequestCancelled()
+        elif stop_event is None:
+            time.sleep(delay)
+
+
+def release_endpoint(endpoint_balancer, endpoint, latency, outcome, retry_after=None):
+    """Reports an attempt to the balancer; returns the (latency, outcome) for the run's concurrency controller."""
+    if endpoint_balancer is None or endpoint is None:
+        return latency, outcome
+    return endpoint_balancer.release(endpoint, latency, outcome, retry_after)
+
+
+def dispatch_request(send, concurrency_controller, config, stop_event, output_text_signal_emit, label, stage_metrics=None,
+                     endpoint_balancer=None):
+    """
+    Sends through send_with_retries when a concurrency_controller is given, otherwise once (send(None), the
+    configured endpoint). With stage_metrics the final attempt is split into 'request' (upload until response headers,
+    requests' response.elapsed) and 'download'; slot waits, backoffs and failed attempts count as 'wait'.
+    """
+    attempt = send
+    if stage_metrics is not None:
+        last_attempt = [0.0]
+        started = time.perf_counter()
+
+        def attempt(endpoint):
+            attempt_started = time.perf_counter()
+            try:
+                return send(endpoint)
+            finally:
+                last_attempt[0] = time.perf_counter() - attempt_started
+
+    if concurrency_controller is not None:
+        response = send_with_retries(attempt, concurrency_controller, config, stop_event,
+                                     output_text_signal_emit or (lambda message: None), label, endpoint_balancer)
+    else:
+        response = attempt(None)
+
+    if stage_metrics is not None:
+        until_headers = min(response.elapsed.total_seconds(), last_attempt[0])
+        stage_metrics.observe('wait', time.perf_counter() - started - last_attempt[0])
+        stage_metrics.observe('request', until_headers)
+        stage_metrics.observe('download', last_attempt[0] - until_headers)
+    return response
+
+
+def post_chat_request(http_session, config, url, headers, data):
+    """
+    The send(endpoint) callable of dispatch_request for one prepared request: routed to the endpoint,
+    over http_session or, without one, a one-off connection.
+    """
+    def send(endpoint):
+        endpoint_url, endpoint_headers, endpoint_data = route_request(endpoint, url, headers, data)
+        if http_session is not None:
+            return http_session.post(endpoint_url, headers=endpoint_headers, json=endpoint_data)
+        import requests
+        return requests.post(endpoint_url, headers=endpoint_headers, json=endpoint_data, timeout=get_request_timeout(config))
+    return send
+
+
+def request_name_suggestion(image_path, config, api_key, base_url, prompt, payload_settings, http_session=None,
+                            concurrency_controller=None, stop_event=None, output_text_signal_emit=None, stage_metrics=None,
+                            endpoint_balancer=None):
+    """
+    压缩图片并调用 chat-completions 接口，返回解析后的 JSON 响应。
+    payload_settings (payload.get_payload_settings) decide the uploaded size and format.
+    http_session is the run's shared PooledSession; without one a one-off connection is used.
+    With a concurrency_controller the request is throttled and retried by send_with_retries, and an
+    endpoint_balancer (endpoints.py) replaces api_key / base_url / Model with the endpoint of each attempt.
+    """
+    encoded = encode_image_payload(image_path, payload_settings, stage_metrics)
+    if output_text_signal_emit is not None:
+        output_text_signal_emit(describe_payload(os.path.basename(image_path), encoded))
+    headers, data = build_chat_request(dict(config, Api_key=api_key), prompt, encoded.data, encoded.mime_type, encoded.detail)
+    encoded = None # The request body holds the only copy of the payload now
+
+    response = dispatch_request(post_chat_request(http_session, config, base_url, headers, data), concurrency_controller,
+                                config, stop_event, output_text_signal_emit, os.path.basename(image_path), stage_metrics,
+                                endpoint_balancer)
+    response.raise_for_status() # Will raise HTTPError for bad responses (4xx or 5xx)
+    with stage_timer(stage_metrics, 'parse'):
+        return response.json()
+
+
+def lookup_cached_suggestion(image_path, config, result_cache, prompt, payload_settings):
+    """
+    Returns (cache_key, cached_text); both are None when caching is off, cached_text is None on a miss.
+    """
+    if result_cache is None:
+        return None, None
+    variant = '' if payload_settings.upload_format == 'original' else payload_signature(payload_settings)
+    cache_key = build_cache_key(hash_file_content(image_path), config["Model"], prompt, payload_settings.quality,
+                                LEGACY_MAX_SIZE, variant)
+    return cache_key, result_cache.get(cache_key)
+
+
+def record_failure(image_path, message, output_text_signal_emit, failure_counter, num_counter, renaming_data_list, cluster_label=None):
+    failure_counter.increment(); num_counter.increment()
+    output_text_signal_emit(message)
+    renaming_data_list.append({'original_name': os.path.basename(image_path), 'new_name_suggestion': '', 'cluster': cluster_label,
+                               'path': image_path, 'status': 'failed', 'error': message})
+
+
+def get_placement_operation(config):
+    """'move' for in-place renames (undoable from the journal), 'copy' otherwise."""
+    return 'move' if config.get('output_mode') == 'in_place' else 'copy'
+
+
+def describe_processing_error(image_path, error):
+    """
+    把处理过程中的异常转换为日志消息。
+    """
+    current_original_filename = os.path.basename(image_path)
+    if isinstance(error, FileNotFoundError):
+        return f"错误：文件未找到 {current_original_filename}"
+    requests = sys.modules.get('requests') # An HTTP error implies requests was already imported
+    if requests is not None and isinstance(error, requests.exceptions.RequestException): # Includes HTTPError from response.raise_for_status()
+        return f"HTTP请求失败 ({current_original_filename}): {error}"
+    if isinstance(error, RuntimeError): # Custom error from compress_and_encode_image
+        return f"图像处理内部错误 ({current_original_filename}): {error}"
+    return f"处理图片时发生未知错误 ({current_original_filename}): {error}"
+
+
+def handle_name_response(image_path, response_data, config, output_text_signal_emit, success_counter, failure_counter, num_counter, renaming_data_list,
+                         result_cache=None, cache_key=None, from_cache=False, cluster_members=None, saved_calls_counter=None,
+                         stage_metrics=None, name_registry=None):
+    """
+    处理 API（或缓存）返回的命名结果：写缓存、记录 Excel 数据、放置文件及其相似图片。
+    Returns True when a name was obtained, False when the response was unusable (already logged as failure).
+    """
+    current_original_filename = os.path.basename(image_path)
+    cluster_label = current_original_filename if cluster_members else None
+    result_text = extract_suggestion(response_data)
+    if not result_text:
+        record_failure(image_path, f"API响应无效或内容为空 ({current_original_filename}): {response_data.get('error', response_data)}",
+                       output_text_signal_emit, failure_counter, num_counter, renaming_data_list, cluster_label)
+        return False
+
+    if not from_cache and result_cache is not None:
+        result_cache.put(cache_key, result_text)
+
+    # If AI suggestion is there, but file op fails, the suggestion still exists in the report.
+    entry = {'original_name': current_original_filename, 'new_name_suggestion': result_text, 'cluster': cluster_label,
+             'path': image_path}
+    operation = get_placement_operation(config)
+    # Journaled before the file is touched, so a crash mid-placement can still be resolved on resume
+    before_place = lambda target_path: mark_journal(renaming_data_list, image_path, 'named', name=result_text,
+                                                    target=target_path, operation=operation)
+    try:
+        with stage_timer(stage_metrics, 'place'):
+            target_dir, target_path, operation_verb, method, size = place_renamed_file(image_path, result_text, config,
+                                                                                      before_place, name_registry)
+    except PlacementError as e:
+        output_text_signal_emit(str(e))
         failure_counter.increment(); num_counter.increment()
-        output_text_signal_emit(f"错误：文件未找到 {current_original_filename}")
-        renaming_data_list.append({'original_name': current_original_filename, 'new_name_suggestion': ''})
-    except requests.exceptions.RequestException as e: # Includes HTTPError from response.raise_for_status()
+        entry.update(status='failed', error=str(e))
+    except Exception as e:
+        message = describe_processing_error(image_path, e)
+        output_text_signal_emit(message)
         failure_counter.increment(); num_counter.increment()
-        output_text_signal_emit(f"HTTP请求失败 ({current_original_filename}): {e}")
-        renaming_data_list.append({'original_name': current_original_filename, 'new_name_suggestion': ''})
-    except RuntimeError as e: # Custom error from compress_and_encode_image
+        entry.update(status='failed', error=message)
+    else:
+        success_counter.increment()
+        num_counter.increment()
+        entry.update(status='placed', target=target_path, operation=operation, placement=method, size=size)
+        output_text_signal_emit(f"第{num_counter.get_value()}张图片处理完成：{current_original_filename} 已{operation_verb}为 {target_dir} (目录: {os.path.basename(target_dir)})")
+    renaming_data_list.append(entry)
+
+    if cluster_members:
+        saved = place_cluster_members(image_path, cluster_members, result_text, config, output_text_signal_emit,
+                                      success_counter, failure_counter, num_counter, renaming_data_list, name_registry)
+        if saved_calls_counter is not None:
+            for _ in range(saved): saved_calls_counter.increment()
+    return True
+
+
+class PlacementError(Exception):
+    """Raised when a renamed file can't be placed; the message is ready for the log."""
+
+
+MAX_NAME_ATTEMPTS = 20 # Names lost to files created by other programs while the run places its own
+
+
+def resolve_target_dir(image_path, config):
+    output_mode = config.get('output_mode', 'finish_subfolder')
+    if output_mode == 'custom':
+        return config.get('custom_output_folder', '')
+    elif output_mode == 'in_place':
+        return os.path.dirname(image_path)
+    else: # finish_subfolder
+        return os.path.join(os.path.dirname(image_path), 'Finish')
+
+
+def place_renamed_file(image_path, result_text, config, before_place=None, name_registry=None):
+    """
+    按输出模式把图片移动/复制为新名称，返回 (target_dir, target_path, operation_verb, method, size)。
+    Copies follow Placement_strategy (see placement.place_file); method is 'move' for in-place renames.
+    Names come from name_registry (the run's NameRegistry) or, without one, get_unique_filename;
+    an existing file is never overwritten.
+    before_place(target_path) is called once the final name is known, right before the move/copy.
+    """
+    current_original_filename = os.path.basename(image_path)
+    original_format = os.path.splitext(image_path)[1][1:].upper()
+    if not original_format: original_format = "PNG" # Default format
+    new_name = f"{result_text}.{original_format.lower()}"
+    output_mode = config.get('output_mode', 'finish_subfolder')
+
+    target_dir = resolve_target_dir(image_path, config)
+    if not target_dir:
+        raise PlacementError(f"错误：自定义输出文件夹未在配置中正确设置。跳过 {current_original_filename}")
+
+    if not os.path.exists(target_dir):
+        try:
+            os.makedirs(target_dir, exist_ok=True)
+        except OSError as e:
+            raise PlacementError(f"创建文件夹失败 '{target_dir}': {e}. 跳过 {current_original_filename}")
+
+    requested_path = os.path.join(target_dir, new_name)
+    for _ in range(MAX_NAME_ATTEMPTS):
+        target_path = name_registry.reserve(requested_path) if name_registry is not None else get_unique_filename(requested_path)
+        if before_place is not None:
+            before_place(target_path)
+        try:
+            if output_mode == 'in_place':
+                move_file(image_path, target_path)
+                if name_registry is not None:
+                    name_registry.release(image_path)
+                return target_dir, target_path, "在原位置重命名", 'move', 0
+            method, size = place_file(image_path, target_path, config.get('Placement_strategy', 'reflink'))
+        except FileExistsError:
+            continue # Created by another program since the directory scan; the name stays reserved
+        except BaseException:
+            if name_registry is not None:
+                name_registry.release(target_path)
+            raise
+        operation_verb = {'reflink': "克隆并重命名到新位置", 'hardlink': "硬链接并重命名到新位置"}.get(method, "复制并重命名到新位置")
+        return target_dir, target_path, operation_verb, method, size
+    raise PlacementError(f"错误：目标文件夹 '{target_dir}' 中找不到可用的文件名 ({new_name})。跳过 {current_original_filename}")
+
+
+def place_cluster_members(representative_path, member_paths, result_text, config, output_text_signal_emit, success_counter, failure_counter, num_counter, renaming_data_list,
+                          name_registry=None):
+    """
+    Gives every near-duplicate of representative_path the representative's AI name
+    (name_registry.reserve adds the _1, _2 ... suffixes, see place_renamed_file). Returns the number of API calls saved.
+    """
+    saved_calls = 0
+    representative_name = os.path.basename(representative_path)
+    operation = get_placement_operation(config)
+    for member_path in member_paths:
+        member_name = os.path.basename(member_path)
+        before_place = lambda target_path, member_path=member_path: mark_journal(
+            renaming_data_list, member_path, 'named', name=result_text, target=target_path, operation=operation)
+        try:
+            target_dir, target_path, operation_verb, method, size = place_renamed_file(member_path, result_text, config,
+                                                                                      before_place, name_registry)
+        except PlacementError as e:
+            failure_counter.increment(); num_counter.increment()
+            output_text_signal_emit(str(e))
+            renaming_data_list.append({'original_name': member_name, 'new_name_suggestion': '', 'cluster': representative_name,
+                                       'path': member_path, 'status': 'failed', 'error': str(e)})
+            continue
+        except Exception as e:
+            failure_counter.increment(); num_counter.increment()
+            message = f"处理图片时发生未知错误 ({member_name}): {e}"
+            output_text_signal_emit(message)
+            renaming_data_list.append({'original_name': member_name, 'new_name_suggestion': '', 'cluster': representative_name,
+                                       'path': member_path, 'status': 'failed', 'error': message})
+            continue
+        renaming_data_list.append({'original_name': member_name, 'new_name_suggestion': result_text, 'cluster': representative_name,
+                                   'path': member_path, 'status': 'placed', 'target': target_path, 'operation': operation,
+                                   'placement': method, 'size': size})
+        saved_calls += 1
+        success_counter.increment()
+        num_counter.increment()
+        output_text_signal_emit(f"第{num_counter.get_value()}张图片处理完成：{member_name} 与 {representative_name} 相似，复用命名，已{operation_verb}为 {target_path} (目录: {os.path.basename(target_dir)})")
+    return saved_calls
+
+
+def fail_cluster_members(representative_path, member_paths, output_text_signal_emit, failure_counter, num_counter, renaming_data_list):
+    representative_name = os.path.basename(representative_path)
+    for member_path in member_paths:
+        member_name = os.path.basename(member_path)
         failure_counter.increment(); num_counter.increment()
-        output_text_signal_emit(f"图像处理内部错误 ({current_original_filename}): {e}")
-        renaming_data_list.append({'original_name': current_original_filename, 'new_name_suggestion': ''})
+        message = f"跳过 {member_name}：同组代表图片 {representative_name} 命名失败"
+        output_text_signal_emit(message)
+        renaming_data_list.append({'original_name': member_name, 'new_name_suggestion': '', 'cluster': representative_name,
+                                   'path': member_path, 'status': 'failed', 'error': message})
+
+
+def name_image(image_path, config, output_text_signal_emit, stop_event, result_cache=None, http_session=None,
+               concurrency_controller=None, stage_metrics=None, endpoint_balancer=None, naming_backend=None):
+    """
+    The naming half of process_image: the local naming_backend (backends.py) when there is one, otherwise
+    (or, in hybrid mode, when its confidence is too low) result cache lookup and compress + API request.
+    Returns (response_data, cache_key, from_cache); nothing is placed or journaled. Local names are
+    returned with from_cache=True so they never enter the result cache of the remote model.
+    """
+    if naming_backend is not None:
+        local_name, confidence = naming_backend.suggest(image_path, stage_metrics)
+        image_name = os.path.basename(image_path)
+        if naming_backend.accepts(confidence):
+            output_text_signal_emit(f"{image_name}：本地模型命名为 {local_name}（置信度{confidence:.2f}）")
+            return {'choices': [{'message': {'content': local_name}}]}, None, True
+        output_text_signal_emit(f"{image_name}：本地模型置信度{confidence:.2f}（{local_name}），改用远程 API")
+
+    prompt = config['Prompt']
+    payload_settings = get_payload_settings(config)
+
+    with stage_timer(stage_metrics if result_cache is not None else None, 'hash'):
+        cache_key, cached_text = lookup_cached_suggestion(image_path, config, result_cache, prompt, payload_settings)
+    if cached_text is not None:
+        # Cache hit: the same bytes were already named with the same model/prompt/compression settings
+        return {'choices': [{'message': {'content': cached_text}}]}, cache_key, True
+    response_data = request_name_suggestion(image_path, config, config['Api_key'], resolve_api_url(config),
+                                            prompt, payload_settings, http_session,
+                                            concurrency_controller, stop_event, output_text_signal_emit,
+                                            stage_metrics, endpoint_balancer)
+    return response_data, cache_key, False
+
+
+# Modified to include renaming_data_list and ensure all attempts are logged for Excel
+def process_image(image_path, config, output_text_signal_emit, stop_event, success_counter, failure_counter, num_counter, active_counter, renaming_data_list, result_cache=None, cluster_members=None, saved_calls_counter=None, http_session=None, concurrency_controller=None, stage_metrics=None, name_registry=None, endpoint_balancer=None, naming_backend=None):
+    current_original_filename = os.path.basename(image_path)
+    # Near-duplicates of this image (see dedup.py) are placed with the same name after it succeeds
+    cluster_members = cluster_members or []
+    cluster_label = current_original_filename if cluster_members else None
+    if stop_event.is_set():
+        return # Not processed, so not added to Excel as "failed"
+
+    active_counter.increment()
+    mark_journal(renaming_data_list, image_path, 'queued')
+    named = False
+    started = time.perf_counter() if stage_metrics is not None else None
+    try:
+        response_data, cache_key, from_cache = name_image(image_path, config, output_text_signal_emit, stop_event,
+                                                          result_cache, http_session, concurrency_controller, stage_metrics,
+                                                          endpoint_balancer, naming_backend)
+        named = handle_name_response(image_path, response_data, config, output_text_signal_emit,
+                                     success_counter, failure_counter, num_counter, renaming_data_list,
+                                     result_cache, cache_key, from_cache, cluster_members, saved_calls_counter,
+                                     stage_metrics, name_registry)
+    except RequestCancelled:
+        return # Stopped while waiting for a slot or a retry; not processed
     except Exception as e:
-        failure_counter.increment(); num_counter.increment()
-        output_text_signal_emit(f"处理图片时发生未知错误 ({current_original_filename}): {e}")
-        renaming_data_list.append({'original_name': current_original_filename, 'new_name_suggestion': ''})
+        record_failure(image_path, describe_processing_error(image_path, e), output_text_signal_emit,
+                       failure_counter, num_counter, renaming_data_list, cluster_label)
+    finally:
+        active_counter.decrement()
+        if started is not None:
+            stage_metrics.observe('total', time.perf_counter() - started)
+
+    # Near-duplicates can't be named when their representative wasn't
+    if cluster_members and not named:
+        fail_cluster_members(image_path, cluster_members, output_text_signal_emit, failure_counter, num_counter, renaming_data_list)
+
+
+class BatchStats:
+    """
+    批量请求统计：发送的批量请求数、由批量请求命名的图片数、回退到单张请求的图片数与 token 用量。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batch_requests = 0
+        self.batched_images = 0
+        self.fallback_images = 0
+        self.total_tokens = 0
+
+    def record_batch(self, named_images, tokens):
+        with self.lock:
+            self.batch_requests += 1
+            self.batched_images += named_images
+            self.total_tokens += tokens
+
+    def record_fallback(self, count=1):
+        with self.lock:
+            self.fallback_images += count
+
+    def summary(self):
+        with self.lock:
+            saved = max(0, self.batched_images - self.batch_requests)
+            tokens_per_image = (self.total_tokens / self.batched_images) if self.batched_images else 0.0
+            return (f"批量请求统计：发送{self.batch_requests}个批量请求，命名{self.batched_images}张图片，"
+                    f"节省{saved}次请求，平均每张{tokens_per_image:.0f} tokens，回退单张请求{self.fallback_images}张")
+
+
+def build_batch_chat_request(config, prompt, encoded_images, detail=None):
+    """
+    Packs several (encoded_image, mime_type) pairs into one request that asks for a JSON array of names.
+    """
+    count = len(encoded_images)
+    instruction = (f"{prompt}\n\n以下共有{count}张图片，请按顺序分别为每张图片命名。"
+                   f"只返回一个 JSON 字符串数组，数组长度为{count}，第k个元素对应第k张图片，不要输出其他内容。")
+    content = [{"type": "text", "text": instruction}]
+    for index, (encoded_image, mime_type) in enumerate(encoded_images, 1):
+        content.append({"type": "text", "text": f"图片{index}:"})
+        content.append(build_image_part(encoded_image, mime_type, detail))
+    headers = {
+        "Authorization": f"Bearer {config['Api_key']}",
+        "Content-Type": "application/json"
+    }
+    data = {
+        "model": config["Model"],
+        "messages": [{"role": "user", "content": content}],
+        "max_tokens": 100 + 60 * count
+    }
+    return headers, data
+
+
+def parse_batch_names(response_data, expected_count):
+    """
+    解析批量请求返回的名称数组；缺失或格式不正确的项为 None（这些图片会回退为单张请求）。
+    """
+    names = [None] * expected_count
+    try:
+        content = response_data['choices'][0]['message']['content']
+    except (KeyError, IndexError, TypeError):
+        return names
+    if not isinstance(content, str):
+        return names
+    start, end = content.find('['), content.rfind(']')
+    if start == -1 or end <= start:
+        return names
+    try:
+        parsed = json.loads(content[start:end + 1])
+    except ValueError:
+        return names
+    if not isinstance(parsed, list):
+        return names
+    for index, value in enumerate(parsed[:expected_count]):
+        if isinstance(value, str):
+            value = sanitize_filename(value)
+            if value:
+                names[index] = value
+    return names
+
+
+def process_image_batch(batch, config, output_text_signal_emit, stop_event, success_counter, failure_counter, num_counter, active_counter, renaming_data_list,
+                        result_cache=None, saved_calls_counter=None, http_session=None, concurrency_controller=None, batch_stats=None,
+                        stage_metrics=None, name_registry=None, endpoint_balancer=None):
+    """
+    用一次 chat-completions 请求为 batch 中的多张图片命名（batch 为 [(代表图片路径, 相似图片列表), ...]）。
+    Cache hits are handled first; any image whose entry is missing, malformed or whose batch
+    request failed falls back to process_image.
+    """
+    if stop_event.is_set():
+        return
+    single = lambda image_path, members: process_image(
+        image_path, config, output_text_signal_emit, stop_event, success_counter, failure_counter, num_counter,
+        active_counter, renaming_data_list, result_cache, members, saved_calls_counter, http_session, concurrency_controller,
+        stage_metrics, name_registry, endpoint_balancer)
+
+    prompt = config['Prompt']
+    payload_settings = get_payload_settings(config)
+    to_request = [] # (image_path, members, cache_key, encoded_image, mime_type)
+    fallback = []
+    active_counter.increment()
+    try:
+        for image_path, members in batch:
+            mark_journal(renaming_data_list, image_path, 'queued')
+            try:
+                cache_key, cached_text = lookup_cached_suggestion(image_path, config, result_cache, prompt, payload_settings)
+                if cached_text is not None:
+                    named = handle_name_response(image_path, {'choices': [{'message': {'content': cached_text}}]}, config,
+                                                 output_text_signal_emit, success_counter, failure_counter, num_counter,
+                                                 renaming_data_list, result_cache, cache_key, True, members, saved_calls_counter,
+                                                 stage_metrics, name_registry)
+                    if members and not named:
+                        fail_cluster_members(image_path, members, output_text_signal_emit, failure_counter, num_counter, renaming_data_list)
+                    continue
+                encoded = encode_image_payload(image_path, payload_settings, stage_metrics)
+                output_text_signal_emit(describe_payload(os.path.basename(image_path), encoded))
+                to_request.append((image_path, members, cache_key, encoded.data, encoded.mime_type))
+            except Exception:
+                fallback.append((image_path, members)) # process_image reports the error in the usual way
+
+        if len(to_request) == 1:
+            fallback.append(to_request[0][:2])
+        elif to_request:
+            headers, data = build_batch_chat_request(config, prompt, [(item[3], item[4]) for item in to_request],
+                                                     payload_settings.detail)
+            label = f"批量请求({len(to_request)}张)"
+            try:
+                response = dispatch_request(post_chat_request(http_session, config, resolve_api_url(config), headers, data),
+                                            concurrency_controller, config, stop_event, output_text_signal_emit,
+                                            label, stage_metrics, endpoint_balancer)
+                response.raise_for_status()
+                with stage_timer(stage_metrics, 'parse'):
+                    response_data = response.json()
+            except RequestCancelled:
+                return
+            except Exception as e:
+                output_text_signal_emit(f"{label}失败，改为逐张请求: {e}")
+                response_data = {}
+            names = parse_batch_names(response_data, len(to_request))
+            usage = response_data.get('usage') or {}
+            tokens = int(usage.get('total_tokens') or (usage.get('prompt_tokens', 0) + usage.get('completion_tokens', 0)) or 0)
+            named_count = 0
+            for (image_path, members, cache_key, _, _), name in zip(to_request, names):
+                if name is None:
+                    fallback.append((image_path, members))
+                    continue
+                named_count += 1
+                handle_name_response(image_path, {'choices': [{'message': {'content': name}}]}, config,
+                                     output_text_signal_emit, success_counter, failure_counter, num_counter,
+                                     renaming_data_list, result_cache, cache_key, False, members, saved_calls_counter,
+                                     stage_metrics, name_registry)
+            if batch_stats is not None and named_count:
+                batch_stats.record_batch(named_count, tokens)
     finally:
         active_counter.decrement()
 
+    if fallback and batch_stats is not None:
+        batch_stats.record_fallback(len(fallback))
+    for image_path, members in fallback:
+        single(image_path, members)
 
-def process_images_concurrently(config, output_text_signal_emit, stop_event, active_counter, gui_num_counter):
+
+def group_near_duplicates(image_paths, config, output_text_signal_emit, stop_event):
+    """
+    Perceptual-hash pre-pass: returns {representative_path: [member_paths]} and logs cluster membership.
+    """
+    max_distance = int(config.get('Dedup_max_distance', 5))
+    method = config.get('Dedup_hash_method', 'dhash')
+    output_text_signal_emit(f"正在计算感知哈希（{method}，汉明距离阈值 {max_distance}）...")
+    clusters = cluster_similar_images(image_paths, max_distance=max_distance, method=method,
+                                      max_workers=config.get("Max_workers", 5), stop_event=stop_event,
+                                      output_text_signal_emit=output_text_signal_emit)
+    multi_clusters = [(rep, members) for rep, members in clusters.items() if members]
+    for cluster_num, (rep, members) in enumerate(multi_clusters, 1):
+        member_names = ", ".join(os.path.basename(member) for member in members)
+        output_text_signal_emit(f"相似组 #{cluster_num}（代表 {os.path.basename(rep)}）：{member_names}")
+    expected_saving = sum(len(members) for _, members in multi_clusters)
+    output_text_signal_emit(f"相似图片分组：{len(image_paths)}张图片分为{len(clusters)}组，"
+                            f"其中{len(multi_clusters)}组含相似图片，预计节省{expected_saving}次API调用。")
+    return clusters
+
+
+SUPPORTED_SUFFIXES = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif', '.webp', '.heif', '.heic', '.svg')
+# Folders the renamer writes into itself; never scanned again when scanning recursively
+SKIPPED_FOLDER_NAMES = ('Finish', '.airenametmp')
+
+
+def _split_patterns(patterns):
+    if not patterns:
+        return []
+    if isinstance(patterns, str):
+        patterns = patterns.split(',')
+    return [pattern.strip() for pattern in patterns if pattern and pattern.strip()]
+
+
+def _matches_any(relative_path, name, patterns):
+    return any(fnmatch.fnmatch(relative_path, pattern) or fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def iter_image_files(source_folder, recursive=False, include=None, exclude=None, skip_paths=()):
+    """
+    基于 os.scandir 的流式扫描：边扫描边产出图片路径，不构建完整列表。
+    include/exclude are glob patterns matched against the file name and the path relative to source_folder.
+    Directory entries come from the scandir cache, so no extra stat call is needed per file.
+    """
+    include = _split_patterns(include)
+    exclude = _split_patterns(exclude)
+    skip_paths = {os.path.normcase(os.path.abspath(path)) for path in skip_paths if path}
+    pending_dirs = [source_folder]
+    while pending_dirs:
+        current_dir = pending_dirs.pop()
+        try:
+            entries = os.scandir(current_dir)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and entry.name not in SKIPPED_FOLDER_NAMES and \
+                           os.path.normcase(os.path.abspath(entry.path)) not in skip_paths:
+                            pending_dirs.append(entry.path)
+                        continue
+                    if not entry.name.lower().endswith(SUPPORTED_SUFFIXES) or not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                relative_path = os.path.relpath(entry.path, source_folder).replace(os.sep, '/')
+                if include and not _matches_any(relative_path, entry.name, include):
+                    continue
+                if exclude and _matches_any(relative_path, entry.name, exclude):
+                    continue
+                yield entry.path
+
+
+class ImageScan:
+    """
+    Iterable over the scanned image paths that counts how many were handed out.
+    """
+    def __init__(self, paths):
+        self._paths = paths
+        self.count = 0
+
+    def __iter__(self):
+        for path in self._paths:
+            self.count += 1
+            yield path
+
+
+def collect_image_paths(config, output_text_signal_emit):
+    """
+    Returns an ImageScan over the images to process, or None (already logged) when there is nothing to do.
+    """
     source_folder = config["Source_folder"]
     if not source_folder or not os.path.isdir(source_folder):
         output_text_signal_emit(f"错误：源文件夹 '{source_folder}' 无效或未设置。")
-        return 0, 0, 0, []
+        return None
 
-    suffix_name = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif', '.webp', '.heif', '.heic', '.svg')
-    image_paths = [os.path.join(source_folder, filename)
-                   for filename in os.listdir(source_folder)
-                   if filename.lower().endswith(suffix_name) and os.path.isfile(os.path.join(source_folder, filename))]
-
-    if not image_paths:
+    skip_paths = [config.get('custom_output_folder')] if config.get('output_mode') == 'custom' else []
+    image_paths = iter_image_files(source_folder, recursive=config.get('Recursive', False),
+                                   include=config.get('Include_patterns'), exclude=config.get('Exclude_patterns'),
+                                   skip_paths=skip_paths)
+    if config.get('Resume', False):
+        image_paths = filter_resumed_paths(image_paths, source_folder, output_text_signal_emit)
+    first_path = next(image_paths, None)
+    if first_path is None:
         output_text_signal_emit("提示：在源文件夹中没有找到符合条件的图片文件。")
-        return 0, 0, 0, []
+        return None
+    return ImageScan(itertools.chain([first_path], image_paths))
 
-    success_counter = Counter()
-    failure_counter = Counter()
-    renaming_data_for_excel = []
 
-    output_text_signal_emit(f"开始处理{len(image_paths)}张图片，线程数: {config.get('Max_workers', 5)}")
+def filter_resumed_paths(image_paths, source_folder, output_text_signal_emit):
+    """
+    续跑：跳过任务日志中已放置完成的图片（以及原位重命名后得到的新文件）。
+    Images that were named but not placed are processed again; their name comes back from the result cache.
+    """
+    done_paths, counts = load_resume_state(source_folder)
+    if not counts:
+        output_text_signal_emit("续跑：未找到任务日志，将处理全部图片。")
+        return image_paths
+    output_text_signal_emit(f"续跑：任务日志中已完成{counts.get('placed', 0)}张，失败{counts.get('failed', 0)}张，"
+                            f"未完成{counts.get('queued', 0) + counts.get('named', 0)}张；已完成的图片将被跳过。")
+    return (path for path in image_paths if os.path.normcase(os.path.abspath(path)) not in done_paths)
+
+
+def log_run_settings(config, output_text_signal_emit, concurrency_label):
+    scope = "（含子文件夹）" if config.get('Recursive', False) else ""
+    output_text_signal_emit(f"开始处理图片{scope}，边扫描边处理，{concurrency_label}")
     output_text_signal_emit(f"模型：{config['Model']}")
+    endpoint_configs = get_endpoint_configs(config)
+    if len(endpoint_configs) > 1:
+        described = "、".join(f"{endpoint['name']}（{endpoint['model'] or config['Model']}，权重{float(endpoint['weight']):g}"
+                             + (f"，并发上限{endpoint['max_concurrency']}" if endpoint['max_concurrency'] else "") + "）"
+                             for endpoint in endpoint_configs)
+        output_text_signal_emit(f"多端点负载均衡：{described}")
     output_text_signal_emit(f"图片质量设置：{config.get('Image_quality_percent', 85)}%")
+    output_text_signal_emit(describe_upload_settings(config))
     output_mode_display = {
         'finish_subfolder': "保存在 'Finish' 子文件夹",
         'in_place': "在原位置重命名",
@@ -254,84 +898,239 @@ def process_images_concurrently(config, output_text_signal_emit, stop_event, act
     if config.get('output_mode') == 'custom':
         output_text_signal_emit(f"自定义输出文件夹：{config.get('custom_output_folder')}")
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=config.get("Max_workers", 5)) as executor:
-        futures = {executor.submit(process_image, image_path, config, output_text_signal_emit, stop_event,
-                                     success_counter, failure_counter, gui_num_counter, active_counter,
-                                     renaming_data_for_excel
-                                     ): image_path
-                   for image_path in image_paths}
+
+def plan_clusters(image_scan, config, output_text_signal_emit, stop_event):
+    """
+    Yields (representative_path, [member_paths]); every image is its own representative unless Dedup_enabled.
+    Near-duplicate grouping needs every path up front, so only then is the scan materialized.
+    """
+    if config.get('Dedup_enabled', False):
+        clusters = group_near_duplicates(list(image_scan), config, output_text_signal_emit, stop_event)
+        return iter(clusters.items())
+    return ((image_path, []) for image_path in image_scan)
+
+
+def get_in_flight_window(config, workers):
+    """How many tasks may be submitted but unfinished at once (Max_in_flight, default 2 x workers)."""
+    return max(1, int(config.get('Max_in_flight') or workers * 2))
+
+
+def log_run_statistics(config, output_text_signal_emit, saved_calls_counter, result_cache, stage_metrics=None,
+                       placement_totals=None):
+    placement_line = placement_totals.summary() if placement_totals is not None else None
+    if placement_line:
+        output_text_signal_emit(placement_line)
+    if config.get('Dedup_enabled', False):
+        output_text_signal_emit(f"相似图片去重：共节省{saved_calls_counter.get_value()}次API调用。")
+    if result_cache is not None:
+        result_cache.evict()
+        output_text_signal_emit(result_cache.summary())
+        result_cache.close()
+    if stage_metrics is not None:
+        report_stage_metrics(config, stage_metrics, output_text_signal_emit)
+
+
+def report_stage_metrics(config, stage_metrics, output_text_signal_emit):
+    """
+    Logs the per-stage table and writes stage_metrics.json / .prom next to the Excel report.
+    """
+    for line in stage_metrics.summary_lines():
+        output_text_signal_emit(line)
+    report_folder = resolve_report_folder(config, output_text_signal_emit)
+    if not report_folder:
+        return
+    try:
+        metrics_path = stage_metrics.write(report_folder, config.get('Metrics_format', 'json'))
+    except OSError as e:
+        output_text_signal_emit(f"警告：无法写入耗时统计文件: {e}")
+    else:
+        output_text_signal_emit(f"耗时统计已保存到：{metrics_path}")
+
+
+def process_images_concurrently(config, output_text_signal_emit, stop_event, active_counter, gui_num_counter,
+                                shared_executor=None):
+    """
+    The threads engine. With shared_executor (jobqueue.JobRunner) the images go to that pool,
+    which other jobs use too, instead of a pool of this run's own.
+    """
+    try:
+        naming_backend = create_naming_backend(config, output_text_signal_emit)
+    except RuntimeError as e:
+        output_text_signal_emit(f"错误：{e}")
+        return 0, 0, 0, []
+    image_scan = collect_image_paths(config, output_text_signal_emit)
+    if not image_scan:
+        if naming_backend is not None:
+            naming_backend.close()
+        return 0, 0, 0, []
+
+    success_counter = Counter()
+    failure_counter = Counter()
+    placement_totals = PlacementTotals()
+    # Rows stream into the report and the totals as they arrive instead of piling up in memory
+    renaming_data_for_excel = open_run_journal(config, output_text_signal_emit, retain_rows=False,
+                                               sinks=(placement_totals, open_run_report(config, output_text_signal_emit)))
+    result_cache = open_result_cache(config, output_text_signal_emit)
+    http_session = create_http_session(config)
+    max_workers = config.get("Max_workers", 5)
+    concurrency_controller = create_concurrency_controller(config, max_workers)
+    endpoint_balancer = create_endpoint_balancer(config)
+    stage_metrics = create_stage_metrics(config)
+    name_registry = NameRegistry()
+
+    log_run_settings(config, output_text_signal_emit, f"线程数: {max_workers}")
+
+    saved_calls_counter = Counter()
+    clusters = plan_clusters(image_scan, config, output_text_signal_emit, stop_event)
+    window = get_in_flight_window(config, max_workers)
+    batch_size = max(1, int(config.get('Batch_size', 1)))
+    if batch_size > 1 and naming_backend is not None:
+        output_text_signal_emit("提示：批量请求模式仅适用于远程命名后端，本次按单张图片处理。")
+        batch_size = 1
+    batch_stats = BatchStats() if batch_size > 1 else None
+    if batch_stats is not None:
+        output_text_signal_emit(f"批量模式：每个请求最多包含{batch_size}张图片")
+
+    own_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) if shared_executor is None else None
+    with own_executor or contextlib.nullcontext(shared_executor) as executor:
+        pending = set()
+
+        def submit_more():
+            # Keep at most `window` futures alive so memory stays flat however large the folder is
+            while len(pending) < window and not stop_event.is_set():
+                if batch_stats is not None:
+                    batch = list(itertools.islice(clusters, batch_size))
+                    if not batch:
+                        return
+                    pending.add(executor.submit(process_image_batch, batch, config, output_text_signal_emit, stop_event,
+                                                success_counter, failure_counter, gui_num_counter, active_counter,
+                                                renaming_data_for_excel, result_cache, saved_calls_counter,
+                                                http_session, concurrency_controller, batch_stats, stage_metrics,
+                                                name_registry, endpoint_balancer))
+                    continue
+                next_cluster = next(clusters, None)
+                if next_cluster is None:
+                    return
+                image_path, members = next_cluster
+                pending.add(executor.submit(process_image, image_path, config, output_text_signal_emit, stop_event,
+                                            success_counter, failure_counter, gui_num_counter, active_counter,
+                                            renaming_data_for_excel, result_cache, members, saved_calls_counter,
+                                            http_session, concurrency_controller, stage_metrics, name_registry,
+                                            endpoint_balancer, naming_backend))
 
         try:
-            for future in concurrent.futures.as_completed(futures):
+            submit_more()
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        future.result()
+                    except concurrent.futures.CancelledError:
+                        output_text_signal_emit("一个任务被取消。") # These won't be in Excel unless process_image added them before cancel
+                    except Exception:
+                        pass # Errors are handled and logged within process_image, and added to renaming_data_for_excel
                 if stop_event.is_set():
-                    for f_cancel in futures:
+                    for f_cancel in pending:
                         if not f_cancel.done(): f_cancel.cancel()
                     output_text_signal_emit("停止信号已接收，正在取消剩余任务...")
                     break
-                try:
-                    future.result()
-                except concurrent.futures.CancelledError:
-                    output_text_signal_emit("一个任务被取消。") # These won't be in Excel unless process_image added them before cancel
-                except Exception:
-                    pass # Errors are handled and logged within process_image, and added to renaming_data_for_excel
+                submit_more()
         except KeyboardInterrupt:
             output_text_signal_emit("检测到键盘中断！正在尝试停止...")
             stop_event.set()
-            for f_cancel in futures:
+            for f_cancel in pending:
                  if not f_cancel.done(): f_cancel.cancel()
-            executor.shutdown(wait=True) # Consider wait=False if UI needs to be more responsive during forced shutdown
+            if own_executor is not None:
+                executor.shutdown(wait=True) # Consider wait=False if UI needs to be more responsive during forced shutdown
             output_text_signal_emit("所有活动线程已尝试停止。")
 
-    return len(image_paths), success_counter.get_value(), failure_counter.get_value(), renaming_data_for_excel
+    if batch_stats is not None:
+        output_text_signal_emit(batch_stats.summary())
+    if naming_backend is not None:
+        naming_backend.close()
+        output_text_signal_emit(naming_backend.summary())
+    output_text_signal_emit(concurrency_controller.summary())
+    if endpoint_balancer.is_multi:
+        output_text_signal_emit(endpoint_balancer.summary())
+    output_text_signal_emit(http_session.summary())
+    http_session.close()
+    renaming_data_for_excel.close()
+    log_run_statistics(config, output_text_signal_emit, saved_calls_counter, result_cache, stage_metrics,
+                       placement_totals)
 
+    return image_scan.count, success_counter.get_value(), failure_counter.get_value(), renaming_data_for_excel
 
-def generate_excel_report(renaming_data, output_folder_path, report_filename="商品标题.xlsx", output_text_signal_emit=None):
+
+def resolve_report_folder(config, output_text_signal_emit):
     """
-    Generates an Excel report with original and new (suggested) filenames.
+    Excel 报告的保存位置：与输出模式一致（Finish 子文件夹 / 自定义文件夹 / 源文件夹），
+    无法创建时退回源文件夹。Returns None when no usable folder exists.
     """
-    if openpyxl is None:
-        if output_text_signal_emit:
-            output_text_signal_emit("错误：Excel报告生成失败。需要安装 'openpyxl' 库。请运行 'pip install openpyxl'。")
-        return
+    source_folder = config.get('Source_folder')
+    output_mode = config.get('output_mode', 'finish_subfolder')
+    excel_output_path = source_folder
 
-    if not renaming_data:
-        if output_text_signal_emit:
-            output_text_signal_emit("提示：没有重命名数据可供生成Excel报告。")
-        return
+    if output_mode == 'custom':
+        custom_folder = config.get('custom_output_folder', '')
+        if custom_folder:
+            excel_output_path = custom_folder
+    elif output_mode == 'finish_subfolder':
+        excel_output_path = os.path.join(source_folder, 'Finish')
 
-    excel_file_path = os.path.join(output_folder_path, report_filename)
+    if not os.path.isdir(excel_output_path):
+        try:
+            os.makedirs(excel_output_path, exist_ok=True)
+            output_text_signal_emit(f"提示：为Excel报告创建了文件夹 {excel_output_path}")
+        except Exception as e:
+            output_text_signal_emit(f"警告：无法创建Excel报告的目标文件夹 {excel_output_path}: {e}。将尝试保存到源文件夹。")
+            excel_output_path = source_folder
+            if not os.path.isdir(excel_output_path) and source_folder:
+                 try: os.makedirs(excel_output_path, exist_ok=True)
+                 except Exception as fallback_e: output_text_signal_emit(f"警告：无法创建源文件夹作为后备Excel报告路径: {fallback_e}")
 
-    try:
-        if not os.path.exists(output_folder_path):
-            os.makedirs(output_folder_path, exist_ok=True)
-            if output_text_signal_emit:
-                output_text_signal_emit(f"提示：为Excel报告创建了文件夹 {output_folder_path}")
-    except Exception as e:
-        if output_text_signal_emit:
-            output_text_signal_emit(f"错误：无法创建Excel报告文件夹 {output_folder_path}: {e}")
-        return
+    if excel_output_path and os.path.isdir(excel_output_path):
+        return excel_output_path
+    output_text_signal_emit(f"错误：无法确定Excel报告的有效保存路径。跳过Excel生成。")
+    return None
 
-    try:
-        workbook = openpyxl.Workbook()
-        sheet = workbook.active
-        sheet.title = "商品标题"
 
-        headers = ["Original Filename", "New Filename"]
-        for col_num, header in enumerate(headers, 1):
-            col_letter = get_column_letter(col_num)
-            sheet[f"{col_letter}1"] = header
-            sheet.column_dimensions[col_letter].width = 40
+def open_run_report(config, output_text_signal_emit, report_name="商品标题"):
+    """
+    StreamingReport for Report_formats (default 'xlsx'), written where the Excel report has always gone
+    (see resolve_report_folder) while the run progresses; None when no report is wanted.
+    """
+    formats = parse_report_formats(config.get('Report_formats', 'xlsx'))
+    if not formats:
+        return None
+    return StreamingReport(formats, lambda: resolve_report_folder(config, output_text_signal_emit), output_text_signal_emit,
+                           report_name, include_cluster=config.get('Dedup_enabled', False))
 
-        for row_num, entry in enumerate(renaming_data, 2):
-            sheet[f"A{row_num}"] = entry.get('original_name', 'N/A') # Should always have original_name
-            sheet[f"B{row_num}"] = entry.get('new_name_suggestion', '') # Use empty string if suggestion is missing or empty
 
-        excel_file_path = get_unique_filename(excel_file_path)
+def generate_run_report(config, renaming_data, output_text_signal_emit, report_filename="商品标题.xlsx"):
+    """Writes a report for rows collected outside an engine run (engines stream theirs)."""
+    excel_output_path = resolve_report_folder(config, output_text_signal_emit)
+    if excel_output_path:
+        if not renaming_data:
+            output_text_signal_emit("提示：没有重命名数据可供生成报告。")
+            return
+        write_report(renaming_data, parse_report_formats(config.get('Report_formats', 'xlsx')), excel_output_path,
+                     output_text_signal_emit, os.path.splitext(report_filename)[0])
 
-        workbook.save(excel_file_path)
-        if output_text_signal_emit:
-            output_text_signal_emit(f"成功：Excel报告已保存到 {excel_file_path}")
 
+def generate_excel_report(renaming_data, output_folder_path, report_filename="商品标题.xlsx", output_text_signal_emit=None):
+    """
+    Generates an Excel report with original and new (suggested) filenames, status, error and timings.
+    """
+    emit = output_text_signal_emit or (lambda message: None)
+    if not renaming_data:
+        emit("提示：没有重命名数据可供生成Excel报告。")
+        return
+
+    try:
+        if not os.path.exists(output_folder_path):
+            os.makedirs(output_folder_path, exist_ok=True)
+            emit(f"提示：为Excel报告创建了文件夹 {output_folder_path}")
     except Exception as e:
-        if output_text_signal_emit:
-            output_text_signal_emit(f"错误：生成Excel报告失败: {e}")
+        emit(f"错误：无法创建Excel报告文件夹 {output_folder_path}: {e}")
+        return
+    write_report(renaming_data, ('xlsx',), output_folder_path, emit, os.path.splitext(report_filename)[0])
@@ -0,0 +1,64 @@
+# http_client.py
+import http.cookiejar
+
+
+def get_request_timeout(config):
+    """
+    (connect, read) timeout tuple for requests, from Connect_timeout / Read_timeout in seconds.
+    """
+    connect_timeout = float(config.get('Connect_timeout', 10))
+    read_timeout = float(config.get('Read_timeout', 60))
+    return (connect_timeout, read_timeout)
+
+
+class PooledSession:
+    """
+    一次运行共享的 HTTP 会话：连接池大小与线程数一致，连接保持 keep-alive 并在线程间复用。
+
+    The underlying requests.Session is only used for sending; cookies are blocked so
+    worker threads never mutate shared session state.
+    """
+    def __init__(self, pool_size, timeout=(10, 60)):
+        import requests # Deferred so importing function.py doesn't pay for requests/urllib3
+        from requests.adapters import HTTPAdapter
+        self.pool_size = max(1, int(pool_size))
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        self.session.headers.update({"Connection": "keep-alive"})
+        # pool_block=True: a thread waits for a free connection instead of opening a throwaway one
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, pool_block=True, max_retries=0)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+    def post(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.post(url, **kwargs)
+
+    def connection_stats(self):
+        """
+        Returns (requests_sent, connections_opened) summed over every urllib3 pool of this session.
+        """
+        requests_sent = 0
+        connections_opened = 0
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            requests_sent += pool.num_requests
+            connections_opened += pool.num_connections
+        return requests_sent, connections_opened
+
+    def summary(self):
+        requests_sent, connections_opened = self.connection_stats()
+        reused = max(0, requests_sent - connections_opened)
+        reuse_rate = (reused / requests_sent * 100) if requests_sent else 0.0
+        return (f"连接复用统计：发送请求{requests_sent}次，新建连接{connections_opened}个，"
+                f"复用连接{reused}次（复用率{reuse_rate:.1f}%），连接池大小{self.pool_size}")
+
+    def close(self):
+        self.session.close()
+
+
+def create_http_session(config):
+    return PooledSession(config.get('Max_workers', 5), timeout=get_request_timeout(config))
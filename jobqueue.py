@@ -0,0 +1,324 @@
+# jobqueue.py
+import concurrent.futures
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from function import Counter, iter_image_files
+from journal import load_resume_state
+from settings import resolve_data_path
+
+DEFAULT_QUEUE_PATH = 'airename_jobs.sqlite3'
+# pending -> running -> done / failed / stopped; cancelled jobs were removed from the queue before they ran
+JOB_STATES = ('pending', 'running', 'done', 'failed', 'stopped', 'cancelled')
+# Settings stored with each job; everything else (API key, engine, workers ...) comes from the config the queue runs with
+JOB_KEYS = ('Source_folder', 'Prompt', 'Model', 'output_mode', 'custom_output_folder', 'Recursive',
+            'Include_patterns', 'Exclude_patterns', 'Report_formats')
+# How often the runner checks whether the running jobs are down to their tail
+DRAIN_POLL_SECONDS = 0.2
+
+
+class JobQueue:
+    """
+    持久化的多文件夹作业队列（SQLite）：每个作业有自己的文件夹、提示词、模型与输出模式，按优先级出队。
+
+    Higher priority runs first, equal priorities in the order they were added. A job that was
+    running when the program died is put back to pending with resume set, so its next run skips
+    what the journal already placed. Thread-safe like ResultCache: one connection, one lock.
+    """
+    def __init__(self, db_path=DEFAULT_QUEUE_PATH):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.isdir(db_dir):
+            os.makedirs(db_dir, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " priority INTEGER NOT NULL DEFAULT 0,"
+            " state TEXT NOT NULL,"
+            " settings TEXT NOT NULL,"
+            " resume INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " finished_at REAL,"
+            " total INTEGER, succeeded INTEGER, failed INTEGER,"
+            " error TEXT)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_state_priority ON jobs(state, priority)")
+        self.conn.execute("UPDATE jobs SET state = 'pending', resume = 1 WHERE state = 'running'")
+        self.conn.commit()
+
+    def add(self, config, priority=0):
+        """Enqueues the JOB_KEYS of config; returns the job id."""
+        settings = {key: config[key] for key in JOB_KEYS if key in config}
+        with self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO jobs (priority, state, settings, resume, created_at) VALUES (?, 'pending', ?, ?, ?)",
+                (int(priority), json.dumps(settings, ensure_ascii=False), int(bool(config.get('Resume'))), time.time()))
+            self.conn.commit()
+            return cursor.lastrowid
+
+    def _job(self, row):
+        job = dict(row)
+        job['settings'] = json.loads(job['settings'])
+        job['resume'] = bool(job['resume'])
+        return job
+
+    def jobs(self, states=None):
+        """All jobs (or those in states), in the order they will run / ran."""
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM jobs ORDER BY state != 'running', state != 'pending',"
+                                     " priority DESC, id").fetchall()
+        return [self._job(row) for row in rows if states is None or row['state'] in states]
+
+    def claim_next(self, busy_folders=()):
+        """
+        Marks the highest-priority pending job as running and returns it, or None.
+        Jobs whose Source_folder is in busy_folders (folder_key values) are skipped and stay pending.
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM jobs WHERE state = 'pending' ORDER BY priority DESC, id").fetchall()
+            row = next((row for row in rows
+                        if folder_key(json.loads(row['settings']).get('Source_folder')) not in busy_folders), None)
+            if row is None:
+                return None
+            self.conn.execute("UPDATE jobs SET state = 'running', started_at = ? WHERE id = ?", (time.time(), row['id']))
+            self.conn.commit()
+        job = self._job(row)
+        job['state'] = 'running'
+        return job
+
+    def finish(self, job_id, state, total=None, succeeded=None, failed=None, error=None):
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET state = ?, finished_at = ?, total = ?, succeeded = ?, failed = ?, error = ?,"
+                              " resume = ? WHERE id = ?",
+                              (state, time.time(), total, succeeded, failed, error, int(state == 'stopped'), job_id))
+            self.conn.commit()
+
+    def requeue(self, job_id):
+        """Puts a stopped or failed job back to pending; a stopped one resumes where it stopped."""
+        with self.lock:
+            cursor = self.conn.execute("UPDATE jobs SET state = 'pending' WHERE id = ? AND state IN ('stopped', 'failed', 'cancelled')",
+                                       (job_id,))
+            self.conn.commit()
+            return cursor.rowcount > 0
+
+    def set_priority(self, job_id, priority):
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET priority = ? WHERE id = ?", (int(priority), job_id))
+            self.conn.commit()
+
+    def cancel(self, job_id):
+        """Cancels a pending job; returns False when it is already running or finished."""
+        with self.lock:
+            cursor = self.conn.execute("UPDATE jobs SET state = 'cancelled', finished_at = ? WHERE id = ? AND state = 'pending'",
+                                       (time.time(), job_id))
+            self.conn.commit()
+            return cursor.rowcount > 0
+
+    def clear_finished(self):
+        """Deletes every job that is not pending or running; returns how many."""
+        with self.lock:
+            cursor = self.conn.execute("DELETE FROM jobs WHERE state NOT IN ('pending', 'running')")
+            self.conn.commit()
+            return cursor.rowcount
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def folder_key(folder):
+    """Compares source folders: two jobs on the same folder would share its journal and rename the same files."""
+    return os.path.normcase(os.path.abspath(folder)) if folder else ''
+
+
+def resolve_queue_path(config, config_path=None):
+    """Queue_path; a relative one (the default included) lives next to the config file, not in the working directory."""
+    return resolve_data_path(config.get('Queue_path') or DEFAULT_QUEUE_PATH, config_path)
+
+
+def open_job_queue(config, config_path=None):
+    return JobQueue(resolve_queue_path(config, config_path))
+
+
+def job_config(base_config, job):
+    """The run config of a job: the queue's config with the job's own settings on top."""
+    config = dict(base_config)
+    config.update(job['settings'])
+    config['Resume'] = job['resume']
+    return config
+
+
+def job_label(job):
+    folder = job['settings'].get('Source_folder', '')
+    return f"#{job['id']} {os.path.basename(os.path.normpath(folder)) or folder}"
+
+
+def count_job_images(config):
+    """Number of images the job will see, for the ETA; one directory scan without opening any file."""
+    source_folder = config.get('Source_folder')
+    if not source_folder or not os.path.isdir(source_folder):
+        return 0
+    skip_paths = [config.get('custom_output_folder')] if config.get('output_mode') == 'custom' else []
+    image_paths = iter_image_files(source_folder, recursive=config.get('Recursive', False),
+                                   include=config.get('Include_patterns'), exclude=config.get('Exclude_patterns'),
+                                   skip_paths=skip_paths)
+    done_paths = load_resume_state(source_folder)[0] if config.get('Resume') else ()
+    return sum(1 for path in image_paths if os.path.normcase(os.path.abspath(path)) not in done_paths)
+
+
+class _ChainedCounter(Counter):
+    """A job's processed counter that also counts towards the queue-wide one (the GUI progress)."""
+    def __init__(self, parent):
+        super().__init__()
+        self.parent = parent
+
+    def increment(self):
+        super().increment()
+        self.parent.increment()
+
+
+class JobProgress:
+    """Throughput and ETA of one running job, from its processed counter and the scanned image count."""
+    def __init__(self, job, total, num_counter):
+        self.job = job
+        self.label = job_label(job)
+        self.total = total
+        self.num_counter = num_counter
+        self.started = time.monotonic()
+
+    def remaining(self):
+        return max(0, self.total - self.num_counter.get_value())
+
+    def snapshot(self):
+        processed = self.num_counter.get_value()
+        elapsed = time.monotonic() - self.started
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        eta_seconds = max(0, self.total - processed) / rate if rate > 0 else None
+        return {'job_id': self.job['id'], 'label': self.label, 'processed': processed, 'total': self.total,
+                'images_per_second': round(rate, 2), 'eta_seconds': None if eta_seconds is None else round(eta_seconds, 1),
+                'elapsed_seconds': round(elapsed, 1)}
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}" if seconds >= 3600 else f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def describe_progress(snapshot):
+    return (f"作业{snapshot['label']}：{snapshot['processed']}/{snapshot['total']}张，"
+            f"{snapshot['images_per_second']:.2f}张/秒，预计剩余{format_eta(snapshot['eta_seconds'])}")
+
+
+class JobRunner:
+    """
+    依次（按优先级）运行队列中的全部作业，所有作业共用一个工作线程池。
+
+    Jobs run one after the other, except that the next job starts as soon as every running job has
+    fewer images left than there are workers: its images fill the workers the tail of the previous
+    job leaves idle, so there is no gap between folders (at most Queue_parallel_jobs at once).
+    A job never starts while another job on the same Source_folder is running; it waits, and jobs
+    on other folders behind it may go first.
+    Only the threads engine takes the shared pool; async / pipeline jobs bring their own.
+    Progress snapshots go to on_progress (a list of JobProgress.snapshot() dicts) every
+    Queue_progress_interval seconds and are logged. Returns the list of finished job summaries.
+    """
+    def __init__(self, job_queue, base_config, output_text_signal_emit, stop_event, active_counter, num_counter,
+                 on_progress=None):
+        self.job_queue = job_queue
+        self.base_config = base_config
+        self.emit = output_text_signal_emit
+        self.stop_event = stop_event
+        self.active_counter = active_counter
+        self.num_counter = num_counter
+        self.on_progress = on_progress
+        self.running = {} # future -> JobProgress
+        self.held_back = False # a pending job waits for a running job on the same folder
+        self.results = []
+
+    def _run_job(self, job, progress, config, shared_executor):
+        from engines import get_engine
+        prefix = f"[作业{progress.label}] "
+        emit = lambda message: self.emit(prefix + str(message))
+        engine = get_engine(config.get('Engine'))
+        extra = {'shared_executor': shared_executor} if config.get('Engine', 'threads') == 'threads' else {}
+        total, succeeded, failed, _ = engine(config, emit, self.stop_event, self.active_counter, progress.num_counter, **extra)
+        return total, succeeded, failed
+
+    def _start_next(self, job_executor, shared_executor):
+        busy_folders = {folder_key(progress.job['settings'].get('Source_folder')) for progress in self.running.values()}
+        job = self.job_queue.claim_next(busy_folders)
+        if job is None:
+            if busy_folders and self.job_queue.jobs(('pending',)) and not self.held_back:
+                self.held_back = True
+                self.emit("作业队列：下一个作业的文件夹正在被另一个作业处理，等该作业结束后再开始")
+            return False
+        self.held_back = False
+        config = job_config(self.base_config, job)
+        total = count_job_images(config)
+        progress = JobProgress(job, total, _ChainedCounter(self.num_counter))
+        self.emit(f"作业{progress.label} 开始：{config.get('Source_folder')}，共{total}张图片，"
+                  f"优先级{job['priority']}，模型{config.get('Model')}")
+        self.running[job_executor.submit(self._run_job, job, progress, config, shared_executor)] = progress
+        return True
+
+    def _report_progress(self):
+        snapshots = [progress.snapshot() for progress in self.running.values()]
+        if self.on_progress is not None:
+            self.on_progress(snapshots)
+        return snapshots
+
+    def _finish(self, future, progress):
+        snapshot = progress.snapshot()
+        job_id = progress.job['id']
+        try:
+            total, succeeded, failed = future.result()
+        except Exception as e:
+            self.job_queue.finish(job_id, 'failed', error=str(e))
+            self.emit(f"作业{progress.label} 出错：{e}")
+            summary = dict(snapshot, state='failed', error=str(e))
+        else:
+            state = 'stopped' if self.stop_event.is_set() else ('failed' if total and not succeeded else 'done')
+            self.job_queue.finish(job_id, state, total, succeeded, failed)
+            self.emit(f"作业{progress.label} {'已停止' if state == 'stopped' else '完成'}：共{total}张，成功{succeeded}张，"
+                      f"失败{failed}张，用时{snapshot['elapsed_seconds']}秒（{snapshot['images_per_second']:.2f}张/秒）")
+            summary = dict(snapshot, state=state, total=total, succeeded=succeeded, failed=failed)
+        self.results.append(summary)
+
+    def run(self):
+        max_workers = int(self.base_config.get('Max_workers', 5))
+        parallel_jobs = max(1, int(self.base_config.get('Queue_parallel_jobs', 2)))
+        interval = max(0.5, float(self.base_config.get('Queue_progress_interval', 5)))
+        pending_count = len(self.job_queue.jobs(('pending',)))
+        self.emit(f"作业队列：{pending_count}个待处理作业，共用{max_workers}个工作线程，最多{parallel_jobs}个作业同时运行")
+        last_report = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as shared_executor, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=parallel_jobs) as job_executor:
+            while True:
+                while (not self.stop_event.is_set() and len(self.running) < parallel_jobs
+                       and all(progress.remaining() < max_workers for progress in self.running.values())):
+                    if not self._start_next(job_executor, shared_executor):
+                        break
+                if not self.running:
+                    break
+                done, _ = concurrent.futures.wait(list(self.running), timeout=DRAIN_POLL_SECONDS,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    self._finish(future, self.running.pop(future))
+                if time.monotonic() - last_report >= interval and self.running:
+                    last_report = time.monotonic()
+                    for snapshot in self._report_progress():
+                        self.emit(describe_progress(snapshot))
+        self._report_progress()
+        self.emit(f"作业队列结束：完成{sum(1 for result in self.results if result['state'] == 'done')}个作业，"
+                  f"共{len(self.results)}个")
+        return self.results
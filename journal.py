@@ -0,0 +1,255 @@
+# journal.py
+import itertools
+import json
+import os
+import threading
+import time
+
+JOURNAL_FILENAME = '.airename_journal.jsonl'
+# queued -> named -> placed, or failed at any point; undone marks an in-place rename that was rolled back
+JOURNAL_STATES = ('queued', 'named', 'placed', 'failed', 'undone')
+# Numbers the runs of this process, so runs started in the same second (queued jobs) get distinct ids
+_run_counter = itertools.count(1)
+
+
+def journal_path(source_folder):
+    return os.path.join(source_folder, JOURNAL_FILENAME)
+
+
+def new_run_id():
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_run_counter)}"
+
+
+class RunJournal(list):
+    """
+    作为 renaming_data_list 使用的列表：每追加一行结果，同时向源文件夹下的追加式日志
+    （.airename_journal.jsonl，每行一个 JSON）写入该文件的状态，崩溃或停止后可据此续跑或撤销。
+
+    Rows are plain dicts as before; rows carrying 'path' and 'status' are journaled.
+    Lines are flushed to the OS immediately and fsynced at most every fsync_interval seconds,
+    so an application crash loses nothing and a power loss at most the last second.
+    With source_folder=None nothing is journaled.
+
+    Each row also gets name_seconds / place_seconds / total_seconds from the queued and named
+    records of its image, and is handed to every sink (objects with add(entry) and close(), e.g.
+    report.StreamingReport). With retain_rows=False rows go only to the sinks, so memory stays flat.
+    """
+    def __init__(self, source_folder=None, run_id=None, output_mode=None, fsync_interval=1.0, write_header=True,
+                 sinks=(), retain_rows=True):
+        super().__init__()
+        self.source_folder = source_folder
+        self.run_id = run_id or new_run_id()
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.file = None
+        self.last_sync = time.monotonic()
+        self.sinks = [sink for sink in sinks if sink is not None]
+        self.retain_rows = retain_rows
+        self.queued_at = {} # image path -> perf_counter() of its latest 'queued' / 'named' record
+        self.named_at = {}
+        if source_folder:
+            self.file = open(journal_path(source_folder), 'a', encoding='utf-8')
+            if write_header:
+                self._write({'event': 'run', 'run': self.run_id, 'time': round(time.time(), 3), 'output_mode': output_mode})
+
+    def _relative(self, path):
+        return os.path.relpath(path, self.source_folder).replace(os.sep, '/')
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self.lock:
+            if self.file is None:
+                return
+            try:
+                self.file.write(line)
+                self.file.flush()
+                now = time.monotonic()
+                if now - self.last_sync >= self.fsync_interval:
+                    os.fsync(self.file.fileno())
+                    self.last_sync = now
+            except (OSError, ValueError):
+                self.file = None # Disk full / closed: keep processing, just without the journal
+
+    def record(self, image_path, state, **fields):
+        """Journal-only state change (queued, named, ...); does not add a report row."""
+        if state == 'queued':
+            self.queued_at[image_path] = time.perf_counter()
+        elif state == 'named':
+            self.named_at[image_path] = time.perf_counter()
+        if self.file is None:
+            return
+        record = {'run': self.run_id, 'time': round(time.time(), 3), 'path': self._relative(image_path), 'state': state}
+        for key, value in fields.items():
+            if value is None:
+                continue
+            if key == 'target':
+                value = self._relative(value)
+            record[key] = value
+        self._write(record)
+
+    def append(self, entry):
+        path = entry.get('path')
+        if path:
+            finished = time.perf_counter()
+            queued = self.queued_at.pop(path, None)
+            named = self.named_at.pop(path, None)
+            if queued is not None:
+                entry['total_seconds'] = finished - queued
+                if named is not None:
+                    entry['name_seconds'] = named - queued
+            if named is not None:
+                entry['place_seconds'] = finished - named
+        if self.retain_rows:
+            super().append(entry)
+        for sink in self.sinks:
+            sink.add(entry)
+        if path and entry.get('status'):
+            self.record(entry['path'], entry['status'], name=entry.get('new_name_suggestion') or None,
+                        target=entry.get('target'), operation=entry.get('operation'), error=entry.get('error'),
+                        cluster=entry.get('cluster'))
+
+    def close(self):
+        """Closes the sinks and the journal file."""
+        sinks, self.sinks = self.sinks, []
+        for sink in sinks:
+            sink.close()
+        with self.lock:
+            if self.file is None:
+                return
+            try:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.file.close()
+            except (OSError, ValueError):
+                pass
+            self.file = None
+
+
+def mark(renaming_data_list, image_path, state, **fields):
+    """Records a journal-only state when renaming_data_list is a RunJournal; no-op for plain lists."""
+    record = getattr(renaming_data_list, 'record', None)
+    if record is not None:
+        record(image_path, state, **fields)
+
+
+def open_run_journal(config, output_text_signal_emit, sinks=(), retain_rows=True):
+    """
+    The renaming_data_list for a run: a RunJournal writing to the source folder when Journal_enabled,
+    otherwise (or if the journal can't be opened) a RunJournal that only feeds its sinks / keeps rows.
+    """
+    source_folder = config.get('Source_folder')
+    if not config.get('Journal_enabled', True) or not source_folder:
+        return RunJournal(sinks=sinks, retain_rows=retain_rows)
+    try:
+        journal = RunJournal(source_folder, output_mode=config.get('output_mode', 'finish_subfolder'),
+                             sinks=sinks, retain_rows=retain_rows)
+    except OSError as e:
+        output_text_signal_emit(f"警告：无法打开任务日志 {journal_path(source_folder)}，本次不记录进度: {e}")
+        return RunJournal(sinks=sinks, retain_rows=retain_rows)
+    output_text_signal_emit(f"任务日志：{journal.run_id}（可用于续跑或撤销原位重命名）")
+    return journal
+
+
+def read_journal(source_folder):
+    """Yields every well-formed record; a line torn by a crash is skipped."""
+    path = journal_path(source_folder)
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8', errors='replace') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict):
+                yield record
+
+
+def load_resume_state(source_folder):
+    """
+    Returns (skip_paths, counts): absolute, normcased paths a resumed run must not touch again —
+    every file whose latest state is 'placed' plus, for in-place renames, the file it became —
+    and the number of files per latest state.
+    A 'named' in-place rename whose target exists and whose original is gone (or is the same file:
+    the crash hit between link and unlink) crashed before its 'placed' line; it counts as placed.
+    """
+    latest = {}
+    for record in read_journal(source_folder):
+        if 'path' in record and record.get('state') in JOURNAL_STATES:
+            latest[record['path']] = record
+    skip_paths = set()
+    counts = {}
+    for relative_path, record in latest.items():
+        state = record['state']
+        original_path = os.path.abspath(os.path.join(source_folder, relative_path))
+        target_path = os.path.abspath(os.path.join(source_folder, record['target'])) if record.get('target') else None
+        if (state == 'named' and record.get('operation') == 'move' and target_path and os.path.exists(target_path)
+                and (not os.path.exists(original_path) or os.path.samefile(original_path, target_path))):
+            state = 'placed'
+        counts[state] = counts.get(state, 0) + 1
+        if state != 'placed':
+            continue
+        skip_paths.add(os.path.normcase(original_path))
+        if target_path:
+            skip_paths.add(os.path.normcase(target_path))
+    return skip_paths, counts
+
+
+def undo_in_place_renames(source_folder, run_id=None, output_text_signal_emit=None):
+    """
+    撤销某次运行（默认最近一次有原位重命名的运行）的全部原位重命名：按相反顺序把新文件名改回原文件名。
+    Only os.rename is used, so this is a metadata operation per file. Files that were changed since
+    (target missing, original name taken again) are skipped. 'named' moves are included so a rename
+    interrupted before its 'placed' line is undone too. Returns (run_id, restored, skipped).
+    """
+    emit = output_text_signal_emit or (lambda message: None)
+    moves = {} # run -> {path: latest record of that path in that run}
+    last_position = {} # run -> index of its last rename record in the journal
+    for position, record in enumerate(read_journal(source_folder)):
+        state = record.get('state')
+        if 'path' not in record:
+            continue
+        if state in ('undone', 'failed') or (state in ('named', 'placed') and record.get('operation') == 'move'):
+            moves.setdefault(record.get('run'), {})[record['path']] = record
+            if state != 'undone':
+                last_position[record.get('run')] = position
+    if run_id is None:
+        candidates = [run for run, records in moves.items()
+                      if any(record['state'] in ('named', 'placed') for record in records.values())]
+        # The run appended to the journal last; ids of runs started in the same second differ only in a counter
+        run_id = max(candidates, key=last_position.get, default=None)
+    if run_id is None or run_id not in moves:
+        emit("撤销：任务日志中没有可撤销的原位重命名。")
+        return run_id, 0, 0
+
+    pending = [record for record in moves[run_id].values()
+               if record['state'] in ('named', 'placed') and record.get('target')]
+    pending.sort(key=lambda record: record.get('time', 0), reverse=True)
+    journal = RunJournal(source_folder, run_id=run_id, write_header=False)
+    restored = skipped = 0
+    try:
+        for record in pending:
+            original_path = os.path.join(source_folder, record['path'])
+            renamed_path = os.path.join(source_folder, record['target'])
+            if (os.path.exists(renamed_path) and os.path.exists(original_path)
+                    and os.path.samefile(renamed_path, original_path)):
+                os.remove(renamed_path) # Interrupted between link and unlink: only the new link has to go
+                restored += 1
+                journal.record(original_path, 'undone', target=renamed_path)
+                continue
+            if not os.path.exists(renamed_path) or os.path.exists(original_path):
+                skipped += 1
+                emit(f"撤销跳过：{record['target']} 已不存在或原文件名 {record['path']} 已被占用")
+                continue
+            try:
+                os.rename(renamed_path, original_path)
+            except OSError as e:
+                skipped += 1
+                emit(f"撤销失败：{record['target']} -> {record['path']}: {e}")
+                continue
+            restored += 1
+            journal.record(original_path, 'undone', target=renamed_path)
+    finally:
+        journal.close()
+    emit(f"撤销完成：运行 {run_id} 共恢复{restored}个文件名，跳过{skipped}个。")
+    return run_id, restored, skipped
@@ -0,0 +1,64 @@
+# logbuffer.py
+import os
+import threading
+import time
+
+
+class LogBuffer:
+    """
+    线程安全的日志缓冲：工作线程只做一次加锁追加，界面定时器批量取出后一次性渲染，
+    同时把完整日志写入磁盘文件（界面只保留最近若干行）。
+
+    Has no Qt dependency; ConfigGUI drains it from a QTimer.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = []
+        self.log_file = None
+        self.log_path = None
+        self.total_lines = 0
+
+    def emit(self, message):
+        """Same signature as the engines' output_text_signal_emit; safe to call from any thread."""
+        line = str(message)
+        with self.lock:
+            self.pending.append((time.time(), line))
+
+    def open_file(self, log_folder, prefix='airename'):
+        """Starts a new log file (log_folder/airename_YYYYmmdd_HHMMSS.log); returns its path or None."""
+        self.close_file()
+        if not log_folder:
+            return None
+        os.makedirs(log_folder, exist_ok=True)
+        path = os.path.join(log_folder, f"{prefix}_{time.strftime('%Y%m%d_%H%M%S')}.log")
+        self.log_file = open(path, 'a', encoding='utf-8', buffering=1024 * 1024)
+        self.log_path = path
+        return path
+
+    def drain(self):
+        """
+        Takes every pending line, appends them to the log file and returns the messages.
+        The file is flushed once per drain (one timer tick), so a crash or kill loses at most the lines
+        still pending, never the last ones already shown.
+        """
+        with self.lock:
+            if not self.pending:
+                return []
+            entries, self.pending = self.pending, []
+        self.total_lines += len(entries)
+        if self.log_file is not None:
+            try:
+                self.log_file.write(''.join(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))} {line}\n"
+                                            for timestamp, line in entries))
+                self.log_file.flush()
+            except (OSError, ValueError):
+                self.log_file = None # Disk full / closed: keep the GUI log going without the file
+        return [line for _, line in entries]
+
+    def close_file(self):
+        if self.log_file is not None:
+            try:
+                self.log_file.close()
+            except OSError:
+                pass
+        self.log_file = None
@@ -0,0 +1,189 @@
+# metrics.py
+import bisect
+import json
+import os
+import threading
+import time
+
+# Processing order of one image in process_image; the report lists stages in this order.
+STAGES = ('read', 'decode', 'resize', 'inference', 'encode', 'base64', 'hash', 'wait', 'request', 'download', 'parse', 'place', 'total')
+
+STAGE_DESCRIPTIONS = {
+    'read': "打开文件并解析头部",
+    'decode': "解码像素（含 EXIF 缩略图 / DCT 缩小解码）",
+    'resize': "缩放到目标尺寸",
+    'inference': "本地模型推理（批次耗时均摊到每张图片）",
+    'encode': "重新编码（JPEG/PNG）",
+    'base64': "Base64 编码",
+    'hash': "计算缓存键（文件哈希）",
+    'wait': "等待并发名额、退避与失败的重试",
+    'request': "上传请求并等待响应头",
+    'download': "读取响应体",
+    'parse': "解析 JSON",
+    'place': "复制/移动文件",
+    'total': "单张图片总耗时",
+}
+
+# Upper bounds in seconds (Prometheus "le" labels); the last bucket is +Inf
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _NullTimer:
+    """Shared no-op context manager, so disabled metrics cost one function call per stage."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _StageTimer:
+    __slots__ = ('metrics', 'stage', 'started')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+def stage_timer(stage_metrics, stage):
+    """with stage_timer(stage_metrics, 'decode'): ... — a no-op when stage_metrics is None."""
+    if stage_metrics is None:
+        return NULL_TIMER
+    return _StageTimer(stage_metrics, stage)
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram; percentiles are interpolated inside the bucket that holds them.
+    """
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = BUCKETS[index - 1] if index > 0 else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else self.max
+                estimate = lower + (upper - lower) * (rank - seen) / bucket_count
+                return min(estimate, self.max)
+            seen += bucket_count
+        return self.max
+
+
+class StageMetrics:
+    """
+    一次运行中各处理阶段的耗时直方图（线程安全），运行结束时输出到日志并写入 JSON / Prometheus 文本文件。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.started_at = time.time()
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def _ordered(self):
+        with self.lock:
+            names = [stage for stage in STAGES if stage in self.histograms]
+            names += sorted(stage for stage in self.histograms if stage not in STAGES)
+            return [(stage, self.histograms[stage]) for stage in names]
+
+    def summary_lines(self):
+        lines = ["各阶段耗时统计（毫秒）："]
+        for stage, histogram in self._ordered():
+            lines.append(f"  {stage:<9}{STAGE_DESCRIPTIONS.get(stage, '')}：{histogram.count}次，合计{histogram.sum:.2f}秒，"
+                         f"平均{histogram.sum / histogram.count * 1000:.1f}，p50 {histogram.percentile(0.5) * 1000:.1f}，"
+                         f"p95 {histogram.percentile(0.95) * 1000:.1f}，p99 {histogram.percentile(0.99) * 1000:.1f}，"
+                         f"最大{histogram.max * 1000:.1f}")
+        return lines
+
+    def to_dict(self):
+        stages = {}
+        for stage, histogram in self._ordered():
+            stages[stage] = {
+                'count': histogram.count, 'sum_seconds': histogram.sum, 'max_seconds': histogram.max,
+                'p50_seconds': histogram.percentile(0.5), 'p95_seconds': histogram.percentile(0.95),
+                'p99_seconds': histogram.percentile(0.99),
+                'buckets': {str(bound): count for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts)},
+            }
+        return {'started_at': self.started_at, 'finished_at': time.time(), 'stages': stages}
+
+    def to_prometheus(self, metric_name='airename_stage_duration_seconds'):
+        lines = [f"# HELP {metric_name} Time spent per processing stage of one image.",
+                 f"# TYPE {metric_name} histogram"]
+        for stage, histogram in self._ordered():
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                cumulative += count
+                lines.append(f'{metric_name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric_name}_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+            lines.append(f'{metric_name}_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, folder, metrics_format='json', filename='stage_metrics'):
+        """Writes stage_metrics.json or stage_metrics.prom into folder and returns the path."""
+        if metrics_format == 'prometheus':
+            path = os.path.join(folder, f"{filename}.prom")
+            content = self.to_prometheus()
+        else:
+            path = os.path.join(folder, f"{filename}.json")
+            content = json.dumps(self.to_dict(), indent=2)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+
+class StageRecorder:
+    """
+    Plain list of (stage, seconds) for code running in another process; the parent
+    feeds it into the run's StageMetrics with replay().
+    """
+    __slots__ = ('observations',)
+
+    def __init__(self):
+        self.observations = []
+
+    def observe(self, stage, seconds):
+        self.observations.append((stage, seconds))
+
+    def replay(self, stage_metrics):
+        for stage, seconds in self.observations:
+            stage_metrics.observe(stage, seconds)
+
+
+def create_stage_metrics(config):
+    """None unless Metrics_enabled, so every stage_timer() call becomes a no-op."""
+    return StageMetrics() if config.get('Metrics_enabled', False) else None
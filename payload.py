@@ -0,0 +1,175 @@
+# payload.py
+import base64
+import io
+import math
+import time
+from collections import namedtuple
+
+from decoding import open_image, open_raster_cache
+from metrics import stage_timer
+from settings import DEFAULT_CONFIG
+
+# Upload_format values, in the order the GUI lists them
+UPLOAD_FORMATS = {
+    'auto': "自动（JPEG，超出预算时尝试 WebP）",
+    'jpeg': "JPEG",
+    'webp': "WebP",
+    'original': "保持原格式（旧版，PNG 不压缩）",
+}
+# Upload_detail: 'auto' sends no detail field; 'low' asks for the fixed-cost low-resolution mode
+UPLOAD_DETAILS = {
+    'auto': "自动",
+    'low': "低细节（最省 token）",
+    'high': "高细节（按分块数）",
+}
+
+LOW_DETAIL_SIZE = 512
+# High-detail images are fitted into 2048x2048 and then scaled so the short side is at most 768
+# before being cut into tiles; anything larger is only extra bytes
+HIGH_DETAIL_MAX_SIDE = 2048
+HIGH_DETAIL_SHORT_SIDE = 768
+MIN_QUALITY = 45
+MAX_ENCODE_ATTEMPTS = 5
+
+# raster_cache (decoding.RasterCache or None) doesn't change the upload and is not part of payload_signature
+PayloadSettings = namedtuple('PayloadSettings', 'upload_format detail quality max_tiles tile_size max_bytes raster_cache')
+# data is the base64 text; byte_count the size of the encoded image before base64
+EncodedImage = namedtuple('EncodedImage', 'data mime_type format width height byte_count encode_seconds detail')
+
+
+def _upload_options(config):
+    """Every PayloadSettings field but raster_cache; missing keys take their settings.DEFAULT_CONFIG values."""
+    def setting(key):
+        value = config.get(key)
+        return DEFAULT_CONFIG[key] if value is None else value
+
+    upload_format = setting('Upload_format')
+    detail = setting('Upload_detail')
+    return (upload_format if upload_format in UPLOAD_FORMATS else 'auto',
+            detail if detail in UPLOAD_DETAILS else 'auto',
+            min(95, max(1, int(setting('Image_quality_percent')))),
+            max(1, int(setting('Upload_max_tiles'))),
+            max(64, int(setting('Vision_tile_size'))),
+            max(0, int(setting('Upload_max_bytes') or 0)))
+
+
+def get_payload_settings(config):
+    return PayloadSettings(*_upload_options(config), open_raster_cache(config))
+
+
+def describe_upload_settings(config):
+    """One run-start log line; re-encoding formats say how to keep the old original-format uploads."""
+    upload_format, detail, quality, _, _, max_bytes = _upload_options(config)
+    budget = f"，单张上限{max_bytes / 1000:.0f} KB" if max_bytes else ""
+    line = f"上传格式：{UPLOAD_FORMATS[upload_format]}，细节{UPLOAD_DETAILS[detail]}，质量{quality}%{budget}"
+    if upload_format != 'original':
+        line += "（图片会重新编码后上传；如需按原格式上传，请把 Upload_format 设为 original）"
+    return line
+
+
+def payload_signature(settings):
+    """Cache-key part for everything besides quality that changes the uploaded image."""
+    return f"{settings.upload_format}/{settings.detail}/{settings.max_tiles}x{settings.tile_size}/{settings.max_bytes}"
+
+
+def target_size(width, height, settings):
+    """
+    Largest (width, height) the model will actually look at: the low-detail square, or the
+    high-detail limits further reduced so the image covers at most max_tiles tiles. Never upscales.
+    """
+    if settings.detail == 'low':
+        scale = min(1.0, LOW_DETAIL_SIZE / max(width, height))
+    else:
+        scale = min(1.0, HIGH_DETAIL_MAX_SIDE / max(width, height), HIGH_DETAIL_SHORT_SIDE / min(width, height))
+        tile = settings.tile_size
+        # For every grid of tiles_x by tiles_y tiles, the scale that fills it; keep the largest
+        tile_scale = max(min(tiles_x * tile / width, (settings.max_tiles // tiles_x) * tile / height)
+                         for tiles_x in range(1, settings.max_tiles + 1))
+        scale = min(scale, tile_scale)
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def estimate_image_tokens(width, height, settings):
+    """Input tokens for one image under the 85 + 170 per tile rule of tiled vision models."""
+    if settings.detail == 'low':
+        return 85
+    scale = min(1.0, HIGH_DETAIL_MAX_SIDE / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, HIGH_DETAIL_SHORT_SIDE / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def flatten_alpha(img, background=(255, 255, 255)):
+    """RGB image for JPEG/WebP: transparency is composited onto a white background (product cut-outs)."""
+    from PIL import Image
+    if img.mode == 'P' and 'transparency' in img.info:
+        img = img.convert('RGBA')
+    if img.mode in ('RGBA', 'LA', 'PA'):
+        img = img.convert('RGBA')
+        flattened = Image.new('RGB', img.size, background)
+        flattened.paste(img, mask=img.getchannel('A'))
+        return flattened
+    if img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+
+def _encode(img, output_format, quality):
+    buffer = io.BytesIO()
+    if output_format == 'WEBP':
+        img.save(buffer, format='WEBP', quality=quality, method=4)
+    else:
+        # Baseline JPEG: progressive scans only help browsers render early, not an API upload
+        img.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer
+
+
+def optimize_payload(image_path, settings, stage_metrics=None):
+    """
+    按模型视觉分块和字节预算压缩图片：缩放到模型实际使用的分辨率，透明背景铺白，
+    编码为 JPEG（或 WebP）；超出 Upload_max_bytes 时依次尝试 WebP、降低质量、缩小尺寸。
+    Returns an EncodedImage. Stage timings go to stage_metrics like compress_and_encode_image.
+    """
+    from PIL import Image
+    started = time.perf_counter()
+    try:
+        with open_image(image_path, lambda width, height: target_size(width, height, settings),
+                        stage_metrics=stage_metrics, raster_cache=settings.raster_cache) as img:
+            img = flatten_alpha(img)
+
+        output_format = 'WEBP' if settings.upload_format == 'webp' else 'JPEG'
+        quality = settings.quality
+        with stage_timer(stage_metrics, 'encode'):
+            best = (_encode(img, output_format, quality), output_format, img.size)
+            attempts = 1
+            while settings.max_bytes and best[0].getbuffer().nbytes > settings.max_bytes and attempts < MAX_ENCODE_ATTEMPTS:
+                attempts += 1
+                if settings.upload_format == 'auto' and output_format == 'JPEG':
+                    output_format = 'WEBP' # Usually a quarter smaller than JPEG at the same quality
+                elif quality > MIN_QUALITY:
+                    quality = max(MIN_QUALITY, quality - 20)
+                else:
+                    # Bytes scale roughly with the pixel count
+                    scale = math.sqrt(settings.max_bytes / best[0].getbuffer().nbytes) * 0.9
+                    img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.BILINEAR)
+                candidate = _encode(img, output_format, quality)
+                if candidate.getbuffer().nbytes < best[0].getbuffer().nbytes:
+                    best = (candidate, output_format, img.size)
+
+        buffer, output_format, (width, height) = best
+        with stage_timer(stage_metrics, 'base64'):
+            encoded = base64.b64encode(buffer.getbuffer()).decode('ascii')
+    except FileNotFoundError:
+        raise
+    except Exception as e:
+        raise RuntimeError(f"Error during image compression/encoding for {image_path}: {e}")
+    return EncodedImage(encoded, f"image/{output_format.lower()}", output_format, width, height,
+                        buffer.getbuffer().nbytes, time.perf_counter() - started, settings.detail)
+
+
+def describe_payload(image_name, encoded):
+    """Log line with what was uploaded for one image."""
+    size = f"{encoded.width}x{encoded.height} " if encoded.width else ""
+    return (f"{image_name}：上传 {encoded.byte_count / 1024:.1f} KB（{size}{encoded.format}，"
+            f"预处理 {encoded.encode_seconds * 1000:.1f} ms）")
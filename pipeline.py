@@ -0,0 +1,272 @@
+# pipeline.py
+import concurrent.futures
+import os
+import queue
+import threading
+import time
+
+from backends import get_naming_backend_name
+from cache import open_result_cache
+from function import (Counter, encode_image_payload, build_chat_request, resolve_api_url,
+                      lookup_cached_suggestion, handle_name_response, record_failure, describe_processing_error,
+                      fail_cluster_members, dispatch_request, post_chat_request, collect_image_paths, log_run_settings,
+                      plan_clusters, log_run_statistics, open_run_report)
+from endpoints import create_endpoint_balancer
+from http_client import create_http_session
+from journal import mark as mark_journal, open_run_journal
+from metrics import StageRecorder, create_stage_metrics, stage_timer
+from payload import describe_payload, get_payload_settings
+from placement import NameRegistry, PlacementTotals
+from ratelimit import RequestCancelled, create_concurrency_controller
+
+_STOP = object() # Queue sentinel
+
+
+def _preprocess(image_path, payload_settings, record_stages=False):
+    """
+    Runs in a worker process: decode, thumbnail, re-encode and base64 (an EncodedImage), plus the CPU
+    time it took and, with record_stages, a StageRecorder of the per-stage timings.
+    """
+    started = time.perf_counter()
+    recorder = StageRecorder() if record_stages else None
+    encoded = encode_image_payload(image_path, payload_settings, recorder)
+    return encoded, time.perf_counter() - started, recorder
+
+
+class StageStats:
+    """
+    记录单个流水线阶段的繁忙时间，用于计算利用率（繁忙时间 / (工作者数 × 运行时间)）。
+    """
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = max(1, workers)
+        self.busy_seconds = 0.0
+        self.items = 0
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.busy_seconds += seconds
+            self.items += 1
+
+    def utilization(self, elapsed):
+        if elapsed <= 0:
+            return 0.0
+        with self.lock:
+            return min(1.0, self.busy_seconds / (self.workers * elapsed))
+
+
+class _Task:
+    __slots__ = ('image_path', 'members', 'cache_key', 'response_data', 'from_cache', 'encoded_image')
+
+    def __init__(self, image_path, members):
+        self.image_path = image_path
+        self.members = members
+        self.cache_key = None
+        self.response_data = None
+        self.from_cache = False
+        self.encoded_image = None # payload.EncodedImage
+
+
+def process_images_pipeline(config, output_text_signal_emit, stop_event, active_counter, gui_num_counter):
+    """
+    分阶段流水线引擎：进程池预处理 -> 有界队列 -> 网络请求线程 -> 有界队列 -> 文件放置线程。
+    Every stage blocks when the next one is full, so a slow API never piles up decoded images in memory.
+    Returns the same tuple as process_images_concurrently.
+    """
+    if get_naming_backend_name(config) == 'local':
+        output_text_signal_emit("错误：流水线引擎只能用远程 API 命名。本地命名后端请改用线程池或异步引擎。")
+        return 0, 0, 0, []
+    image_scan = collect_image_paths(config, output_text_signal_emit)
+    if not image_scan:
+        return 0, 0, 0, []
+
+    success_counter = Counter()
+    failure_counter = Counter()
+    saved_calls_counter = Counter()
+    placement_totals = PlacementTotals()
+    renaming_data_for_excel = open_run_journal(config, output_text_signal_emit, retain_rows=False,
+                                               sinks=(placement_totals, open_run_report(config, output_text_signal_emit)))
+    result_cache = open_result_cache(config, output_text_signal_emit)
+    http_session = create_http_session(config)
+    network_workers = max(1, int(config.get("Max_workers", 5)))
+    concurrency_controller = create_concurrency_controller(config, network_workers)
+    endpoint_balancer = create_endpoint_balancer(config)
+    stage_metrics = create_stage_metrics(config)
+    name_registry = NameRegistry()
+    preprocess_workers = max(1, int(config.get('Pipeline_preprocess_workers') or os.cpu_count() or 1))
+    queue_size = max(1, int(config.get('Pipeline_queue_size', network_workers * 2)))
+
+    log_run_settings(config, output_text_signal_emit, f"流水线引擎：预处理进程{preprocess_workers}个，请求线程{network_workers}个，队列长度{queue_size}")
+    if int(config.get('Batch_size', 1)) > 1:
+        output_text_signal_emit("提示：批量请求模式仅适用于线程池引擎，本次按单张图片请求。")
+    if get_naming_backend_name(config) == 'hybrid':
+        output_text_signal_emit("提示：混合命名后端仅适用于线程池与异步引擎，本次全部使用远程 API。")
+    clusters = plan_clusters(image_scan, config, output_text_signal_emit, stop_event)
+
+    prompt = config['Prompt']
+    payload_settings = get_payload_settings(config)
+    url = resolve_api_url(config)
+
+    # Slots bound "being preprocessed + waiting for the network stage"; freed when a network worker takes the task
+    preprocess_slots = threading.BoundedSemaphore(queue_size)
+    preprocessing = Counter()
+    request_queue = queue.Queue()
+    placement_queue = queue.Queue(maxsize=queue_size)
+    preprocess_stats = StageStats("预处理", preprocess_workers)
+    network_stats = StageStats("网络", network_workers)
+    placement_stats = StageStats("放置", 1)
+    started_at = time.monotonic()
+
+    def fail(task, error):
+        cluster_label = os.path.basename(task.image_path) if task.members else None
+        record_failure(task.image_path, describe_processing_error(task.image_path, error), output_text_signal_emit,
+                       failure_counter, gui_num_counter, renaming_data_for_excel, cluster_label)
+        if task.members:
+            fail_cluster_members(task.image_path, task.members, output_text_signal_emit, failure_counter,
+                                 gui_num_counter, renaming_data_for_excel)
+        active_counter.decrement()
+
+    def on_preprocessed(task, future):
+        preprocessing.decrement()
+        try:
+            task.encoded_image, cpu_seconds, recorder = future.result()
+            preprocess_stats.add(cpu_seconds)
+            output_text_signal_emit(describe_payload(os.path.basename(task.image_path), task.encoded_image))
+            if recorder is not None:
+                recorder.replay(stage_metrics)
+        except concurrent.futures.CancelledError:
+            preprocess_slots.release()
+            active_counter.decrement()
+            return
+        except Exception as e:
+            preprocess_slots.release()
+            fail(task, e)
+            return
+        request_queue.put(task)
+
+    def feed(process_pool):
+        for image_path, members in clusters:
+            if stop_event.is_set():
+                output_text_signal_emit("停止信号已接收，正在取消剩余任务...")
+                break
+            task = _Task(image_path, members)
+            active_counter.increment()
+            mark_journal(renaming_data_for_excel, image_path, 'queued')
+            try:
+                with stage_timer(stage_metrics if result_cache is not None else None, 'hash'):
+                    task.cache_key, cached_text = lookup_cached_suggestion(image_path, config, result_cache, prompt,
+                                                                           payload_settings)
+            except Exception as e:
+                fail(task, e)
+                continue
+            if cached_text is not None:
+                task.response_data = {'choices': [{'message': {'content': cached_text}}]}
+                task.from_cache = True
+                placement_queue.put(task)
+                continue
+            while not preprocess_slots.acquire(timeout=0.2):
+                if stop_event.is_set():
+                    break
+            else:
+                preprocessing.increment()
+                future = process_pool.submit(_preprocess, image_path, payload_settings, stage_metrics is not None)
+                future.add_done_callback(lambda f, task=task: on_preprocessed(task, f))
+                continue
+            active_counter.decrement() # Stopped while waiting for a slot
+            break
+
+    def network_worker():
+        while True:
+            task = request_queue.get()
+            if task is _STOP:
+                return
+            preprocess_slots.release()
+            if stop_event.is_set():
+                active_counter.decrement()
+                continue
+            started = time.perf_counter()
+            try:
+                encoded = task.encoded_image
+                headers, data = build_chat_request(config, prompt, encoded.data, encoded.mime_type, encoded.detail)
+                encoded = None
+                task.encoded_image = None # Free the payload as soon as it is sent
+                response = dispatch_request(post_chat_request(http_session, config, url, headers, data),
+                                            concurrency_controller, config, stop_event, output_text_signal_emit,
+                                            os.path.basename(task.image_path), stage_metrics, endpoint_balancer)
+                response.raise_for_status()
+                with stage_timer(stage_metrics, 'parse'):
+                    task.response_data = response.json()
+            except RequestCancelled:
+                active_counter.decrement()
+                continue
+            except Exception as e:
+                fail(task, e)
+                continue
+            finally:
+                network_stats.add(time.perf_counter() - started)
+            placement_queue.put(task)
+
+    def placement_worker():
+        while True:
+            task = placement_queue.get()
+            if task is _STOP:
+                return
+            started = time.perf_counter()
+            try:
+                named = handle_name_response(task.image_path, task.response_data, config, output_text_signal_emit,
+                                             success_counter, failure_counter, gui_num_counter, renaming_data_for_excel,
+                                             result_cache, task.cache_key, task.from_cache, task.members,
+                                             saved_calls_counter, stage_metrics, name_registry)
+                if task.members and not named:
+                    fail_cluster_members(task.image_path, task.members, output_text_signal_emit, failure_counter,
+                                         gui_num_counter, renaming_data_for_excel)
+            except Exception as e:
+                output_text_signal_emit(describe_processing_error(task.image_path, e))
+            finally:
+                placement_stats.add(time.perf_counter() - started)
+                active_counter.decrement()
+
+    def report(final=False):
+        elapsed = time.monotonic() - started_at
+        prefix = "流水线统计" if final else "流水线状态"
+        output_text_signal_emit(
+            f"{prefix}：预处理中{preprocessing.get_value()}，请求队列{request_queue.qsize()}，放置队列{placement_queue.qsize()}/{queue_size}；"
+            f"利用率 预处理{preprocess_stats.utilization(elapsed) * 100:.0f}% "
+            f"网络{network_stats.utilization(elapsed) * 100:.0f}% 放置{placement_stats.utilization(elapsed) * 100:.0f}%")
+
+    network_threads = [threading.Thread(target=network_worker, daemon=True) for _ in range(network_workers)]
+    placement_thread = threading.Thread(target=placement_worker, daemon=True)
+    for thread in network_threads + [placement_thread]:
+        thread.start()
+
+    report_interval = float(config.get('Pipeline_report_interval', 5.0))
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=preprocess_workers) as process_pool:
+            feeder = threading.Thread(target=feed, args=(process_pool,), daemon=True)
+            feeder.start()
+            while feeder.is_alive():
+                feeder.join(timeout=report_interval)
+                if feeder.is_alive():
+                    report()
+        # Process pool is drained: every preprocessed task is now in request_queue
+        for _ in network_threads:
+            request_queue.put(_STOP)
+        for thread in network_threads:
+            thread.join()
+        placement_queue.put(_STOP)
+        placement_thread.join()
+    except KeyboardInterrupt:
+        output_text_signal_emit("检测到键盘中断！正在尝试停止...")
+        stop_event.set()
+
+    report(final=True)
+    output_text_signal_emit(concurrency_controller.summary())
+    if endpoint_balancer.is_multi:
+        output_text_signal_emit(endpoint_balancer.summary())
+    output_text_signal_emit(http_session.summary())
+    http_session.close()
+    renaming_data_for_excel.close()
+    log_run_statistics(config, output_text_signal_emit, saved_calls_counter, result_cache, stage_metrics,
+                       placement_totals)
+    return image_scan.count, success_counter.get_value(), failure_counter.get_value(), renaming_data_for_excel
@@ -0,0 +1,231 @@
+# placement.py
+import errno
+import os
+import shutil
+import sys
+import threading
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+# Placement_strategy values for the Finish / custom output modes, in the order the GUI lists them
+PLACEMENT_STRATEGIES = {
+    'reflink': "写时复制克隆（不支持时复制）",
+    'auto': "克隆 > 硬链接 > 复制",
+    'hardlink': "硬链接（跨磁盘时复制）",
+    'copy': "完整复制",
+}
+
+FICLONE = 0x40049409 # _IOW(0x94, 9, int) from linux/fs.h
+# Errors meaning "this filesystem / device pair can't do it", as opposed to a real I/O failure
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EPERM, errno.EOPNOTSUPP, errno.ENOSYS,
+                       getattr(errno, 'ENOTSUP', errno.EOPNOTSUPP), errno.EMLINK}
+# st_dev of target folders where FICLONE already failed; checked before every attempt
+_reflink_unsupported_devices = set()
+
+
+def _try_reflink(source_path, target_path):
+    """
+    Clones source into a new target_path with FICLONE: no data is read or written, the blocks are shared
+    copy-on-write (Btrfs, XFS with reflink=1, bcachefs, OCFS2). Returns False when unsupported.
+    """
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
+    target_device = os.stat(os.path.dirname(target_path) or '.').st_dev
+    if target_device in _reflink_unsupported_devices:
+        return False
+    with open(source_path, 'rb') as source_file:
+        target_fd = os.open(target_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            fcntl.ioctl(target_fd, FICLONE, source_file.fileno())
+        except OSError as e:
+            os.close(target_fd)
+            os.remove(target_path)
+            if e.errno in _UNSUPPORTED_ERRNOS:
+                _reflink_unsupported_devices.add(target_device)
+                return False
+            raise
+        os.close(target_fd)
+    shutil.copystat(source_path, target_path)
+    return True
+
+
+def _try_hardlink(source_path, target_path):
+    """Returns False when source and target are on different devices or links aren't supported."""
+    try:
+        os.link(source_path, target_path)
+    except OSError as e:
+        if e.errno in _UNSUPPORTED_ERRNOS:
+            return False
+        raise
+    return True
+
+
+def _copy(source_path, target_path, size):
+    """
+    In-kernel copy with os.copy_file_range where available (the filesystem may share extents or do a
+    server-side copy on NFS/SMB), otherwise a buffered copy. Metadata is copied like shutil.copy2.
+    The target is created exclusively: FileExistsError instead of overwriting.
+    """
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    try:
+        with open(source_path, 'rb') as source_file, open(target_path, 'xb') as target_file:
+            remaining = size if copy_file_range is not None else 0
+            try:
+                while remaining > 0:
+                    copied = copy_file_range(source_file.fileno(), target_file.fileno(), min(remaining, 1 << 30))
+                    if copied == 0:
+                        break
+                    remaining -= copied
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED_ERRNOS:
+                    raise
+                source_file.seek(0)
+                target_file.seek(0)
+                target_file.truncate()
+            if copy_file_range is None or target_file.tell() == 0:
+                shutil.copyfileobj(source_file, target_file, 1024 * 1024)
+    except FileExistsError:
+        raise
+    except BaseException:
+        try:
+            os.remove(target_path)
+        except OSError:
+            pass
+        raise
+    shutil.copystat(source_path, target_path)
+
+
+def place_file(source_path, target_path, strategy='reflink'):
+    """
+    Puts a copy of source_path at target_path using the cheapest method the strategy allows.
+    Returns (method, size): method is 'reflink', 'hardlink' or 'copy'; only 'copy' moves the data.
+    """
+    size = os.stat(source_path).st_size
+    if strategy in ('reflink', 'auto') and _try_reflink(source_path, target_path):
+        return 'reflink', size
+    # A hardlink shares the inode, so edits to either file show up in both; only used when asked for
+    if strategy in ('hardlink', 'auto') and _try_hardlink(source_path, target_path):
+        return 'hardlink', size
+    _copy(source_path, target_path, size)
+    return 'copy', size
+
+
+def move_file(source_path, target_path):
+    """
+    Renames without replacing an existing target: link + unlink (EEXIST if the name is taken),
+    or an exists check + shutil.move on filesystems without hard links.
+    """
+    try:
+        os.link(source_path, target_path)
+    except OSError as e:
+        if e.errno not in _UNSUPPORTED_ERRNOS:
+            raise
+        if os.path.lexists(target_path):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), target_path)
+        shutil.move(source_path, target_path)
+        return
+    os.remove(source_path)
+
+
+class NameRegistry:
+    """
+    一次运行内各目标文件夹的文件名登记表（线程安全）：每个文件夹只扫描一次，
+    之后分配 name_1、name_2 … 时不再逐个 stat，并保证并发线程不会拿到同一个文件名。
+
+    Per directory it keeps the set of taken names and, per base name, the next suffix to try,
+    so handing out the k-th duplicate is O(1) amortized. Files created by other programs after
+    the scan are caught by the exclusive create in place_file / move_file.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.directories = {} # normcased directory -> (taken normcased names, {normcased base+ext: next suffix})
+        self.scans = 0
+
+    def _directory(self, directory):
+        key = os.path.normcase(os.path.abspath(directory))
+        state = self.directories.get(key)
+        if state is None:
+            taken = set()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        taken.add(os.path.normcase(entry.name))
+            except FileNotFoundError:
+                pass
+            state = self.directories[key] = (taken, {})
+            self.scans += 1
+        return state
+
+    def reserve(self, target_path):
+        """Returns target_path, or the first free target_path with a _N suffix, and marks it taken."""
+        directory, filename = os.path.split(target_path)
+        base, extension = os.path.splitext(filename)
+        with self.lock:
+            taken, next_suffix = self._directory(directory)
+            if os.path.normcase(filename) not in taken:
+                taken.add(os.path.normcase(filename))
+                return target_path
+            stem = os.path.normcase(filename)
+            counter = next_suffix.get(stem, 1)
+            while os.path.normcase(f"{base}_{counter}{extension}") in taken:
+                counter += 1
+            next_suffix[stem] = counter + 1
+            candidate = f"{base}_{counter}{extension}"
+            taken.add(os.path.normcase(candidate))
+            return os.path.join(directory, candidate)
+
+    def release(self, path):
+        """Frees a name: a reservation that was never used, or a file that was renamed away."""
+        directory, filename = os.path.split(path)
+        key = os.path.normcase(os.path.abspath(directory))
+        with self.lock:
+            state = self.directories.get(key)
+            if state is not None:
+                state[0].discard(os.path.normcase(filename))
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+class PlacementTotals:
+    """
+    RunJournal sink counting files and bytes per placement method, for the end-of-run summary line.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.total_bytes = 0
+        self.copied_bytes = 0
+
+    def add(self, entry):
+        method = entry.get('placement')
+        if not method or method == 'move':
+            return
+        size = entry.get('size', 0)
+        with self.lock:
+            self.counts[method] = self.counts.get(method, 0) + 1
+            self.total_bytes += size
+            if method == 'copy':
+                self.copied_bytes += size
+
+    def close(self):
+        pass
+
+    def summary(self):
+        """
+        Files per placement method and the bytes that were actually copied;
+        None when nothing was copied to a new location (in-place renames only).
+        """
+        if not self.counts:
+            return None
+        labels = (('reflink', "克隆"), ('hardlink', "硬链接"), ('copy', "复制"))
+        methods = "，".join(f"{label}{self.counts[method]}个" for method, label in labels if method in self.counts)
+        return (f"文件放置：{methods}；实际复制{format_bytes(self.copied_bytes)}，"
+                f"共{format_bytes(self.total_bytes)}（节省{format_bytes(self.total_bytes - self.copied_bytes)}）")
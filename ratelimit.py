@@ -0,0 +1,274 @@
+# ratelimit.py
+import collections
+import email.utils
+import random
+import threading
+import time
+
+# 429/503: the server asks us to slow down. Others in RETRYABLE_STATUS are transient failures.
+THROTTLE_STATUS = {429, 503}
+RETRYABLE_STATUS = {408, 500, 502, 504}
+
+
+class RequestCancelled(Exception):
+    """Raised when the stop signal arrives while a request waits for a concurrency slot or a backoff."""
+
+
+def parse_retry_after(value):
+    """
+    解析 Retry-After 头（秒数或 HTTP 日期），返回需要等待的秒数；无法解析时返回 None。
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0, retry_after=None):
+    """
+    Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt)), never shorter than Retry-After.
+    """
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AsyncWaitQueue:
+    """
+    协程按到达顺序排队等待一个资源（并发槽位、端点），由释放资源的一方唤醒，而不是轮询。
+
+    Only the head of the queue may take the resource, so waiters are served first come, first served.
+    The owner calls wake() with its lock held whenever the resource may have become free; that can happen
+    on any thread, so the head's future is resolved in its own loop via call_soon_threadsafe.
+    A waiter also wakes on its own after wait_timeout(now) seconds, for pauses that end and for stop_event.
+    """
+    def __init__(self, lock):
+        self.lock = lock # The owner's lock (Condition), which also guards the queue
+        self.waiters = collections.deque() # [loop, future] entries, head first
+
+    def wake(self):
+        """Wakes the head waiter; call with the lock held."""
+        if not self.waiters:
+            return
+        loop, future = self.waiters[0]
+        try:
+            loop.call_soon_threadsafe(_wake, future)
+        except RuntimeError:
+            pass # Its loop is closed; the waiter is gone
+
+    async def acquire(self, take, stop_event=None, wait_timeout=None):
+        """
+        Returns the first result of take(now) (called with the lock held) that is not None,
+        or None if stop_event was set while waiting.
+        """
+        import asyncio
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if not self.waiters:
+                result = take(time.monotonic())
+                if result is not None:
+                    return result
+            entry = [loop, loop.create_future()]
+            self.waiters.append(entry)
+        try:
+            while True:
+                if stop_event is not None and stop_event.is_set():
+                    return None
+                timeout = wait_timeout(time.monotonic()) if wait_timeout is not None else 0.2
+                await asyncio.wait((entry[1],), timeout=timeout)
+                with self.lock:
+                    if self.waiters[0] is entry:
+                        result = take(time.monotonic())
+                        if result is not None:
+                            return result
+                    if entry[1].done():
+                        entry[1] = loop.create_future()
+        finally:
+            with self.lock:
+                head = self.waiters[0] is entry
+                self.waiters.remove(entry)
+                if head:
+                    self.wake() # The next waiter may find a slot too
+
+
+class AdaptiveConcurrencyController:
+    """
+    AIMD 自适应并发控制：延迟与错误率正常时逐步提高并发上限（每完成约 limit 个请求 +1），
+    遇到 429/503 时减半，延迟明显升高或出现 5xx 时小幅下调。
+
+    The limit starts at max_limit (the configured worker count) unless initial_limit is given, so without
+    throttling a run is as concurrent as a fixed pool; it only drops below that after 429/503, 5xx or rising latency.
+    Both engines share it: threads block in acquire(), coroutines await acquire_async().
+    With enabled=False the limit stays at max_limit and only retries/statistics apply.
+    """
+    def __init__(self, max_limit, initial_limit=None, min_limit=1, enabled=True,
+                 latency_tolerance=2.0, report_interval=5.0):
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.enabled = enabled
+        if not enabled or initial_limit is None:
+            initial_limit = self.max_limit
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial_limit)))
+        self.latency_tolerance = latency_tolerance
+        self.report_interval = report_interval
+
+        self.in_flight = 0
+        self.completed = 0
+        self.retries = 0
+        self.throttled = 0
+        self.errors = 0
+        self.peak_limit = self.limit
+        self.ewma_latency = None
+        self.baseline_latency = None
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.started_at = time.monotonic()
+        self.last_report = self.started_at
+        self.condition = threading.Condition()
+        self.async_waiters = AsyncWaitQueue(self.condition)
+
+    def _can_start(self, now):
+        return now >= self.paused_until and self.in_flight < int(self.limit)
+
+    def _wait_timeout(self, now):
+        wait = self.paused_until - now if now < self.paused_until else 0.2
+        return min(max(wait, 0.01), 0.2)
+
+    def _take(self, now):
+        if self._can_start(now):
+            self.in_flight += 1
+            return True
+        return None
+
+    def acquire(self, stop_event=None):
+        """
+        Blocks until a slot is free. Returns False if stop_event was set while waiting.
+        """
+        with self.condition:
+            while True:
+                if stop_event is not None and stop_event.is_set():
+                    return False
+                now = time.monotonic()
+                if self._can_start(now):
+                    self.in_flight += 1
+                    return True
+                self.condition.wait(timeout=self._wait_timeout(now))
+
+    def try_acquire(self):
+        with self.condition:
+            if self._can_start(time.monotonic()):
+                self.in_flight += 1
+                return True
+            return False
+
+    async def acquire_async(self, stop_event=None):
+        """
+        Awaits a free slot in arrival order (see AsyncWaitQueue). Returns False if stop_event was set while waiting.
+        """
+        return bool(await self.async_waiters.acquire(self._take, stop_event, self._wait_timeout))
+
+    def release(self, latency=None, outcome='success'):
+        """
+        outcome: 'success' | 'throttled' (429/503) | 'error' (5xx, timeouts, connection errors) | 'neutral' (other 4xx).
+        """
+        with self.condition:
+            self.in_flight = max(0, self.in_flight - 1)
+            self.completed += 1
+            now = time.monotonic()
+            if latency is not None and outcome in ('success', 'neutral'):
+                self.ewma_latency = latency if self.ewma_latency is None else 0.8 * self.ewma_latency + 0.2 * latency
+                if self.completed >= 5:
+                    self.baseline_latency = (self.ewma_latency if self.baseline_latency is None
+                                             else min(self.baseline_latency, self.ewma_latency))
+
+            if outcome == 'throttled':
+                self.throttled += 1
+                self._decrease(now, 0.5)
+            elif outcome == 'error':
+                self.errors += 1
+                self._decrease(now, 0.9)
+            elif outcome == 'success' and self.enabled:
+                if (self.baseline_latency is not None and self.ewma_latency is not None
+                        and self.ewma_latency > self.baseline_latency * self.latency_tolerance):
+                    self._decrease(now, 0.9)
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                    self.peak_limit = max(self.peak_limit, self.limit)
+            self.condition.notify_all()
+            self.async_waiters.wake()
+
+    def _decrease(self, now, factor):
+        # One cut per round trip, so a burst of 429s from the same window only halves once
+        if not self.enabled:
+            return
+        cooldown = self.ewma_latency or 1.0
+        if now - self.last_decrease < cooldown:
+            return
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.last_decrease = now
+
+    def pause(self, seconds):
+        """Honours Retry-After: no new request starts until the pause ends."""
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def record_retry(self):
+        with self.condition:
+            self.retries += 1
+
+    def requests_per_second(self):
+        elapsed = time.monotonic() - self.started_at
+        return self.completed / elapsed if elapsed > 0 else 0.0
+
+    def status_line(self):
+        with self.condition:
+            limit, in_flight = int(self.limit), self.in_flight
+            retries, throttled, errors = self.retries, self.throttled, self.errors
+        return (f"自适应并发：当前上限{limit}，进行中{in_flight}，重试{retries}次，"
+                f"限流{throttled}次，错误{errors}次，吞吐{self.requests_per_second():.2f}请求/秒")
+
+    def maybe_report(self, output_text_signal_emit):
+        now = time.monotonic()
+        with self.condition:
+            if now - self.last_report < self.report_interval:
+                return
+            self.last_report = now
+        output_text_signal_emit(self.status_line())
+
+    def summary(self):
+        return (f"请求统计：完成{self.completed}次请求，重试{self.retries}次，限流{self.throttled}次，"
+                f"最终并发上限{int(self.limit)}（峰值{int(self.peak_limit)}），"
+                f"平均吞吐{self.requests_per_second():.2f}请求/秒")
+
+
+def create_concurrency_controller(config, max_limit):
+    return AdaptiveConcurrencyController(
+        max_limit,
+        initial_limit=config.get('Adaptive_initial_concurrency'),
+        min_limit=config.get('Adaptive_min_concurrency', 1),
+        enabled=config.get('Adaptive_concurrency', True),
+        latency_tolerance=float(config.get('Adaptive_latency_tolerance', 2.0)),
+    )
+
+
+def get_retry_settings(config):
+    """(max_retries, backoff_base_seconds, backoff_cap_seconds)"""
+    return (max(0, int(config.get('Max_retries', 3))),
+            float(config.get('Retry_backoff_base', 1.0)),
+            float(config.get('Retry_backoff_max', 60.0)))
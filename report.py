@@ -0,0 +1,223 @@
+# report.py
+import contextlib
+import csv
+import json
+import os
+import tempfile
+import threading
+import time
+
+REPORT_FORMATS = ('xlsx', 'csv', 'jsonl')
+
+# (row key, header, Excel column width); 'cluster' is only included when near-duplicate grouping is on
+REPORT_COLUMNS = (
+    ('original_name', "Original Filename", 40),
+    ('new_name_suggestion', "New Filename", 40),
+    ('cluster', "Cluster (Representative)", 40),
+    ('status', "Status", 10),
+    ('error', "Error", 60),
+    ('target', "Target Path", 60),
+    ('placement', "Placement", 10),
+    ('size', "Size (bytes)", 14),
+    ('name_seconds', "Name Seconds", 14),
+    ('place_seconds', "Place Seconds", 14),
+    ('total_seconds', "Total Seconds", 14),
+)
+
+
+def parse_report_formats(value):
+    """'xlsx,csv' or ['xlsx', 'csv'] -> ('xlsx', 'csv'); unknown names are dropped, '' means no report."""
+    if isinstance(value, str):
+        value = value.split(',')
+    formats = []
+    for name in value or ():
+        name = str(name).strip().lower()
+        if name in REPORT_FORMATS and name not in formats:
+            formats.append(name)
+    return tuple(formats)
+
+
+def _create_exclusive(path, mode='x', **kwargs):
+    """Opens path (or path_1, path_2 ...) for exclusive creation; returns (file, path)."""
+    base, extension = os.path.splitext(path)
+    counter = 0
+    while True:
+        candidate = path if counter == 0 else f"{base}_{counter}{extension}"
+        try:
+            return open(candidate, mode, **kwargs), candidate
+        except FileExistsError:
+            counter += 1
+
+
+def _claim_exclusive(temp_path, path):
+    """
+    Gives the finished file temp_path the name path (or path_1, path_2 ...) without replacing an existing
+    file; returns the name. Hard links claim the name atomically; where they are unsupported an O_EXCL
+    placeholder is replaced instead.
+    """
+    base, extension = os.path.splitext(path)
+    counter = 0
+    while True:
+        candidate = path if counter == 0 else f"{base}_{counter}{extension}"
+        try:
+            os.link(temp_path, candidate)
+        except FileExistsError:
+            counter += 1
+            continue
+        except OSError:
+            placeholder, candidate = _create_exclusive(path, 'xb')
+            placeholder.close()
+            os.replace(temp_path, candidate)
+            return candidate
+        os.unlink(temp_path)
+        return candidate
+
+
+class _XlsxSink:
+    """
+    openpyxl write-only workbook: rows go straight to a temporary XML part on disk, so memory stays flat.
+    Nothing is created in the report folder until close(), which saves to a temporary name there and then
+    claims the report name, so a crashed run leaves no empty or half-written .xlsx behind.
+    """
+    def __init__(self, path, columns, sheet_title):
+        import openpyxl # Only needed when an Excel report is requested
+        from openpyxl.utils import get_column_letter
+        self.path = path
+        self.workbook = openpyxl.Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet(sheet_title)
+        for column_number, (_, _, width) in enumerate(columns, 1):
+            self.sheet.column_dimensions[get_column_letter(column_number)].width = width
+        self.sheet.append([header for _, header, _ in columns])
+
+    def add(self, values, row):
+        self.sheet.append(values)
+
+    def close(self):
+        folder, name = os.path.split(self.path)
+        fd, temp_path = tempfile.mkstemp(prefix=f".{name}.", suffix='.tmp', dir=folder or None)
+        os.close(fd)
+        try:
+            self.workbook.save(temp_path)
+            self.path = _claim_exclusive(temp_path, self.path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(temp_path)
+            raise
+
+
+class _CsvSink:
+    """UTF-8 with BOM so Excel shows the Chinese names correctly; every row is flushed."""
+    def __init__(self, path, columns):
+        self.file, self.path = _create_exclusive(path, 'x', encoding='utf-8-sig', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([header for _, header, _ in columns])
+        self.file.flush()
+
+    def add(self, values, row):
+        self.writer.writerow(values)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class _JsonlSink:
+    def __init__(self, path, columns):
+        self.file, self.path = _create_exclusive(path, 'x', encoding='utf-8')
+
+    def add(self, values, row):
+        self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class StreamingReport:
+    """
+    运行过程中逐行写入的结果报告（xlsx / csv / jsonl 任意组合），不在内存中保留全部结果。
+
+    Attached to the run's RunJournal as a sink: add(entry) is called once per result row from any
+    worker thread. Files are created on the first row (in the folder from folder_resolver), so a run
+    without results leaves nothing behind. CSV and JSONL are flushed per row and survive a crash;
+    the .xlsx only appears once close() has saved it completely.
+    """
+    def __init__(self, formats, folder_resolver, output_text_signal_emit, report_name="商品标题", include_cluster=False):
+        self.formats = formats
+        self.folder_resolver = folder_resolver
+        self.emit = output_text_signal_emit
+        self.report_name = report_name
+        self.columns = [column for column in REPORT_COLUMNS if include_cluster or column[0] != 'cluster']
+        self.lock = threading.Lock()
+        self.sinks = None # Opened on the first row
+        self.rows = 0
+        self.write_seconds = 0.0
+
+    def _open(self):
+        self.sinks = []
+        folder = self.folder_resolver()
+        if not folder:
+            return
+        for report_format in self.formats:
+            path = os.path.join(folder, f"{self.report_name}.{report_format}")
+            try:
+                if report_format == 'xlsx':
+                    self.sinks.append(_XlsxSink(path, self.columns, self.report_name))
+                elif report_format == 'csv':
+                    self.sinks.append(_CsvSink(path, self.columns))
+                else:
+                    self.sinks.append(_JsonlSink(path, self.columns))
+            except ImportError:
+                self.emit("错误：Excel报告生成失败。需要安装 'openpyxl' 库。请运行 'pip install openpyxl'。")
+            except OSError as e:
+                self.emit(f"错误：无法创建报告文件 {path}: {e}")
+
+    def row_values(self, entry):
+        row = {}
+        for key, _, _ in self.columns:
+            value = entry.get(key)
+            if isinstance(value, float):
+                value = round(value, 3)
+            row[key] = value
+        row['original_name'] = row['original_name'] or 'N/A' # Should always have original_name
+        return row
+
+    def add(self, entry):
+        row = self.row_values(entry)
+        values = ['' if value is None else value for value in row.values()]
+        with self.lock:
+            started = time.perf_counter()
+            if self.sinks is None:
+                self._open()
+            for sink in list(self.sinks):
+                try:
+                    sink.add(values, row)
+                except (OSError, ValueError) as e:
+                    self.emit(f"错误：写入报告 {sink.path} 失败，停止写入该文件: {e}")
+                    self.sinks.remove(sink)
+            self.rows += 1
+            self.write_seconds += time.perf_counter() - started
+
+    def close(self):
+        with self.lock:
+            for sink in self.sinks or ():
+                try:
+                    sink.close()
+                except Exception as e:
+                    self.emit(f"错误：生成报告失败 {sink.path}: {e}")
+                else:
+                    self.emit(f"成功：报告已保存到 {sink.path}")
+            if self.sinks:
+                self.emit(f"报告：共{self.rows}行，写入耗时{self.write_seconds:.2f}秒")
+            self.sinks = []
+
+
+def write_report(rows, formats, folder, output_text_signal_emit, report_name="商品标题", include_cluster=None):
+    """Writes an already collected list of result rows with the same sinks; returns the number of rows."""
+    if include_cluster is None:
+        include_cluster = any(entry.get('cluster') for entry in rows)
+    report = StreamingReport(formats, lambda: folder, output_text_signal_emit, report_name, include_cluster)
+    for entry in rows:
+        report.add(entry)
+    report.close()
+    return report.rows
@@ -0,0 +1,188 @@
+# settings.py
+import copy
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+
+DEFAULT_CONFIG_PATH = 'config.json'
+DEFAULT_PROMPT = '请识别图片内容并用中文命名，要求：1.简洁(不超过10个字)。2.准确。3.不包含任何标点及特殊符号。'
+
+DEFAULT_CONFIG = {
+    'Base_url': '',
+    'Api_key': '', 'Model': 'gpt-4.1-nano-2025-04-14',
+    'Image_quality_percent': 80, 'Max_workers': 10, 'Source_folder': '',
+    'Prompt': DEFAULT_PROMPT,
+    'output_mode': 'finish_subfolder', 'custom_output_folder': '',
+    'Cache_enabled': True, 'Cache_max_entries': 50000, 'Cache_max_age_days': 30,
+    'Dedup_enabled': False, 'Dedup_max_distance': 5, 'Dedup_hash_method': 'dhash',
+    'Connect_timeout': 10, 'Read_timeout': 60,
+    'Engine': 'threads', 'Async_concurrency': 200,
+    'Adaptive_concurrency': True, 'Max_retries': 3, 'Retry_backoff_base': 1.0, 'Retry_backoff_max': 60.0,
+    'Recursive': False, 'Include_patterns': '', 'Exclude_patterns': '',
+    'Batch_size': 1,
+    'Metrics_enabled': False, 'Metrics_format': 'json',
+    'Log_folder': 'logs', 'Log_max_lines': 5000, 'Log_flush_interval_ms': 100,
+    'Config_save_delay_ms': 500,
+    'Journal_enabled': True, 'Resume': False,
+    'Placement_strategy': 'reflink',
+    'Report_formats': 'xlsx',
+    'Upload_format': 'auto', 'Upload_detail': 'auto', 'Upload_max_tiles': 1, 'Vision_tile_size': 512,
+    'Upload_max_bytes': 150000,
+    'Raster_cache_enabled': True, 'Raster_cache_folder': 'airename_raster_cache', 'Raster_cache_max_age_days': 30,
+    'Queue_path': 'airename_jobs.sqlite3', 'Queue_parallel_jobs': 2, 'Queue_progress_interval': 5,
+    'Distributed_listen': '127.0.0.1:8765', 'Distributed_token': '', 'Distributed_db': '', 'Distributed_unit_size': 20,
+    'Distributed_lease_seconds': 60, 'Distributed_prefetch_units': 2, 'Distributed_progress_interval': 10,
+    'Worker_idle_timeout': 300, 'Worker_source_root': '',
+    'Endpoints': [], 'Endpoint_eject_after': 3, 'Endpoint_eject_seconds': 30,
+    'Naming_backend': 'remote', 'Local_model_path': '', 'Local_labels_path': '', 'Local_label_embeddings_path': '',
+    'Local_batch_size': 16, 'Local_batch_wait_ms': 10, 'Local_threads': 0, 'Local_logit_scale': 100.0,
+    'Hybrid_min_confidence': 0.5
+}
+
+
+# The config file load_config_file read last; relative data paths (caches, queue) live next to it
+_loaded_config_path = DEFAULT_CONFIG_PATH
+
+
+def resolve_data_path(path, config_path=None):
+    """
+    A relative data path (Cache_path, Queue_path ...) resolved against the directory of config_path,
+    by default the config file load_config_file read last, instead of the working directory.
+    """
+    if os.path.isabs(path):
+        return path
+    return os.path.join(os.path.dirname(os.path.abspath(config_path or _loaded_config_path)), path)
+
+
+def default_config():
+    return copy.deepcopy(DEFAULT_CONFIG)
+
+
+def normalize_config(loaded_config):
+    """
+    在默认配置上合并 config.json 的内容，并迁移旧版本的配置项（Option、Proxy_quality）。
+    """
+    final_config = default_config()
+    final_config.update(loaded_config)
+
+    if 'Option' in final_config: del final_config['Option']
+    if 'Proxy_quality' in final_config:
+        if 'Image_quality_percent' not in loaded_config and isinstance(final_config.get('Proxy_quality'), float):
+             final_config['Image_quality_percent'] = int(final_config['Proxy_quality'] * 100)
+        del final_config['Proxy_quality']
+
+    final_config['Image_quality_percent'] = int(final_config.get('Image_quality_percent', DEFAULT_CONFIG['Image_quality_percent']))
+    final_config['Max_workers'] = int(final_config.get('Max_workers', DEFAULT_CONFIG['Max_workers']))
+    return final_config
+
+
+def load_config_file(config_path=DEFAULT_CONFIG_PATH):
+    """
+    Returns the merged configuration; a missing file yields the defaults.
+    json.JSONDecodeError / OSError propagate so each front end can report them its own way.
+    """
+    global _loaded_config_path
+    _loaded_config_path = config_path
+    if not os.path.exists(config_path):
+        return default_config()
+    with open(config_path, 'r', encoding='utf-8') as file:
+        return normalize_config(json.load(file))
+
+
+def save_config_file(config, config_path=DEFAULT_CONFIG_PATH):
+    """
+    原子写入配置：先写同目录下的临时文件并 fsync，再用 os.replace 替换，崩溃时旧文件保持完整。
+    """
+    directory = os.path.dirname(os.path.abspath(config_path))
+    try:
+        mode = stat.S_IMODE(os.stat(config_path).st_mode)
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask # What a plain open(config_path, 'w') would have created
+    descriptor, temp_path = tempfile.mkstemp(prefix='.config-', suffix='.tmp', dir=directory)
+    try:
+        os.chmod(temp_path, mode) # mkstemp creates 0600; keep the permissions config.json already had
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as file:
+            json.dump(config, file, indent=4, ensure_ascii=False)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, config_path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class DebouncedConfigWriter:
+    """
+    在后台线程中合并保存配置：每次修改只记录快照，最后一次修改 delay 秒后才真正写盘。
+    requests / writes count edits and disk writes, so the coalescing can be checked.
+
+    on_error(message) is called from the writer thread.
+    """
+    def __init__(self, config_path=DEFAULT_CONFIG_PATH, delay=0.5, on_error=None):
+        self.config_path = config_path
+        self.delay = delay
+        self.on_error = on_error
+        self.condition = threading.Condition()
+        self.pending = None
+        self.deadline = 0.0
+        self.closed = False
+        self.requests = 0
+        self.writes = 0
+        self.thread = threading.Thread(target=self._run, name='config-writer', daemon=True)
+        self.thread.start()
+
+    def schedule(self, config):
+        """Records a snapshot of config (a shallow copy, taken on the caller's thread) to be written later."""
+        snapshot = dict(config)
+        with self.condition:
+            self.pending = snapshot
+            self.deadline = time.monotonic() + self.delay
+            self.requests += 1
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.closed and (self.pending is None or time.monotonic() < self.deadline):
+                    timeout = None if self.pending is None else max(0.0, self.deadline - time.monotonic())
+                    self.condition.wait(timeout)
+                if self.closed:
+                    return
+                snapshot, self.pending = self.pending, None
+            self._write(snapshot)
+
+    def _write(self, snapshot):
+        try:
+            save_config_file(snapshot, self.config_path)
+        except Exception as e:
+            if self.on_error:
+                self.on_error(f"错误：无法保存配置文件 {self.config_path}: {e}")
+        else:
+            with self.condition:
+                self.writes += 1
+
+    def flush(self):
+        """Writes any pending snapshot now, on the calling thread."""
+        with self.condition:
+            snapshot, self.pending = self.pending, None
+        if snapshot is not None:
+            self._write(snapshot)
+
+    def close(self):
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join(timeout=5)
+
+    def summary(self):
+        with self.condition:
+            return f"配置保存统计：{self.requests}次修改，实际写盘{self.writes}次"
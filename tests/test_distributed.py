@@ -0,0 +1,73 @@
+import pytest
+
+from distributed import MAX_UNIT_ATTEMPTS, LeaseStore, start_lease_server
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LeaseStore(str(tmp_path / 'units.sqlite3'))
+    store.start_run('run', str(tmp_path), {})
+    yield store
+    store.close()
+
+
+def test_lease_hands_out_each_unit_once(store):
+    first = store.add_unit('run', ['a.jpg'])
+    second = store.add_unit('run', ['b.jpg'])
+    assert store.lease('w1', 60)['unit'] == first
+    assert store.lease('w2', 60)['unit'] == second
+    assert store.lease('w3', 60) == {'unit': None, 'finished': False}
+
+
+def test_expired_lease_is_reissued(store):
+    unit_id = store.add_unit('run', ['a.jpg'])
+    assert store.lease('w1', -1)['unit'] == unit_id # Already expired
+    reissued = store.lease('w2', 60)
+    assert reissued['unit'] == unit_id
+    assert store.heartbeat(unit_id, 'w1', 60) is False
+    assert store.heartbeat(unit_id, 'w2', 60) is True
+
+
+def test_unit_fails_after_max_attempts(store):
+    unit_id = store.add_unit('run', ['a.jpg', 'b.jpg'])
+    for attempt in range(MAX_UNIT_ATTEMPTS):
+        assert store.lease(f'w{attempt}', -1)['unit'] == unit_id
+    assert store.lease('late', 60) == {'unit': None, 'finished': False}
+    assert store.unit_counts('run') == {'failed': 1}
+    results = store.results_after('run', 0)
+    assert sorted(result['path'] for result in results) == ['a.jpg', 'b.jpg']
+    assert all(result['error'] and not result['name'] for result in results)
+
+
+def test_complete_rejects_paths_outside_the_unit(store):
+    unit_id = store.add_unit('run', ['a.jpg'])
+    store.lease('w1', 60)
+    assert store.complete(unit_id, 'w1', [{'path': '../../etc/passwd', 'name': 'x'}]) is False
+    assert store.complete(unit_id, 'w1', [{'path': 'a.jpg', 'name': 'x'}, {'path': 'b.jpg', 'name': 'y'}]) is False
+    assert store.results_after('run', 0) == []
+    assert store.unit_counts('run') == {'leased': 1}
+
+
+def test_complete_rejects_a_worker_without_the_lease(store):
+    unit_id = store.add_unit('run', ['a.jpg'])
+    store.lease('w1', 60)
+    assert store.complete(unit_id, 'evil', [{'path': 'a.jpg', 'name': 'x'}]) is False
+    assert store.complete(unit_id, 'w1', [{'path': 'a.jpg', 'name': 'x'}]) is True
+    assert store.complete(unit_id, 'w1', [{'path': 'a.jpg', 'name': 'again'}]) is False # First completion wins
+
+
+def test_complete_records_missing_paths_as_errors(store):
+    unit_id = store.add_unit('run', ['a.jpg', 'b.jpg'])
+    store.lease('w1', 60)
+    assert store.complete(unit_id, 'w1', [{'path': 'a.jpg', 'name': 'named'}])
+    results = {result['path']: result for result in store.results_after('run', 0)}
+    assert results['a.jpg']['name'] == 'named'
+    assert results['b.jpg']['name'] is None and results['b.jpg']['error']
+
+
+def test_non_loopback_listen_needs_a_token(store):
+    with pytest.raises(ValueError):
+        start_lease_server(store, 'run', {'Distributed_listen': '0.0.0.0:0'})
+    server = start_lease_server(store, 'run', {'Distributed_listen': '127.0.0.1:0'})
+    server.shutdown()
+    server.server_close()
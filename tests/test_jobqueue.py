@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from jobqueue import JobQueue, resolve_queue_path
+
+
+@pytest.fixture
+def job_queue(tmp_path):
+    job_queue = JobQueue(str(tmp_path / 'jobs.sqlite3'))
+    yield job_queue
+    job_queue.close()
+
+
+def add(job_queue, folder, priority=0):
+    return job_queue.add({'Source_folder': folder, 'Prompt': 'p', 'Api_key': 'not stored'}, priority)
+
+
+def test_claim_next_takes_priority_then_arrival_order(job_queue):
+    low = add(job_queue, '/a')
+    high = add(job_queue, '/b', priority=5)
+    also_low = add(job_queue, '/c')
+    assert [job_queue.claim_next()['id'] for _ in range(3)] == [high, low, also_low]
+    assert job_queue.claim_next() is None
+
+
+def test_job_settings_leave_out_run_wide_keys(job_queue):
+    add(job_queue, '/a')
+    job = job_queue.claim_next()
+    assert job['settings'] == {'Source_folder': '/a', 'Prompt': 'p'}
+    assert job['state'] == 'running'
+
+
+def test_claim_next_skips_busy_folders(job_queue, tmp_path):
+    folder = str(tmp_path / 'a')
+    first = add(job_queue, folder)
+    second = add(job_queue, folder)
+    other = add(job_queue, str(tmp_path / 'b'))
+    assert job_queue.claim_next()['id'] == first
+    busy = {os.path.normcase(os.path.abspath(folder))}
+    assert job_queue.claim_next(busy)['id'] == other
+    assert job_queue.claim_next(busy) is None
+    job_queue.finish(first, 'done', 1, 1, 0)
+    assert job_queue.claim_next()['id'] == second
+
+
+def test_cancel_and_requeue(job_queue):
+    job_id = add(job_queue, '/a')
+    assert job_queue.cancel(job_id)
+    assert job_queue.claim_next() is None
+    assert job_queue.requeue(job_id)
+    assert job_queue.claim_next()['id'] == job_id
+    assert not job_queue.cancel(job_id) # Running jobs can't be cancelled
+
+
+def test_running_jobs_resume_after_a_crash(tmp_path):
+    db_path = str(tmp_path / 'jobs.sqlite3')
+    job_queue = JobQueue(db_path)
+    job_id = add(job_queue, '/a')
+    job_queue.claim_next()
+    job_queue.close() # The process died while the job was running
+    job_queue = JobQueue(db_path)
+    job = job_queue.claim_next()
+    assert job['id'] == job_id and job['resume']
+    job_queue.close()
+
+
+def test_relative_queue_path_is_next_to_the_config_file(tmp_path):
+    config_path = str(tmp_path / 'conf' / 'config.json')
+    assert resolve_queue_path({}, config_path) == str(tmp_path / 'conf' / 'airename_jobs.sqlite3')
+    assert resolve_queue_path({'Queue_path': '/abs/q.sqlite3'}, config_path) == '/abs/q.sqlite3'
@@ -0,0 +1,91 @@
+import os
+
+from function import collect_image_paths, place_renamed_file
+from journal import RunJournal, load_resume_state, mark, read_journal, undo_in_place_renames
+
+IN_PLACE = {'output_mode': 'in_place'}
+
+
+def touch(folder, name):
+    path = os.path.join(folder, name)
+    with open(path, 'wb') as file:
+        file.write(name.encode('utf-8'))
+    return path
+
+
+def rename_in_place(journal, image_path, name):
+    """What the engines do for one image: queued, named (right before the move), placed."""
+    mark(journal, image_path, 'queued')
+    before_place = lambda target_path: mark(journal, image_path, 'named', name=name, target=target_path, operation='move')
+    _, target_path, _, _, _ = place_renamed_file(image_path, name, IN_PLACE, before_place)
+    journal.append({'path': image_path, 'original_name': os.path.basename(image_path), 'new_name_suggestion': name,
+                    'status': 'placed', 'target': target_path, 'operation': 'move'})
+    return target_path
+
+
+def scanned_names(folder):
+    scan = collect_image_paths({'Source_folder': folder, 'Resume': True}, lambda message: None)
+    return sorted(os.path.basename(path) for path in scan) if scan else []
+
+
+def test_resume_skips_placed_files_and_their_new_names(tmp_path):
+    folder = str(tmp_path)
+    placed, named_only, untouched = (touch(folder, name) for name in ('a.jpg', 'b.jpg', 'c.jpg'))
+    journal = RunJournal(folder, output_mode='in_place')
+    rename_in_place(journal, placed, 'red')
+    mark(journal, named_only, 'queued')
+    mark(journal, named_only, 'named', name='blue', target=os.path.join(folder, 'blue.jpg'), operation='move')
+    journal.close()
+
+    skip_paths, counts = load_resume_state(folder)
+    assert counts == {'placed': 1, 'named': 1}
+    assert os.path.normcase(os.path.abspath(os.path.join(folder, 'red.jpg'))) in skip_paths
+    assert scanned_names(folder) == ['b.jpg', 'c.jpg']
+
+
+def test_resume_treats_a_rename_interrupted_before_placed_as_done(tmp_path):
+    folder = str(tmp_path)
+    image_path = touch(folder, 'a.jpg')
+    touch(folder, 'b.jpg')
+    journal = RunJournal(folder, output_mode='in_place')
+    target_path = os.path.join(folder, 'green.jpg')
+    mark(journal, image_path, 'named', name='green', target=target_path, operation='move')
+    os.rename(image_path, target_path) # Crash before the 'placed' line
+    journal.close()
+    assert scanned_names(folder) == ['b.jpg']
+
+
+def test_undo_restores_the_latest_run(tmp_path):
+    folder = str(tmp_path)
+    first, second, later = (touch(folder, name) for name in ('a.jpg', 'b.jpg', 'c.jpg'))
+    journal = RunJournal(folder, output_mode='in_place')
+    rename_in_place(journal, first, 'red')
+    rename_in_place(journal, second, 'red') # Becomes red_1.jpg
+    journal.close()
+    later_journal = RunJournal(folder, output_mode='in_place')
+    rename_in_place(later_journal, later, 'blue')
+    later_journal.close()
+    assert journal.run_id != later_journal.run_id
+
+    run_id, restored, skipped = undo_in_place_renames(folder)
+    assert (run_id, restored, skipped) == (later_journal.run_id, 1, 0)
+    assert sorted(os.listdir(folder)) == ['.airename_journal.jsonl', 'c.jpg', 'red.jpg', 'red_1.jpg']
+
+    run_id, restored, skipped = undo_in_place_renames(folder, journal.run_id)
+    assert (restored, skipped) == (2, 0)
+    assert sorted(os.listdir(folder)) == ['.airename_journal.jsonl', 'a.jpg', 'b.jpg', 'c.jpg']
+    with open(first, 'rb') as file:
+        assert file.read() == b'a.jpg' # The original content under the original name
+    assert sum(record.get('state') == 'undone' for record in read_journal(folder)) == 3
+
+
+def test_undo_skips_files_whose_original_name_was_taken_again(tmp_path):
+    folder = str(tmp_path)
+    image_path = touch(folder, 'a.jpg')
+    journal = RunJournal(folder, output_mode='in_place')
+    rename_in_place(journal, image_path, 'red')
+    journal.close()
+    touch(folder, 'a.jpg')
+    _, restored, skipped = undo_in_place_renames(folder)
+    assert (restored, skipped) == (0, 1)
+    assert os.path.exists(os.path.join(folder, 'red.jpg'))
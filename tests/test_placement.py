@@ -0,0 +1,74 @@
+import os
+import threading
+
+import pytest
+
+from function import place_renamed_file
+from placement import NameRegistry
+
+
+def make_images(folder, count):
+    paths = []
+    for index in range(count):
+        path = os.path.join(folder, f"img{index:03d}.jpg")
+        with open(path, 'wb') as file:
+            file.write(str(index).encode())
+        paths.append(path)
+    return paths
+
+
+def place_concurrently(paths, config, name_registry):
+    targets = []
+    errors = []
+    barrier = threading.Barrier(len(paths))
+
+    def place(image_path):
+        barrier.wait()
+        try:
+            targets.append(place_renamed_file(image_path, 'red', config, name_registry=name_registry)[1])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=place, args=(path,)) for path in paths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    return targets
+
+
+@pytest.mark.parametrize('output_mode', ['finish_subfolder', 'in_place'])
+def test_concurrent_placement_gives_every_image_its_own_name(tmp_path, output_mode):
+    paths = make_images(str(tmp_path), 40)
+    config = {'output_mode': output_mode, 'Placement_strategy': 'copy'}
+    targets = place_concurrently(paths, config, NameRegistry())
+    names = sorted(os.path.basename(target) for target in targets)
+    assert names == sorted(['red.jpg'] + [f"red_{suffix}.jpg" for suffix in range(1, 40)])
+    contents = set()
+    for target in targets:
+        with open(target, 'rb') as file:
+            contents.add(file.read())
+    assert len(contents) == 40 # No image was overwritten by another
+
+
+def test_file_created_after_the_scan_is_not_overwritten(tmp_path):
+    folder = str(tmp_path)
+    image_path = make_images(folder, 1)[0]
+    name_registry = NameRegistry()
+    name_registry.reserve(os.path.join(folder, 'other.jpg')) # Scans the folder
+    with open(os.path.join(folder, 'red.jpg'), 'wb') as file:
+        file.write(b'someone else')
+    target_path = place_renamed_file(image_path, 'red', {'output_mode': 'in_place'}, name_registry=name_registry)[1]
+    assert os.path.basename(target_path) == 'red_1.jpg'
+    with open(os.path.join(folder, 'red.jpg'), 'rb') as file:
+        assert file.read() == b'someone else'
+
+
+def test_released_names_are_handed_out_again(tmp_path):
+    name_registry = NameRegistry()
+    first = name_registry.reserve(str(tmp_path / 'red.jpg'))
+    assert name_registry.reserve(str(tmp_path / 'red.jpg')).endswith('red_1.jpg')
+    name_registry.release(first)
+    assert name_registry.reserve(str(tmp_path / 'red.jpg')) == first
+    assert name_registry.scans == 1
@@ -0,0 +1,122 @@
+import asyncio
+import email.utils
+import threading
+import time
+
+from ratelimit import AdaptiveConcurrencyController, backoff_delay, parse_retry_after
+
+
+def finish(controller, outcome='success', latency=0.01):
+    assert controller.try_acquire()
+    controller.release(latency, outcome)
+
+
+def test_limit_starts_at_the_maximum():
+    assert AdaptiveConcurrencyController(10).limit == 10
+    assert AdaptiveConcurrencyController(10, initial_limit=3).limit == 3
+    assert AdaptiveConcurrencyController(10, initial_limit=3, enabled=False).limit == 10
+
+
+def test_success_increases_the_limit_additively_up_to_the_maximum():
+    controller = AdaptiveConcurrencyController(4, initial_limit=2)
+    finish(controller)
+    assert controller.limit == 2.5 # +1 / limit per completed request
+    for _ in range(20):
+        finish(controller)
+    assert controller.limit == 4
+
+
+def test_throttling_halves_the_limit_once_per_round_trip():
+    controller = AdaptiveConcurrencyController(16, min_limit=2)
+    finish(controller, 'throttled')
+    assert controller.limit == 8
+    finish(controller, 'throttled') # Same window: no second cut
+    assert controller.limit == 8
+    controller.last_decrease -= 10
+    finish(controller, 'throttled')
+    assert controller.limit == 4
+    controller.last_decrease -= 10
+    finish(controller, 'throttled')
+    controller.last_decrease -= 10
+    finish(controller, 'throttled')
+    assert controller.limit == 2 # Never below min_limit
+
+
+def test_errors_decrease_the_limit_gently():
+    controller = AdaptiveConcurrencyController(10)
+    finish(controller, 'error')
+    assert controller.limit == 9
+
+
+def test_limit_caps_the_requests_in_flight():
+    controller = AdaptiveConcurrencyController(2)
+    assert controller.try_acquire() and controller.try_acquire()
+    assert not controller.try_acquire()
+    controller.release(0.01)
+    assert controller.try_acquire()
+
+
+def test_retry_after_pauses_new_requests():
+    controller = AdaptiveConcurrencyController(4)
+    controller.pause(0.2)
+    assert not controller.try_acquire()
+    started = time.monotonic()
+    assert controller.acquire()
+    assert time.monotonic() - started >= 0.15
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after('') is None
+    assert parse_retry_after('soon') is None
+    retry_at = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 <= parse_retry_after(retry_at) <= 30
+
+
+def test_backoff_is_never_shorter_than_retry_after():
+    for attempt in range(5):
+        assert backoff_delay(attempt, base=0.01, cap=60, retry_after=2.0) >= 2.0
+    assert backoff_delay(10, base=1.0, cap=5.0) <= 5.0
+
+
+def test_async_waiters_are_served_in_arrival_order():
+    controller = AdaptiveConcurrencyController(2)
+    order = []
+
+    async def worker(index):
+        assert await controller.acquire_async()
+        order.append(index)
+        await asyncio.sleep(0.005)
+        threading.Thread(target=controller.release, args=(0.005,)).start() # Released from another thread
+
+    async def main():
+        tasks = []
+        for index in range(12):
+            tasks.append(asyncio.create_task(worker(index)))
+            await asyncio.sleep(0)
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+
+    asyncio.run(main())
+    assert order == list(range(12))
+    assert controller.in_flight == 0
+
+
+def test_async_waiter_cancel_and_stop():
+    controller = AdaptiveConcurrencyController(1)
+
+    async def main():
+        assert await controller.acquire_async()
+        cancelled = asyncio.create_task(controller.acquire_async())
+        waiting = asyncio.create_task(controller.acquire_async())
+        await asyncio.sleep(0.05)
+        cancelled.cancel()
+        controller.release(0.01)
+        assert await asyncio.wait_for(waiting, 1) is True # Not stuck behind the cancelled waiter
+        stop_event = threading.Event()
+        stopped = asyncio.create_task(controller.acquire_async(stop_event))
+        await asyncio.sleep(0.05)
+        stop_event.set()
+        assert await asyncio.wait_for(stopped, 1) is False
+        assert not controller.async_waiters.waiters
+
+    asyncio.run(main())
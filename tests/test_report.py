@@ -0,0 +1,22 @@
+import os
+
+import pytest
+
+from report import StreamingReport
+
+openpyxl = pytest.importorskip('openpyxl')
+
+
+def test_xlsx_appears_only_when_saved_and_never_replaces_a_report(tmp_path):
+    folder = str(tmp_path)
+    with open(os.path.join(folder, '商品标题.xlsx'), 'wb') as file:
+        file.write(b'earlier report')
+    report = StreamingReport(('xlsx',), lambda: folder, lambda message: None)
+    report.add({'original_name': 'a.jpg', 'new_name_suggestion': 'red', 'status': 'placed'})
+    assert os.listdir(folder) == ['商品标题.xlsx'] # Nothing half-written while the run is going
+    report.close()
+    assert sorted(os.listdir(folder)) == ['商品标题.xlsx', '商品标题_1.xlsx']
+    with open(os.path.join(folder, '商品标题.xlsx'), 'rb') as file:
+        assert file.read() == b'earlier report'
+    rows = list(openpyxl.load_workbook(os.path.join(folder, '商品标题_1.xlsx')).active.values)
+    assert rows[1][:3] == ('a.jpg', 'red', 'placed')
@@ -6,12 +6,22 @@ import threading
 import shutil # For rmtree in cleanup
 
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit,
-                             QSpinBox, QPushButton, QTextEdit, QCheckBox, QMessageBox, QFileDialog, QComboBox, QGroupBox,
-                             QRadioButton, QTabWidget)
+                             QSpinBox, QPushButton, QTextEdit, QPlainTextEdit, QCheckBox, QMessageBox, QFileDialog, QComboBox, QGroupBox,
+                             QRadioButton, QTabWidget, QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView)
 from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot, QTimer, Qt
 from PyQt5.QtGui import QMouseEvent, QFontMetrics
 
-from function import Counter, process_images_concurrently, generate_excel_report, sanitize_filename
+from backends import NAMING_BACKENDS, uses_remote_api
+from endpoints import format_endpoint_lines, has_api_key, parse_endpoint_lines
+from function import Counter
+from jobqueue import JobRunner, format_eta, job_label, open_job_queue
+from journal import undo_in_place_renames
+from logbuffer import LogBuffer
+from payload import UPLOAD_DETAILS, UPLOAD_FORMATS
+from placement import PLACEMENT_STRATEGIES
+from report import parse_report_formats
+from engines import ENGINES, get_engine
+from settings import DEFAULT_PROMPT, DebouncedConfigWriter, default_config, load_config_file
 
 class FolderLineEdit(QLineEdit):
     def __init__(self, config_key, update_callback, parent=None, *args, **kwargs):
@@ -38,9 +48,23 @@ class FolderLineEdit(QLineEdit):
             if self.update_callback:
                 self.update_callback(self.config_key, directory)
 
+class FileLineEdit(FolderLineEdit):
+    """Like FolderLineEdit, but picks a file matching name_filter."""
+    def __init__(self, config_key, update_callback, name_filter, parent=None, *args, **kwargs):
+        super().__init__(config_key, update_callback, parent, *args, **kwargs)
+        self.name_filter = name_filter
+
+    def openFolderDialog(self):
+        current_path = self.text()
+        start = os.path.dirname(current_path) if os.path.isfile(current_path) else os.path.expanduser("~")
+        path, _ = QFileDialog.getOpenFileName(self.parent(), "选择文件", start, self.name_filter)
+        if path:
+            self.setText(path)
+            if self.update_callback:
+                self.update_callback(self.config_key, path)
+
 class MainLogicThread(QThread):
     finished = pyqtSignal(bool)
-    output_text = pyqtSignal(str)
 
     # Modified constructor to accept current_config
     def __init__(self, gui, current_config, *args, **kwargs):
@@ -49,16 +73,21 @@ class MainLogicThread(QThread):
         self.current_config = current_config # Store the config for this run
         self.stop_event = threading.Event()
         self.active_counter = Counter()
+        # Log lines go into the GUI's LogBuffer instead of one queued signal per line; a timer renders them
+        self.emit_output = gui.log_buffer.emit
 
     def run(self):
         is_stopped_manually = False
         try:
             self.stop_event.clear()
 
+            # All engines share the same signature and return value
+            engine = get_engine(self.current_config.get('Engine'))
             # Use self.current_config instead of self.gui.config
-            total_found, success_count, failure_count, collected_renaming_data = process_images_concurrently(
+            # The engine streams the report (Report_formats) into the output folder while it runs
+            total_found, success_count, failure_count, _ = engine(
                 self.current_config, # Use the config passed at instantiation
-                self.output_text.emit,
+                self.emit_output,
                 self.stop_event,
                 self.active_counter,
                 self.gui.num_counter_ref # This counter is managed by ConfigGUI, accessed via self.gui
@@ -66,64 +95,56 @@ class MainLogicThread(QThread):
 
             processed_attempts = self.gui.num_counter_ref.get_value()
 
-            if success_count > 0 and collected_renaming_data:
-                # Use self.current_config for Excel report parameters
-                source_folder = self.current_config.get('Source_folder')
-                output_mode = self.current_config.get('output_mode', 'finish_subfolder')
-                excel_output_path = source_folder
-
-                if output_mode == 'custom':
-                    custom_folder = self.current_config.get('custom_output_folder', '')
-                    if custom_folder:
-                        excel_output_path = custom_folder
-                elif output_mode == 'finish_subfolder':
-                    excel_output_path = os.path.join(source_folder, 'Finish')
-
-                if not os.path.isdir(excel_output_path):
-                    try:
-                        os.makedirs(excel_output_path, exist_ok=True)
-                        self.output_text.emit(f"提示：为Excel报告创建了文件夹 {excel_output_path}")
-                    except Exception as e:
-                        self.output_text.emit(f"警告：无法创建Excel报告的目标文件夹 {excel_output_path}: {e}。将尝试保存到源文件夹。")
-                        excel_output_path = source_folder
-                        if not os.path.isdir(excel_output_path) and source_folder:
-                             try: os.makedirs(excel_output_path, exist_ok=True)
-                             except Exception as fallback_e: self.output_text.emit(f"警告：无法创建源文件夹作为后备Excel报告路径: {fallback_e}")
-
-                if os.path.isdir(excel_output_path):
-                    source_folder_name = os.path.basename(source_folder.rstrip('/\\')) if source_folder else "image_processing"
-                    # sanitize_filename is imported and available globally in this module's context if needed,
-                    # but it's better if generate_excel_report handles its internal naming well.
-                    # The function is imported from function.py so MainLogicThread can use it if it constructs the name itself.
-                    base_excel_filename = f"商品标题.xlsx"
-                    generate_excel_report(collected_renaming_data,
-                                          excel_output_path,
-                                          report_filename=base_excel_filename,
-                                          output_text_signal_emit=self.output_text.emit)
-                else:
-                    self.output_text.emit(f"错误：无法确定Excel报告的有效保存路径。跳过Excel生成。")
-
-
             if self.stop_event.is_set():
                 is_stopped_manually = True
-                self.output_text.emit("任务被用户停止。")
+                self.emit_output("任务被用户停止。")
 
             if total_found > 0 :
-                 self.output_text.emit(f"任务总结：共发现{total_found}张图片。处理尝试{processed_attempts}张，成功{success_count}张，失败{failure_count}张。")
+                 self.emit_output(f"任务总结：共发现{total_found}张图片。处理尝试{processed_attempts}张，成功{success_count}张，失败{failure_count}张。")
             elif not is_stopped_manually:
                  if total_found == 0 and processed_attempts == 0 :
                     pass
                  else:
-                    self.output_text.emit("任务完成：未处理任何图片（可能由于处理前停止或全部处理失败）。")
+                    self.emit_output("任务完成：未处理任何图片（可能由于处理前停止或全部处理失败）。")
 
         except Exception as e:
-            self.output_text.emit(f"主逻辑线程发生错误: {str(e)}")
+            self.emit_output(f"主逻辑线程发生错误: {str(e)}")
             is_stopped_manually = False
         finally:
             self.finished.emit(is_stopped_manually or self.stop_event.is_set())
 
     def stop(self):
-        self.output_text.emit("正在发送停止信号...")
+        self.emit_output("正在发送停止信号...")
+        self.stop_event.set()
+
+    def active_count(self):
+        return self.active_counter.get_value()
+
+class QueueThread(QThread):
+    """Runs every pending job of the queue (jobqueue.JobRunner) on one shared worker pool."""
+    finished = pyqtSignal(bool)
+    progress = pyqtSignal(list)
+
+    def __init__(self, gui, base_config, job_queue, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.gui = gui
+        self.base_config = base_config
+        self.job_queue = job_queue
+        self.stop_event = threading.Event()
+        self.active_counter = Counter()
+        self.emit_output = gui.log_buffer.emit
+
+    def run(self):
+        try:
+            JobRunner(self.job_queue, self.base_config, self.emit_output, self.stop_event, self.active_counter,
+                      self.gui.num_counter_ref, on_progress=self.progress.emit).run()
+        except Exception as e:
+            self.emit_output(f"作业队列发生错误: {str(e)}")
+        finally:
+            self.finished.emit(self.stop_event.is_set())
+
+    def stop(self):
+        self.emit_output("正在发送停止信号...")
         self.stop_event.set()
 
     def active_count(self):
@@ -134,11 +155,13 @@ class ConfigGUI(QMainWindow):
         super().__init__()
         # self.thread is renamed to self.processing_thread and initialized to None
         self.processing_thread = None
+        self.queue_thread = None
+        self.job_progress = {} # job id -> latest JobRunner snapshot
         self.last_run_config = None # To store config used for the last run for cleanup
 
         # Signals will be connected when the thread is instantiated
         # self.thread.finished.connect(self.on_main_logic_finished)
-        # self.thread.output_text.connect(self.update_output_text)
+        # Log output goes through self.log_buffer, drained by log_flush_timer
 
         self.setWindowTitle('图片批量AI重命名-HEIBA')
         self.setGeometry(100, 100, 500, 600)
@@ -148,6 +171,11 @@ class ConfigGUI(QMainWindow):
 
         self.config_path = 'config.json'
         self.config = self.load_config() # For initial UI population and saving
+        self.job_queue = None # Opened on first use of the queue tab, see get_job_queue
+        self.log_buffer = LogBuffer()
+        # Edits are coalesced and written atomically off the GUI thread; errors arrive in the log
+        self.config_writer = DebouncedConfigWriter(self.config_path, int(self.config.get('Config_save_delay_ms', 500)) / 1000,
+                                                   on_error=self.log_buffer.emit)
 
         self.widget = QWidget(self)
         self.setCentralWidget(self.widget)
@@ -158,6 +186,10 @@ class ConfigGUI(QMainWindow):
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.update_progress_after_stop_request)
 
+        self.log_flush_timer = QTimer(self)
+        self.log_flush_timer.timeout.connect(self.flush_log)
+        self.log_flush_timer.start(max(20, int(self.config.get('Log_flush_interval_ms', 100))))
+
         self.widget.setLayout(self.layout)
         self.apply_style()
 
@@ -174,38 +206,14 @@ class ConfigGUI(QMainWindow):
             pass
 
     def load_config(self):
-        default_config = {
-            'Base_url': '',
-            'Api_key': '', 'Model': 'gpt-4.1-nano-2025-04-14',
-            'Image_quality_percent': 80, 'Max_workers': 10, 'Source_folder': '',
-            'Prompt': '请识别图片内容并用中文命名，要求：1.简洁(不超过10个字)。2.准确。3.不包含任何标点及特殊符号。',
-            'output_mode': 'finish_subfolder', 'custom_output_folder': ''
-        }
-        if os.path.exists(self.config_path):
-            try:
-                with open(self.config_path, 'r', encoding='utf-8') as file:
-                    loaded_config = json.load(file)
-
-                final_config = default_config.copy()
-                final_config.update(loaded_config)
-
-                if 'Option' in final_config: del final_config['Option']
-                if 'Proxy_quality' in final_config:
-                    if 'Image_quality_percent' not in loaded_config and isinstance(final_config.get('Proxy_quality'), float):
-                         final_config['Image_quality_percent'] = int(final_config['Proxy_quality'] * 100)
-                    del final_config['Proxy_quality']
-
-                final_config['Image_quality_percent'] = int(final_config.get('Image_quality_percent', default_config['Image_quality_percent']))
-                final_config['Max_workers'] = int(final_config.get('Max_workers', default_config['Max_workers']))
-
-                return final_config
-            except json.JSONDecodeError:
-                QMessageBox.warning(self, "配置错误", f"配置文件 {self.config_path} 格式错误，将使用默认配置。")
-                return default_config
-            except Exception as e:
-                QMessageBox.warning(self, "配置加载错误", f"加载配置文件时出错: {e}。将使用默认配置。")
-                return default_config
-        return default_config
+        try:
+            return load_config_file(self.config_path)
+        except json.JSONDecodeError:
+            QMessageBox.warning(self, "配置错误", f"配置文件 {self.config_path} 格式错误，将使用默认配置。")
+            return default_config()
+        except Exception as e:
+            QMessageBox.warning(self, "配置加载错误", f"加载配置文件时出错: {e}。将使用默认配置。")
+            return default_config()
 
     def init_ui(self):
         self.tab_widget = QTabWidget()
@@ -237,6 +245,14 @@ class ConfigGUI(QMainWindow):
         show_key_checkbox = QCheckBox("显示 API Key")
         show_key_checkbox.toggled.connect(self.toggle_api_key_visibility)
         api_layout.addWidget(show_key_checkbox)
+        api_layout.addWidget(QLabel("负载均衡端点（可选，每行一个：URL | Key | 模型 | 权重 | 并发上限，空项沿用上方设置）:"))
+        self.endpoints_edit = QPlainTextEdit()
+        self.endpoints_edit.setPlainText(format_endpoint_lines(self.config.get('Endpoints') or []))
+        self.endpoints_edit.setPlaceholderText("https://a.example | sk-... | | 2 | 16\nhttps://b.example | sk-... | gpt-4.1-mini")
+        self.endpoints_edit.setToolTip("填写两个以上端点时，请求按进行中请求数与延迟分配，连续失败的端点会被暂时剔除。")
+        self.endpoints_edit.setMaximumHeight(80)
+        self.endpoints_edit.textChanged.connect(self.update_endpoints)
+        api_layout.addWidget(self.endpoints_edit)
         api_group.setLayout(api_layout)
         self.configuration_layout.addWidget(api_group)
 
@@ -264,6 +280,110 @@ class ConfigGUI(QMainWindow):
         param_group.setLayout(param_layout)
         self.configuration_layout.addWidget(param_group)
 
+        upload_group = QGroupBox("上传图片优化")
+        upload_layout = QHBoxLayout()
+        self.upload_format_combo = QComboBox(self)
+        for format_key, format_label in UPLOAD_FORMATS.items():
+            self.upload_format_combo.addItem(format_label, format_key)
+        upload_format_index = self.upload_format_combo.findData(self.config.get('Upload_format', 'auto'))
+        self.upload_format_combo.setCurrentIndex(upload_format_index if upload_format_index >= 0 else 0)
+        self.upload_format_combo.currentIndexChanged.connect(
+            lambda index: self.update_config('Upload_format', self.upload_format_combo.itemData(index)))
+        upload_layout.addWidget(QLabel("格式:"))
+        upload_layout.addWidget(self.upload_format_combo)
+        self.upload_detail_combo = QComboBox(self)
+        for detail_key, detail_label in UPLOAD_DETAILS.items():
+            self.upload_detail_combo.addItem(detail_label, detail_key)
+        upload_detail_index = self.upload_detail_combo.findData(self.config.get('Upload_detail', 'auto'))
+        self.upload_detail_combo.setCurrentIndex(upload_detail_index if upload_detail_index >= 0 else 0)
+        self.upload_detail_combo.currentIndexChanged.connect(
+            lambda index: self.update_config('Upload_detail', self.upload_detail_combo.itemData(index)))
+        upload_layout.addWidget(QLabel("细节:"))
+        upload_layout.addWidget(self.upload_detail_combo)
+        self.upload_tiles_spin = QSpinBox()
+        self.upload_tiles_spin.setRange(1, 16)
+        self.upload_tiles_spin.setValue(int(self.config.get('Upload_max_tiles', 1)))
+        self.upload_tiles_spin.setToolTip("高细节模式下图片最多占用的 512px 分块数；每块约 170 token。")
+        self.upload_tiles_spin.valueChanged.connect(lambda value: self.update_config('Upload_max_tiles', value))
+        upload_layout.addWidget(QLabel("最多分块:"))
+        upload_layout.addWidget(self.upload_tiles_spin)
+        self.upload_budget_spin = QSpinBox()
+        self.upload_budget_spin.setRange(0, 4096)
+        self.upload_budget_spin.setSuffix(" KB")
+        self.upload_budget_spin.setValue(int(self.config.get('Upload_max_bytes', 150000)) // 1000)
+        self.upload_budget_spin.setToolTip("单张上传图片的字节上限，超出时依次尝试 WebP、降低质量、缩小尺寸；0 为不限制。")
+        self.upload_budget_spin.valueChanged.connect(lambda value: self.update_config('Upload_max_bytes', value * 1000))
+        upload_layout.addWidget(QLabel("大小上限:"))
+        upload_layout.addWidget(self.upload_budget_spin)
+        upload_group.setLayout(upload_layout)
+        self.configuration_layout.addWidget(upload_group)
+
+        engine_group = QGroupBox("请求引擎")
+        engine_layout = QHBoxLayout()
+        self.engine_combo = QComboBox(self)
+        for engine_key, engine_label in ENGINES.items():
+            self.engine_combo.addItem(engine_label, engine_key)
+        engine_index = self.engine_combo.findData(self.config.get('Engine', 'threads'))
+        self.engine_combo.setCurrentIndex(engine_index if engine_index >= 0 else 0)
+        self.engine_combo.currentIndexChanged.connect(lambda index: self.update_config('Engine', self.engine_combo.itemData(index)))
+        engine_layout.addWidget(QLabel("引擎:"))
+        engine_layout.addWidget(self.engine_combo)
+        self.async_concurrency_spin = QSpinBox()
+        self.async_concurrency_spin.setRange(1, 2000)
+        self.async_concurrency_spin.setValue(int(self.config.get('Async_concurrency', 200)))
+        self.async_concurrency_spin.setToolTip("异步引擎同时进行的请求数，仅在选择异步引擎时生效。")
+        self.async_concurrency_spin.valueChanged.connect(lambda value: self.update_config('Async_concurrency', value))
+        engine_layout.addWidget(QLabel("异步并发数:"))
+        engine_layout.addWidget(self.async_concurrency_spin)
+        self.batch_size_spin = QSpinBox()
+        self.batch_size_spin.setRange(1, 20)
+        self.batch_size_spin.setValue(int(self.config.get('Batch_size', 1)))
+        self.batch_size_spin.setToolTip("每个请求包含的图片数，1 为逐张请求。仅线程池引擎支持批量。")
+        self.batch_size_spin.valueChanged.connect(lambda value: self.update_config('Batch_size', value))
+        engine_layout.addWidget(QLabel("每请求图片数:"))
+        engine_layout.addWidget(self.batch_size_spin)
+        self.metrics_checkbox = QCheckBox("记录各阶段耗时")
+        self.metrics_checkbox.setChecked(bool(self.config.get('Metrics_enabled', False)))
+        self.metrics_checkbox.setToolTip("在日志中输出读取/解码/编码/请求/复制等阶段的耗时统计，并在报告旁写入 stage_metrics 文件。")
+        self.metrics_checkbox.toggled.connect(lambda checked: self.update_config('Metrics_enabled', checked))
+        engine_layout.addWidget(self.metrics_checkbox)
+        engine_group.setLayout(engine_layout)
+        self.configuration_layout.addWidget(engine_group)
+
+        backend_group = QGroupBox("命名后端")
+        backend_layout = QHBoxLayout()
+        self.backend_combo = QComboBox(self)
+        for backend_key, backend_label in NAMING_BACKENDS.items():
+            self.backend_combo.addItem(backend_label, backend_key)
+        backend_index = self.backend_combo.findData(self.config.get('Naming_backend', 'remote'))
+        self.backend_combo.setCurrentIndex(backend_index if backend_index >= 0 else 0)
+        self.backend_combo.currentIndexChanged.connect(
+            lambda index: self.update_config('Naming_backend', self.backend_combo.itemData(index)))
+        backend_layout.addWidget(QLabel("后端:"))
+        backend_layout.addWidget(self.backend_combo)
+        self.local_model_edit = FileLineEdit('Local_model_path', self.update_config, "ONNX 模型 (*.onnx)", self)
+        self.local_model_edit.setText(self.config.get('Local_model_path', ''))
+        self.local_model_edit.setPlaceholderText("点击选择 .onnx 模型")
+        self.local_model_edit.setReadOnly(True)
+        backend_layout.addWidget(QLabel("本地模型:"))
+        backend_layout.addWidget(self.local_model_edit)
+        self.local_labels_edit = FileLineEdit('Local_labels_path', self.update_config, "标签文件 (*.txt)", self)
+        self.local_labels_edit.setText(self.config.get('Local_labels_path', ''))
+        self.local_labels_edit.setPlaceholderText("点击选择标签文件")
+        self.local_labels_edit.setReadOnly(True)
+        backend_layout.addWidget(QLabel("标签:"))
+        backend_layout.addWidget(self.local_labels_edit)
+        self.min_confidence_spin = QSpinBox()
+        self.min_confidence_spin.setRange(0, 100)
+        self.min_confidence_spin.setSuffix(" %")
+        self.min_confidence_spin.setValue(int(round(float(self.config.get('Hybrid_min_confidence', 0.5)) * 100)))
+        self.min_confidence_spin.setToolTip("混合模式下，本地模型置信度低于此值的图片改为请求远程 API。")
+        self.min_confidence_spin.valueChanged.connect(lambda value: self.update_config('Hybrid_min_confidence', value / 100))
+        backend_layout.addWidget(QLabel("最低置信度:"))
+        backend_layout.addWidget(self.min_confidence_spin)
+        backend_group.setLayout(backend_layout)
+        self.configuration_layout.addWidget(backend_group)
+
         output_dest_group = QGroupBox("输出目标设置")
         output_dest_layout = QVBoxLayout()
         self.radio_finish_subfolder = QRadioButton("保存在原图文件夹下的 'Finish' 子文件夹")
@@ -279,6 +399,29 @@ class ConfigGUI(QMainWindow):
         output_dest_layout.addWidget(self.radio_finish_subfolder)
         output_dest_layout.addWidget(self.radio_rename_in_place)
         output_dest_layout.addLayout(custom_folder_hbox)
+        placement_hbox = QHBoxLayout()
+        self.placement_combo = QComboBox(self)
+        for strategy_key, strategy_label in PLACEMENT_STRATEGIES.items():
+            self.placement_combo.addItem(strategy_label, strategy_key)
+        placement_index = self.placement_combo.findData(self.config.get('Placement_strategy', 'reflink'))
+        self.placement_combo.setCurrentIndex(placement_index if placement_index >= 0 else 0)
+        self.placement_combo.setToolTip("克隆仅在 Btrfs、XFS 等支持写时复制的 Linux 文件系统上生效；"
+                                        "硬链接与原图共用同一文件，修改其中一个另一个也会改变。原位重命名不受此设置影响。")
+        self.placement_combo.currentIndexChanged.connect(
+            lambda index: self.update_config('Placement_strategy', self.placement_combo.itemData(index)))
+        placement_hbox.addWidget(QLabel("放置方式:"))
+        placement_hbox.addWidget(self.placement_combo)
+        placement_hbox.addWidget(QLabel("报告格式:"))
+        report_formats = parse_report_formats(self.config.get('Report_formats', 'xlsx'))
+        self.report_format_checkboxes = {}
+        for report_format, report_label in (('xlsx', "Excel"), ('csv', "CSV"), ('jsonl', "JSONL")):
+            checkbox = QCheckBox(report_label)
+            checkbox.setChecked(report_format in report_formats)
+            checkbox.toggled.connect(lambda checked: self.update_config('Report_formats', self.selected_report_formats()))
+            self.report_format_checkboxes[report_format] = checkbox
+            placement_hbox.addWidget(checkbox)
+        placement_hbox.addStretch(1)
+        output_dest_layout.addLayout(placement_hbox)
         output_dest_group.setLayout(output_dest_layout)
         self.configuration_layout.addWidget(output_dest_group)
         self.radio_finish_subfolder.toggled.connect(self.on_output_option_changed)
@@ -301,6 +444,15 @@ class ConfigGUI(QMainWindow):
         self.source_folder_edit.setReadOnly(True) # Click to open dialog
         folder_group_layout.addWidget(folder_label)
         folder_group_layout.addWidget(self.source_folder_edit)
+        self.recursive_checkbox = QCheckBox("包含子文件夹")
+        self.recursive_checkbox.setChecked(bool(self.config.get('Recursive', False)))
+        self.recursive_checkbox.toggled.connect(lambda checked: self.update_config('Recursive', checked))
+        folder_group_layout.addWidget(self.recursive_checkbox)
+        self.resume_checkbox = QCheckBox("断点续跑")
+        self.resume_checkbox.setChecked(bool(self.config.get('Resume', False)))
+        self.resume_checkbox.setToolTip("根据源文件夹中的任务日志跳过上次已完成的图片（崩溃或停止后继续）。")
+        self.resume_checkbox.toggled.connect(lambda checked: self.update_config('Resume', checked))
+        folder_group_layout.addWidget(self.resume_checkbox)
         folder_group = QGroupBox("源文件选择")
         folder_group.setLayout(folder_group_layout)
         self.main_operations_layout.addWidget(folder_group)
@@ -308,7 +460,7 @@ class ConfigGUI(QMainWindow):
         prompt_group_layout = QVBoxLayout()
         prompt_label = QLabel("提示词 (Prompt):")
         self.prompt_text_edit = QTextEdit()
-        default_prompt = '请识别图片内容并用中文命名，要求：1.简洁(不超过10个字)。2.准确。3.不包含任何标点及特殊符号。'
+        default_prompt = DEFAULT_PROMPT
         self.prompt_text_edit.setPlaceholderText(default_prompt)
         self.prompt_text_edit.setText(self.config.get('Prompt', default_prompt))
         font_metrics = QFontMetrics(self.prompt_text_edit.font())
@@ -321,22 +473,188 @@ class ConfigGUI(QMainWindow):
         self.main_operations_layout.addWidget(prompt_container_group)
 
         log_group_layout = QVBoxLayout()
-        self.output_text_box = QTextEdit(self)
+        # Plain text with a block limit: appending is cheap and old lines are dropped (the log file keeps everything)
+        self.output_text_box = QPlainTextEdit(self)
         self.output_text_box.setReadOnly(True)
+        self.output_text_box.setMaximumBlockCount(max(100, int(self.config.get('Log_max_lines', 5000))))
+        self.output_text_box.setUndoRedoEnabled(False)
         log_group_layout.addWidget(self.output_text_box)
         log_container_group = QGroupBox("运行日志")
         log_container_group.setLayout(log_group_layout)
         self.main_operations_layout.addWidget(log_container_group)
         self.main_operations_layout.setStretchFactor(log_container_group, 1)
 
+        button_layout = QHBoxLayout()
         self.start_button = QPushButton("开始处理", self)
         self.start_button.clicked.connect(self.start_main_logic)
-        self.main_operations_layout.addWidget(self.start_button)
+        button_layout.addWidget(self.start_button, 1)
+        self.undo_button = QPushButton("撤销上次原位重命名", self)
+        self.undo_button.setToolTip("按任务日志把最近一次运行的原位重命名全部改回原文件名。")
+        self.undo_button.clicked.connect(self.undo_last_renames)
+        button_layout.addWidget(self.undo_button)
+        self.main_operations_layout.addLayout(button_layout)
+
+        self.init_queue_tab()
 
         self.tab_widget.addTab(self.main_operations_tab, "主操作")
+        self.tab_widget.addTab(self.queue_tab, "作业队列")
         self.tab_widget.addTab(self.configuration_tab, "配置")
+        self.tab_widget.currentChanged.connect(self.on_tab_changed)
         self.layout.addWidget(self.tab_widget)
 
+    def init_queue_tab(self):
+        self.queue_tab = QWidget()
+        queue_layout = QVBoxLayout(self.queue_tab)
+        enqueue_layout = QHBoxLayout()
+        enqueue_layout.addWidget(QLabel("优先级:"))
+        self.job_priority_spin = QSpinBox()
+        self.job_priority_spin.setRange(-100, 100)
+        self.job_priority_spin.setToolTip("数值大的作业先运行；相同优先级按加入顺序。")
+        enqueue_layout.addWidget(self.job_priority_spin)
+        self.enqueue_button = QPushButton("加入队列", self)
+        self.enqueue_button.setToolTip("把主操作页当前的源文件夹、提示词、模型和输出模式作为一个作业加入队列。")
+        self.enqueue_button.clicked.connect(self.enqueue_current_folder)
+        enqueue_layout.addWidget(self.enqueue_button, 1)
+        queue_layout.addLayout(enqueue_layout)
+
+        self.job_table = QTableWidget(0, 7, self)
+        self.job_table.setHorizontalHeaderLabels(["ID", "文件夹", "优先级", "状态", "进度", "速度 (张/秒)", "预计剩余"])
+        self.job_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.job_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.Stretch)
+        self.job_table.verticalHeader().setVisible(False)
+        self.job_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.job_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        queue_layout.addWidget(self.job_table, 1)
+
+        queue_button_layout = QHBoxLayout()
+        self.run_queue_button = QPushButton("运行队列", self)
+        self.run_queue_button.clicked.connect(self.toggle_queue)
+        queue_button_layout.addWidget(self.run_queue_button, 1)
+        self.cancel_job_button = QPushButton("取消作业", self)
+        self.cancel_job_button.clicked.connect(self.cancel_selected_job)
+        queue_button_layout.addWidget(self.cancel_job_button)
+        self.requeue_job_button = QPushButton("重新排队", self)
+        self.requeue_job_button.setToolTip("把已停止或失败的作业放回队列；已停止的作业会从中断处续跑。")
+        self.requeue_job_button.clicked.connect(self.requeue_selected_job)
+        queue_button_layout.addWidget(self.requeue_job_button)
+        self.clear_jobs_button = QPushButton("清除已结束", self)
+        self.clear_jobs_button.clicked.connect(self.clear_finished_jobs)
+        queue_button_layout.addWidget(self.clear_jobs_button)
+        queue_layout.addLayout(queue_button_layout)
+
+    def get_job_queue(self):
+        """The job queue database, created the first time the queue tab is used."""
+        if self.job_queue is None:
+            self.job_queue = open_job_queue(self.config, self.config_path)
+        return self.job_queue
+
+    def on_tab_changed(self, index):
+        if self.tab_widget.widget(index) is self.queue_tab:
+            self.refresh_job_table()
+
+    def refresh_job_table(self):
+        jobs = self.get_job_queue().jobs()
+        self.job_table.setRowCount(len(jobs))
+        for row, job in enumerate(jobs):
+            snapshot = self.job_progress.get(job['id'])
+            if job['state'] == 'running' and snapshot is not None:
+                progress = f"{snapshot['processed']}/{snapshot['total']}"
+                rate = f"{snapshot['images_per_second']:.2f}"
+                eta = format_eta(snapshot['eta_seconds'])
+            elif job['total'] is not None:
+                progress = f"成功{job['succeeded']} / 失败{job['failed']}"
+                rate = eta = ""
+            else:
+                progress = rate = eta = ""
+            values = (job['id'], job_label(job).split(' ', 1)[-1], job['priority'], job['state'], progress, rate, eta)
+            for column, value in enumerate(values):
+                item = QTableWidgetItem(str(value))
+                if column == 1:
+                    item.setToolTip(job['settings'].get('Source_folder', ''))
+                self.job_table.setItem(row, column, item)
+
+    def selected_job_id(self):
+        row = self.job_table.currentRow()
+        item = self.job_table.item(row, 0) if row >= 0 else None
+        return int(item.text()) if item is not None else None
+
+    def enqueue_current_folder(self):
+        current_run_config = self.gather_run_config()
+        source_folder = current_run_config['Source_folder']
+        if not source_folder or not os.path.isdir(source_folder):
+            QMessageBox.warning(self, "作业队列", "请先在主操作页选择一个有效的源文件夹。")
+            return
+        if current_run_config['output_mode'] == 'custom' and not current_run_config['custom_output_folder']:
+            QMessageBox.warning(self, "作业队列", "请选择自定义输出文件夹。")
+            return
+        job_id = self.get_job_queue().add(current_run_config, self.job_priority_spin.value())
+        self.append_log(f"已加入作业队列：#{job_id} {source_folder}（优先级{self.job_priority_spin.value()}）")
+        self.refresh_job_table()
+
+    def cancel_selected_job(self):
+        job_id = self.selected_job_id()
+        if job_id is not None and not self.get_job_queue().cancel(job_id):
+            QMessageBox.information(self, "作业队列", "只能取消尚未运行的作业。")
+        self.refresh_job_table()
+
+    def requeue_selected_job(self):
+        job_id = self.selected_job_id()
+        if job_id is not None and not self.get_job_queue().requeue(job_id):
+            QMessageBox.information(self, "作业队列", "只有已停止、失败或已取消的作业可以重新排队。")
+        self.refresh_job_table()
+
+    def clear_finished_jobs(self):
+        self.get_job_queue().clear_finished()
+        self.refresh_job_table()
+
+    def toggle_queue(self):
+        if self.queue_thread is not None and self.queue_thread.isRunning():
+            self.queue_thread.stop()
+            self.run_queue_button.setEnabled(False) # Until the running jobs have stopped
+            return
+        current_run_config = self.gather_run_config()
+        if uses_remote_api(current_run_config) and not has_api_key(current_run_config):
+            QMessageBox.warning(self, "配置错误", "请输入有效的 API Key。")
+            return
+        if not self.get_job_queue().jobs(('pending',)):
+            QMessageBox.information(self, "作业队列", "队列中没有待处理的作业。")
+            return
+        self.num_counter_ref.value = 0
+        self.job_progress = {}
+        try:
+            log_path = self.log_buffer.open_file(current_run_config.get('Log_folder', 'logs'))
+        except OSError as e:
+            self.append_log(f"警告：无法创建日志文件: {e}")
+        else:
+            if log_path:
+                self.append_log(f"完整日志写入：{os.path.abspath(log_path)}")
+        self.queue_thread = QueueThread(self, current_run_config, self.get_job_queue())
+        self.queue_thread.progress.connect(self.on_job_progress)
+        self.queue_thread.finished.connect(self.on_queue_finished)
+        self.run_queue_button.setText("停止队列")
+        self.start_button.setEnabled(False)
+        self.undo_button.setEnabled(False)
+        self.queue_thread.start()
+        self.refresh_job_table()
+
+    @pyqtSlot(list)
+    def on_job_progress(self, snapshots):
+        for snapshot in snapshots:
+            self.job_progress[snapshot['job_id']] = snapshot
+        self.refresh_job_table()
+
+    @pyqtSlot(bool)
+    def on_queue_finished(self, stopped_manually=False):
+        self.run_queue_button.setText("运行队列")
+        self.run_queue_button.setEnabled(True)
+        self.start_button.setEnabled(True)
+        self.undo_button.setEnabled(True)
+        self.refresh_job_table()
+        self.flush_log()
+        self.log_buffer.close_file()
+        QMessageBox.information(self, "已停止" if stopped_manually else "完成",
+                                "作业队列已停止。" if stopped_manually else "作业队列中的作业已全部处理完毕！")
+
     def on_output_option_changed(self, checked):
         sender = self.sender()
         if sender.isChecked(): # Process only if a radio button becomes checked
@@ -358,35 +676,50 @@ class ConfigGUI(QMainWindow):
     def toggle_api_key_visibility(self, checked):
         self.api_key_edit.setEchoMode(QLineEdit.Normal if checked else QLineEdit.Password)
 
+    def update_endpoints(self):
+        try:
+            endpoints = parse_endpoint_lines(self.endpoints_edit.toPlainText())
+        except ValueError:
+            return # Keep the last valid list while a weight or limit is being typed
+        self.update_config('Endpoints', endpoints)
+
     def update_config(self, key=None, value=None):
         if key is not None: # Update the internal self.config dictionary
             self.config[key] = value
-        try: # Save the entire self.config dictionary to the JSON file
-            with open(self.config_path, 'w', encoding='utf-8') as file:
-                json.dump(self.config, file, indent=4, ensure_ascii=False)
-        except Exception as e:
-            log_widget = getattr(self, 'output_text_box', None)
-            msg = f"错误：无法保存配置文件 {self.config_path}: {e}"
-            if log_widget:
-                log_widget.append(msg)
-            else:
-                print(msg)
+        self.config_writer.schedule(self.config) # Written by the background writer once edits pause
 
 
-    def start_main_logic(self):
-        self.output_text_box.clear()
-
-        # Gather current configuration directly from UI elements
-        current_run_config = {
+    def gather_run_config(self):
+        """
+        The run configuration from the UI elements; settings without a widget (e.g. Cache_*) come from config.json.
+        """
+        current_run_config = dict(self.config)
+        current_run_config.update({
             'Base_url': self.base_url_edit.text().strip(),
             'Api_key': self.api_key_edit.text().strip(),
             'Model': self.model_combo.currentText(),
             'Image_quality_percent': self.image_quality_spin.value(),
+            'Upload_format': self.upload_format_combo.currentData(),
+            'Upload_detail': self.upload_detail_combo.currentData(),
+            'Upload_max_tiles': self.upload_tiles_spin.value(),
+            'Upload_max_bytes': self.upload_budget_spin.value() * 1000,
             'Max_workers': self.max_workers_spin.value(),
+            'Engine': self.engine_combo.currentData(),
+            'Naming_backend': self.backend_combo.currentData(),
+            'Local_model_path': self.local_model_edit.text().strip(),
+            'Local_labels_path': self.local_labels_edit.text().strip(),
+            'Hybrid_min_confidence': self.min_confidence_spin.value() / 100,
+            'Async_concurrency': self.async_concurrency_spin.value(),
+            'Batch_size': self.batch_size_spin.value(),
+            'Metrics_enabled': self.metrics_checkbox.isChecked(),
             'Source_folder': self.source_folder_edit.text().strip(),
+            'Recursive': self.recursive_checkbox.isChecked(),
+            'Resume': self.resume_checkbox.isChecked(),
+            'Placement_strategy': self.placement_combo.currentData(),
+            'Report_formats': self.selected_report_formats(),
             'Prompt': self.prompt_text_edit.toPlainText().strip(),
             'custom_output_folder': self.custom_output_folder_edit.text().strip()
-        }
+        })
         if self.radio_finish_subfolder.isChecked():
             current_run_config['output_mode'] = 'finish_subfolder'
         elif self.radio_rename_in_place.isChecked():
@@ -395,17 +728,22 @@ class ConfigGUI(QMainWindow):
             current_run_config['output_mode'] = 'custom'
         else: # Default or error case, though one should always be checked
             current_run_config['output_mode'] = 'finish_subfolder'
+        return current_run_config
+
+    def start_main_logic(self):
+        self.output_text_box.clear()
+        current_run_config = self.gather_run_config()
 
 
         # Validate using current_run_config
         source_folder = current_run_config['Source_folder']
         if not source_folder or not os.path.isdir(source_folder):
             QMessageBox.warning(self, "配置错误", "请选择一个有效的源文件夹。")
-            self.output_text_box.append("错误：源文件夹未选择或无效。")
+            self.append_log("错误：源文件夹未选择或无效。")
             return
-        if not current_run_config['Api_key']:
+        if uses_remote_api(current_run_config) and not has_api_key(current_run_config):
             QMessageBox.warning(self, "配置错误", "请输入有效的 API Key。")
-            self.output_text_box.append("错误：API Key 未设置。")
+            self.append_log("错误：API Key 未设置。")
             return
         if current_run_config['output_mode'] == 'custom':
             custom_folder = current_run_config['custom_output_folder']
@@ -414,7 +752,7 @@ class ConfigGUI(QMainWindow):
                 self.custom_output_folder_edit.openFolderDialog() # Attempt to open dialog
                 current_run_config['custom_output_folder'] = self.custom_output_folder_edit.text().strip() # Re-fetch after dialog
                 if not current_run_config['custom_output_folder']:
-                    self.output_text_box.append("错误：自定义输出文件夹仍未选择。")
+                    self.append_log("错误：自定义输出文件夹仍未选择。")
                     return
 
             # Ensure custom output folder exists or can be created
@@ -423,10 +761,10 @@ class ConfigGUI(QMainWindow):
             if active_custom_folder and not os.path.isdir(active_custom_folder):
                 try:
                     os.makedirs(active_custom_folder, exist_ok=True)
-                    self.output_text_box.append(f"提示：自定义输出文件夹 '{active_custom_folder}' 已创建。")
+                    self.append_log(f"提示：自定义输出文件夹 '{active_custom_folder}' 已创建。")
                 except OSError as e:
                     QMessageBox.warning(self, "配置错误", f"无法创建自定义输出文件夹 '{active_custom_folder}': {e}")
-                    self.output_text_box.append(f"错误：无法创建自定义输出文件夹 '{active_custom_folder}'")
+                    self.append_log(f"错误：无法创建自定义输出文件夹 '{active_custom_folder}'")
                     return
 
         self.num_counter_ref.value = 0 # Reset shared counter for the new run
@@ -435,13 +773,22 @@ class ConfigGUI(QMainWindow):
             self.last_run_config = current_run_config # Store config for this run for cleanup
             self.processing_thread = MainLogicThread(self, self.last_run_config) # Pass the fresh config
             self.processing_thread.finished.connect(self.on_main_logic_finished)
-            self.processing_thread.output_text.connect(self.update_output_text)
+            try:
+                log_path = self.log_buffer.open_file(current_run_config.get('Log_folder', 'logs'))
+            except OSError as e:
+                self.append_log(f"警告：无法创建日志文件: {e}")
+            else:
+                if log_path:
+                    self.append_log(f"完整日志写入：{os.path.abspath(log_path)}")
+            self.log_buffer.emit(self.config_writer.summary())
 
             self.start_button.setText("停止处理")
+            self.undo_button.setEnabled(False)
+            self.run_queue_button.setEnabled(False)
             self.processing_thread.start()
         else: # "停止处理" was clicked
             if self.processing_thread and self.processing_thread.isRunning():
-                self.output_text_box.append("状态：正在请求停止任务...")
+                self.append_log("状态：正在请求停止任务...")
                 self.processing_thread.stop()
                 self.timer.start(200) # Check progress of stopping
                 self.start_button.setEnabled(False) # Disable button until fully stopped
@@ -450,6 +797,23 @@ class ConfigGUI(QMainWindow):
                 self.start_button.setEnabled(True)
 
 
+    def selected_report_formats(self):
+        return ','.join(report_format for report_format, checkbox in self.report_format_checkboxes.items()
+                        if checkbox.isChecked())
+
+
+    def undo_last_renames(self):
+        source_folder = self.source_folder_edit.text().strip()
+        if not source_folder or not os.path.isdir(source_folder):
+            QMessageBox.warning(self, "撤销", "请选择一个有效的源文件夹。")
+            return
+        reply = QMessageBox.question(self, "撤销", f"将按任务日志把 '{source_folder}' 中最近一次运行的原位重命名改回原文件名，是否继续？",
+                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if reply != QMessageBox.Yes:
+            return
+        undo_in_place_renames(source_folder, output_text_signal_emit=self.log_buffer.emit)
+
+
     def update_progress_after_stop_request(self):
         if not self.processing_thread: # Safety check
             self.timer.stop()
@@ -462,7 +826,7 @@ class ConfigGUI(QMainWindow):
             self.timer.stop()
             self.start_button.setEnabled(True)
             self.start_button.setText("开始处理")
-            self.output_text_box.append("状态：所有活动任务已完成，处理已停止。")
+            self.append_log("状态：所有活动任务已完成，处理已停止。")
             # The thread's 'finished' signal should call on_main_logic_finished.
             # If the thread is no longer running (it should have emitted 'finished'), this check is fine.
             if not self.processing_thread.isRunning():
@@ -471,13 +835,24 @@ class ConfigGUI(QMainWindow):
                  # but usually, the signal mechanism is preferred.
                  pass
         else:
-            self.output_text_box.append(f"状态：等待 {active_threads_in_logic} 个活动任务完成...")
+            self.append_log(f"状态：等待 {active_threads_in_logic} 个活动任务完成...")
+
+    def append_log(self, text):
+        """Log from the GUI thread: goes through the buffer (so it reaches the log file) and shows at once."""
+        self.log_buffer.emit(text)
+        self.flush_log()
 
-    @pyqtSlot(str)
-    def update_output_text(self, text):
-        self.output_text_box.append(text)
-        self.output_text_box.ensureCursorVisible()
-        QApplication.processEvents() # Process events to keep UI responsive
+    def flush_log(self):
+        lines = self.log_buffer.drain()
+        if not lines:
+            return
+        # Only the newest lines can survive the block limit, so don't lay out the rest
+        lines = lines[-self.output_text_box.maximumBlockCount():]
+        scroll_bar = self.output_text_box.verticalScrollBar()
+        follow = scroll_bar.value() >= scroll_bar.maximum() - 4 # Don't yank the view while the user reads older lines
+        self.output_text_box.appendPlainText("\n".join(lines))
+        if follow:
+            scroll_bar.setValue(scroll_bar.maximum())
 
     @pyqtSlot(bool)
     def on_main_logic_finished(self, stopped_manually=False):
@@ -486,6 +861,8 @@ class ConfigGUI(QMainWindow):
         if not self.timer.isActive():
             self.start_button.setText("开始处理")
             self.start_button.setEnabled(True)
+        self.undo_button.setEnabled(True)
+        self.run_queue_button.setEnabled(True)
 
         # Cleanup temporary folders using the config from the run that just finished
         if hasattr(self, 'last_run_config') and self.last_run_config:
@@ -497,23 +874,26 @@ class ConfigGUI(QMainWindow):
                          tmp_dir_to_remove = os.path.join(root, '.airenametmp')
                          try:
                              shutil.rmtree(tmp_dir_to_remove)
-                             self.output_text_box.append(f"提示：临时文件夹 {tmp_dir_to_remove} 已清理。")
+                             self.append_log(f"提示：临时文件夹 {tmp_dir_to_remove} 已清理。")
                          except Exception as e:
-                             self.output_text_box.append(f"警告：清理临时文件夹 {tmp_dir_to_remove} 失败: {e}")
+                             self.append_log(f"警告：清理临时文件夹 {tmp_dir_to_remove} 失败: {e}")
                      # This condition might be redundant if .airenametmp is always a direct child
                      # or handled by the above. Kept for consistency with original logic.
                      if os.path.basename(root) == '.airenametmp' and os.path.dirname(root).startswith(source_folder):
                          try:
                              if os.path.exists(root):
                                 shutil.rmtree(root)
-                                self.output_text_box.append(f"提示：临时文件夹 {root} 已清理。")
+                                self.append_log(f"提示：临时文件夹 {root} 已清理。")
                          except Exception as e:
-                             self.output_text_box.append(f"警告：清理临时文件夹 {root} 失败: {e}")
+                             self.append_log(f"警告：清理临时文件夹 {root} 失败: {e}")
             else:
-                 self.output_text_box.append("警告：无法获取上次运行的源文件夹路径，跳过临时文件清理。")
+                 self.append_log("警告：无法获取上次运行的源文件夹路径，跳过临时文件清理。")
         else:
-            self.output_text_box.append("警告：未找到上次运行的配置信息，无法进行临时文件清理。")
+            self.append_log("警告：未找到上次运行的配置信息，无法进行临时文件清理。")
+
 
+        self.flush_log()
+        self.log_buffer.close_file()
 
         msg_title = "已停止" if stopped_manually else "完成"
         msg_text = "图片重命名任务已停止。" if stopped_manually else "图片重命名任务已处理完毕！"
@@ -521,12 +901,16 @@ class ConfigGUI(QMainWindow):
 
     def closeEvent(self, event):
         self.update_config() # Save the latest UI state to config.json before exiting
+        self.config_writer.flush()
+        self.flush_log()
 
-        if self.processing_thread and self.processing_thread.isRunning():
+        running_thread = next((thread for thread in (self.processing_thread, self.queue_thread)
+                               if thread and thread.isRunning()), None)
+        if running_thread is not None:
             reply = QMessageBox.question(self, '退出确认', "处理仍在进行中。确定退出吗？",
                                        QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
             if reply == QMessageBox.Yes:
-                self.processing_thread.stop() # Request stop
+                running_thread.stop() # Request stop; a running job is resumed on the next queue run
                 # Consider self.processing_thread.wait(milliseconds) if graceful shutdown is critical
                 # and can complete quickly. Otherwise, just accept and close.
                 event.accept()
@@ -596,7 +980,7 @@ class ConfigGUI(QMainWindow):
                 background-color: #FFFFFF;
                 color: #212529;
             }
-            QTextEdit {
+            QTextEdit, QPlainTextEdit {
                 padding: 8px;
                 border: 1px solid #CED4DA;
                 border-radius: 6px;
@@ -604,7 +988,7 @@ class ConfigGUI(QMainWindow):
                 background-color: #FFFFFF;
                 color: #212529;
             }
-            QLineEdit:focus, QTextEdit:focus, QSpinBox:focus, QComboBox:focus {
+            QLineEdit:focus, QTextEdit:focus, QPlainTextEdit:focus, QSpinBox:focus, QComboBox:focus {
                 border-color: #28A745;
             }
             QPushButton {
@@ -628,7 +1012,7 @@ class ConfigGUI(QMainWindow):
                 spacing: 8px;
                 color: #212529;
             }
-            QTextEdit[readOnly="true"] {
+            QTextEdit[readOnly="true"], QPlainTextEdit[readOnly="true"] {
                 background-color: #F8F9FA;
                 color: #212529;
                 border: 1px solid #CED4DA;